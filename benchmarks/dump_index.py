@@ -0,0 +1,112 @@
+"""
+Build a WikidataDump index from a synthetic bz2 dump, then time its lookups.
+The synthetic dump follows the format of the real ones (a JSON array with one entity per line), so it also serves
+as a small fixture to try the offline mode of RelationshipExtractor.
+
+Usage:
+    python benchmarks/dump_index.py [--items N] [--properties N] [--keep DIR]
+"""
+import argparse
+import bz2
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wikidata_dump import WikidataDump
+
+
+def snak(prop_id, datatype, datavalue):
+    return {"snaktype": "value", "property": prop_id, "datatype": datatype, "datavalue": datavalue}
+
+
+def synthetic_entities(n_items, n_properties, seed=0):
+    """ Yield properties then items, with labels, aliases, sitelinks and claims of the usual DataValue types """
+    rnd = random.Random(seed)
+    for pid in range(1, n_properties + 1):
+        yield {"type": "property", "id": "P{}".format(pid), "datatype": "wikibase-item",
+               "labels": {"en": {"language": "en", "value": "property {}".format(pid)}}, "claims": {}}
+    for qid in range(1, n_items + 1):
+        claims = {}
+        for pid in rnd.sample(range(1, n_properties + 1), min(n_properties, rnd.randint(5, 30))):
+            prop_id, kind = "P{}".format(pid), pid % 3
+            if kind == 0:
+                target = rnd.randint(1, n_items)
+                value = snak(prop_id, "wikibase-item", {"type": "wikibase-entityid", "value": {
+                    "entity-type": "item", "numeric-id": target, "id": "Q{}".format(target)}})
+            elif kind == 1:
+                value = snak(prop_id, "string", {"type": "string", "value": "value {}".format(rnd.randint(1, 1000))})
+            else:
+                value = snak(prop_id, "quantity", {"type": "quantity", "value": {
+                    "amount": "+{}".format(rnd.randint(1, 10 ** 6)), "unit": "1"}})
+            claims[prop_id] = [{"mainsnak": value, "type": "statement", "rank": "normal",
+                                "references": [{"hash": "%040x" % rnd.getrandbits(160)}]}]
+        yield {"type": "item", "id": "Q{}".format(qid),
+               "labels": {"en": {"language": "en", "value": "item {}".format(qid % (n_items // 2 or 1))}},
+               "aliases": {"en": [{"language": "en", "value": "alias {}".format(qid)}]},
+               "sitelinks": {"wiki{}".format(i): {} for i in range(qid * 4 // n_items)}, "claims": claims}
+
+
+def write_dump(path, n_items, n_properties):
+    with bz2.open(path, "wt", encoding="utf-8") as f:
+        f.write("[\n")
+        for idx, ent in enumerate(synthetic_entities(n_items, n_properties)):
+            f.write((",\n" if idx else "") + json.dumps(ent))
+        f.write("\n]\n")
+
+
+def per_call_us(fn, args):
+    start = time.perf_counter()
+    for arg in args:
+        fn(arg)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--properties", type=int, default=300)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--keep", help="Directory where the dump and the index are kept, a temporary one otherwise")
+    args = parser.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp()
+    os.makedirs(directory, exist_ok=True)
+    dump_path, index_path = os.path.join(directory, "dump.json.bz2"), os.path.join(directory, "dump.db")
+    try:
+        write_dump(dump_path, args.items, args.properties)
+
+        start = time.perf_counter()
+        dump = WikidataDump.build(dump_path, index_path)
+        elapsed = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 2 ** 10  # Bounded whatever the size of the dump
+
+        entities = args.items + args.properties
+        print("dump MB\tindex MB\tbuild s\tentities/s\tpeak RSS MB")
+        print("{:.1f}\t{:.1f}\t{:.2f}\t{:.0f}\t{:.1f}".format(os.path.getsize(dump_path) / 2 ** 20,
+                                                            os.path.getsize(index_path) / 2 ** 20, elapsed,
+                                                            entities / elapsed, peak / 2 ** 20))
+
+        rnd = random.Random(1)
+        assert dump.search("Item 1") == "Q{}".format(args.items // 2 + 1)  # Homonyms: most sitelinks first
+        assert dump.search("alias 7") == "Q7" and dump.search("missing") is None
+        names = ["item {}".format(rnd.randint(1, args.items // 2 - 1)) for _ in range(args.lookups)]
+        ids = ["Q{}".format(rnd.randint(1, args.items)) for _ in range(args.lookups)]
+        props = [["P{}".format(rnd.randint(1, args.properties)) for _ in range(20)] for _ in range(args.lookups // 20)]
+        print("\nlookup\tus/call")
+        print("search\t{:.1f}".format(per_call_us(dump.search, names)))
+        print("claims\t{:.1f}".format(per_call_us(dump.claims, ids)))
+        print("labels\t{:.1f}\t(20 ids)".format(per_call_us(dump.labels, props)))
+        dump.close()
+    finally:
+        if not args.keep: shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
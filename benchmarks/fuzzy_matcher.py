@@ -0,0 +1,94 @@
+"""
+Compare the all-pairs difflib scan that find_similarities used to run with the TrigramIndex matcher,
+on a synthetic item, in both modes. Both must return the same results.
+
+Usage:
+    python benchmarks/fuzzy_matcher.py [--props N] [--values N] [--queries N]
+"""
+import argparse
+import difflib
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fuzzy_index import TrigramIndex
+
+
+def comparison_strategy(s1, s2):
+    return (difflib.SequenceMatcher(None, s1.lower(), s2.lower()).ratio()) > 0.9
+
+
+def scan_find_similarities(prop_d, to_find, mode):
+    """ find_similarities before the index: every value (or propriety) is compared with to_find """
+    results = []
+    for prop_name, value in prop_d.items():
+        for value_name in value:
+            if mode and comparison_strategy(to_find, value_name):
+                results.append(prop_name)
+            elif not mode and comparison_strategy(to_find, prop_name):
+                results.append(value_name)
+    return results
+
+
+def index_find_similarities(index, prop_d, to_find, mode):
+    matched = index.match(to_find)
+    results = []
+    for prop_name, value in prop_d.items():
+        for value_name in value:
+            if mode and value_name in matched:
+                results.append(prop_name)
+            elif not mode and prop_name in matched:
+                results.append(value_name)
+    return results
+
+
+def synthetic_item(n_props, n_values, rnd):
+    def name():
+        return " ".join("".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 9)))
+                        for _ in range(rnd.randint(1, 3)))
+    return {name(): {name() for _ in range(rnd.randint(1, n_values))} for _ in range(n_props)}
+
+
+def typo(s, rnd):
+    idx = rnd.randrange(len(s))
+    return s[:idx] + rnd.choice(string.ascii_lowercase) + s[idx + 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--props", type=int, default=300)
+    parser.add_argument("--values", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    prop_d = synthetic_item(args.props, args.values, rnd)
+    values = [v for value in prop_d.values() for v in value]
+
+    print("mode\tstrings\tqueries\tscan s\tindex s\tbuild s\tspeedup")
+    for mode in (1, 0):
+        strings = values if mode else list(prop_d)
+        queries = [typo(rnd.choice(strings), rnd) if rnd.random() < 0.5 else rnd.choice(strings).upper()
+                   for _ in range(args.queries)]
+
+        start = time.perf_counter()
+        expected = [scan_find_similarities(prop_d, q, mode) for q in queries]
+        scan = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = TrigramIndex(strings)
+        build = time.perf_counter() - start
+        got = [index_find_similarities(index, prop_d, q, mode) for q in queries]
+        indexed = time.perf_counter() - start
+
+        assert got == expected, "TrigramIndex results differ from the scan"
+        print("{}\t{}\t{}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.1f}x".format(mode, len(strings), len(queries), scan, indexed,
+                                                                 build, scan / indexed))
+
+
+if __name__ == "__main__":
+    main()
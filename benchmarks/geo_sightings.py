@@ -0,0 +1,156 @@
+"""
+Writes and lookups of location_people sightings: the historical users table, with TEXT coordinates and only the
+(timestamp, user_id) key, against SightingStore and its R*Tree. Sightings are scattered around synthetic cities
+over one year, the lookups are "who was within R km of a point during the last week" and alike.
+
+Usage:
+    python benchmarks/geo_sightings.py [--sightings N] [--cities N] [--queries N] [--batch N]
+"""
+import argparse
+import datetime
+import math
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sightings import SightingStore, haversine, KM_PER_DEGREE
+
+START = 1546300800  # 2019-01-01
+YEAR = 365 * 24 * 3600
+WEEK = 7 * 24 * 3600
+
+
+def synthetic_cities(n_cities, seed=0):
+    rnd = random.Random(seed)
+    return [(rnd.uniform(-60, 70), rnd.uniform(-180, 180)) for _ in range(n_cities)]
+
+
+def synthetic_sightings(n, n_cities, seed=0):
+    """ Yields (taken_at, placename, lat, lng, user_id, nickname, fullname, city_id, city_name) """
+    rnd = random.Random(seed)
+    cities = synthetic_cities(n_cities)
+    for idx in range(n):
+        city = min(int(rnd.paretovariate(1.0)) - 1, n_cities - 1)  # A few large cities
+        lat, lng = cities[city]
+        user = rnd.randrange(n // 3)
+        yield (START + rnd.randrange(YEAR), "place_{}".format(idx % 5000), lat + rnd.gauss(0, 0.05),
+               lng + rnd.gauss(0, 0.05), str(user), "user_{}".format(user), "User {}".format(user), str(city),
+               "city_{}".format(city))
+
+
+def legacy_insert(db, rows):
+    """ location_people before SightingStore: TEXT columns, local time strings """
+    db.executemany('''
+        INSERT OR IGNORE INTO users(timestamp, placename, lat, lng, user_id, nickname, fullname, city_id, city_name)
+        VALUES(?,?,?,?,?,?,?,?,?)''', [(datetime.datetime.fromtimestamp(row[0]).strftime('%Y-%m-%d %H:%M:%S'),) +
+                                       tuple(str(value) for value in row[1:]) for row in rows])
+    db.commit()
+
+
+def legacy_near(db, lat, lng, radius_km, since, until):
+    """ The same lookup without spatial index: the time range comes from the key, the coordinates are cast """
+    delta_lat = radius_km / KM_PER_DEGREE
+    delta_lng = delta_lat / math.cos(math.radians(lat))
+    rows = db.execute('''SELECT * FROM users WHERE timestamp BETWEEN ? AND ?
+                         AND CAST(lat AS REAL) BETWEEN ? AND ? AND CAST(lng AS REAL) BETWEEN ? AND ?''',
+                      (since, until, lat - delta_lat, lat + delta_lat, lng - delta_lng, lng + delta_lng)).fetchall()
+    return [row for row in rows if haversine(lat, lng, float(row[2]), float(row[3])) <= radius_km]
+
+
+def legacy_bbox(db, min_lat, min_lng, max_lat, max_lng):
+    return db.execute('''SELECT * FROM users WHERE CAST(lat AS REAL) BETWEEN ? AND ? AND CAST(lng AS REAL) BETWEEN ? AND ?
+                         ORDER BY timestamp''', (min_lat, max_lat, min_lng, max_lng)).fetchall()
+
+
+def per_query(fn, args_list):
+    start = time.perf_counter()
+    results = [fn(*args) for args in args_list]
+    return results, (time.perf_counter() - start) / len(args_list)
+
+
+def local(seconds):
+    return datetime.datetime.fromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sightings", type=int, default=3000000)
+    parser.add_argument("--cities", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=500, help="Sightings per transaction, as in location_people")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        legacy = sqlite3.connect(os.path.join(directory, "legacy.db"))
+        legacy.execute('''
+            CREATE TABLE IF NOT EXISTS users(timestamp TEXT, placename TEXT, lat TEXT, lng TEXT, user_id TEXT, nickname TEXT, fullname TEXT, city_id TEXT, city_name TEXT, PRIMARY KEY (timestamp, user_id))
+        ''')
+        store = SightingStore(os.path.join(directory, "sightings.db"))
+
+        timings = {"legacy": 0.0, "store": 0.0}
+        batch = []
+        for row in synthetic_sightings(args.sightings, args.cities):
+            batch.append(row)
+            if len(batch) >= args.batch:
+                start = time.perf_counter()
+                legacy_insert(legacy, batch)
+                timings["legacy"] += time.perf_counter() - start
+                start = time.perf_counter()
+                store.insert(batch)
+                timings["store"] += time.perf_counter() - start
+                batch = []
+        legacy_insert(legacy, batch)
+        store.insert(batch)
+        print("{} sightings\n".format(args.sightings))
+        print("lookup\t\t\tlegacy s\tstore s\t\trows")
+        print("insert /1M\t\t{:.2f}\t\t{:.2f}".format(timings["legacy"] / args.sightings * 1e6,
+                                                       timings["store"] / args.sightings * 1e6))
+
+        rnd = random.Random(1)
+        centers = [(lat + rnd.gauss(0, 0.05), lng + rnd.gauss(0, 0.05))
+                   for lat, lng in rnd.choices(synthetic_cities(args.cities)[:20], k=args.queries)]
+        weeks = [START + rnd.randrange(YEAR - WEEK) for _ in range(args.queries)]
+        near = [(lat, lng, 2.0, week, week + WEEK) for (lat, lng), week in zip(centers, weeks)]
+        new, new_time = per_query(store.near, near)
+        old, old_time = per_query(legacy_near, [(legacy, lat, lng, r, local(since), local(until))
+                                                for lat, lng, r, since, until in near])
+        assert [len(rows) for rows in new] == [len(rows) for rows in old]
+        print("2 km, one week\t\t{:.4f}\t\t{:.4f}\t\t{:.1f}".format(old_time, new_time,
+                                                                   sum(map(len, new)) / len(new)))
+
+        boxes = [(lat - 0.02, lng - 0.02, lat + 0.02, lng + 0.02) for lat, lng in centers[:10]]
+        new, new_time = per_query(store.in_bbox, boxes)
+        old, old_time = per_query(legacy_bbox, [(legacy,) + box for box in boxes])
+        assert [len(rows) for rows in new] == [len(rows) for rows in old]
+        print("bbox, all time\t\t{:.4f}\t\t{:.4f}\t\t{:.1f}".format(old_time, new_time, sum(map(len, new)) / len(new)))
+
+        windows = [(week, week + 3600) for week in weeks[:10]]
+        new, new_time = per_query(store.in_window, windows)
+        old, old_time = per_query(lambda since, until: legacy.execute(
+            'SELECT * FROM users WHERE timestamp BETWEEN ? AND ?', (since, until)).fetchall(),
+            [(local(since), local(until)) for since, until in windows])
+        assert [len(rows) for rows in new] == [len(rows) for rows in old]
+        print("one hour\t\t{:.4f}\t\t{:.4f}\t\t{:.1f}".format(old_time, new_time, sum(map(len, new)) / len(new)))
+
+        new, new_time = per_query(store.city_stats, [(weeks[0], weeks[0] + 30 * 24 * 3600)])
+        old, old_time = per_query(lambda since, until: legacy.execute(
+            '''SELECT city_id, COUNT(*), COUNT(DISTINCT user_id), AVG(CAST(lat AS REAL)) FROM users
+               WHERE timestamp BETWEEN ? AND ? GROUP BY city_id''', (since, until)).fetchall(),
+            [(local(weeks[0]), local(weeks[0] + 30 * 24 * 3600))])
+        assert len(new[0]) == len(old[0])
+        print("cities, one month\t{:.4f}\t\t{:.4f}\t\t{}".format(old_time, new_time, len(new[0])))
+        legacy.close()
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+DegreeGraph against SQL over a synthetic degree table: load and incremental refresh time, memory,
+degrees of separation, top mentioned users, connected components and PageRank.
+Mentioned users follow a power law, as popular accounts are mentioned by many.
+
+Usage:
+    python benchmarks/graph_analytics.py [--edges N] [--users N] [--refresh N] [--queries N]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from degree_graph import DegreeGraph
+
+
+def synthetic_edges(n_edges, n_users, seed):
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, n_users, n_edges)
+    destinations = np.minimum(rng.zipf(1.6, n_edges) - 1, n_users - 1)
+    destinations = (destinations * 7919 + seed) % n_users  # Popular users are not the smallest ids
+    return zip(sources.astype(str).tolist(), destinations.astype(str).tolist())
+
+
+def populate(path, n_edges, n_users, seed=0):
+    db = sqlite3.connect(path)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS degree(source TEXT, refered TEXT, PRIMARY KEY(source, refered));
+        CREATE INDEX IF NOT EXISTS degree_refered ON degree(refered);
+    ''')
+    with db:
+        db.executemany('INSERT OR IGNORE INTO degree(source, refered) VALUES(?,?)',
+                       synthetic_edges(n_edges, n_users, seed))
+    n = db.execute('SELECT COUNT(*) FROM degree').fetchone()[0]
+    db.close()
+    return n
+
+
+def sql_distance(db, a, b):
+    """ Degrees of separation as it can be done without the graph: one query per node visited """
+    seen, queue = {a: 0}, deque([a])
+    while queue:
+        node = queue.popleft()
+        for refered, in db.execute('SELECT refered FROM degree WHERE source = ?', (node,)):
+            if refered not in seen:
+                seen[refered] = seen[node] + 1
+                if refered == b: return seen[refered]
+                queue.append(refered)
+    return None
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--edges", type=int, default=2000000)
+    parser.add_argument("--users", type=int, default=500000)
+    parser.add_argument("--refresh", type=int, default=20000, help="Edges inserted before the refresh")
+    parser.add_argument("--queries", type=int, default=20, help="Shortest paths computed")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "degree.db")
+        n, elapsed = timed(populate, path, args.edges, args.users)
+        print("degree table of {} edges built in {:.1f} s\n".format(n, elapsed))
+
+        graph, elapsed = timed(DegreeGraph, path)
+        tracemalloc.start()  # Measured on a second load, as tracing slows it down
+        del graph
+        graph = DegreeGraph(path)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        arrays = sum(a.nbytes for a in (graph.offsets, graph.targets, graph.rev_offsets, graph.rev_targets))
+        print("load\t\t{:.2f} s\t{} users, {} edges, CSR {:.0f} MB, total {:.0f} MB, peak {:.0f} MB".format(
+            elapsed, len(graph), graph.edges, arrays / 2 ** 20, size / 2 ** 20, peak / 2 ** 20))
+
+        populate(path, args.refresh, args.users, seed=1)
+        added, elapsed = timed(graph.refresh)
+        print("refresh\t\t{:.2f} s\t{} new edges".format(elapsed, added))
+
+        db = sqlite3.connect(path)
+        rnd = random.Random(0)
+        sources = [graph.users[idx] for idx in np.flatnonzero(graph.out_degree()).tolist()]
+        pairs = [(rnd.choice(sources), rnd.choice(graph.users)) for _ in range(args.queries)]
+        start = time.perf_counter()
+        lengths = [graph.shortest_path(a, b) for a, b in pairs]
+        graph_time = (time.perf_counter() - start) / len(pairs)
+        start = time.perf_counter()
+        sql = [sql_distance(db, a, b) for a, b in pairs[:3]]
+        sql_time = (time.perf_counter() - start) / 3
+        assert sql == [len(p) - 1 if p else None for p in lengths[:3]]
+        print("path\t\t{:.4f} s\tSQL BFS {:.4f} s per query".format(graph_time, sql_time))
+
+        top, elapsed = timed(graph.top, 10)
+        sql, sql_time = timed(lambda: db.execute('''SELECT refered, COUNT(*) FROM degree WHERE refered IS NOT NULL
+                                                    GROUP BY refered ORDER BY 2 DESC LIMIT 10''').fetchall())
+        assert [d for _, d in top] == [d for _, d in sql]
+        print("top 10\t\t{:.4f} s\tSQL GROUP BY {:.2f} s".format(elapsed, sql_time))
+
+        sizes, elapsed = timed(graph.component_sizes, 3)
+        print("components\t{:.2f} s\tlargest {}".format(elapsed, sizes))
+        ranks, elapsed = timed(graph.top_pagerank, 3)
+        print("pagerank\t{:.2f} s\ttop {}".format(elapsed, [(u, round(r, 4)) for u, r in ranks]))
+        db.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Build time and resident memory of MarkovPy for chains of order 1 to 4 on the same corpus.
+Every order is built in a fresh interpreter so that the memory of one run does not leak into the next.
+
+Usage:
+    python benchmarks/markov_orders.py [corpus.txt] [--words N]
+"""
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from markov import MarkovPy
+
+ORDERS = (1, 2, 3, 4)
+
+
+def rss_mb():
+    """ Current resident set size in MB, peak RSS where /proc is not available """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def synthetic_corpus(n_words, seed=0):
+    """ Yield lines of Zipf-distributed words, to benchmark without a real corpus """
+    rnd = random.Random(seed)
+    vocab = ["w{}".format(i) for i in range(20000)] + list(".,!?;")
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(vocab))))
+    for _ in range(n_words // 20):
+        yield " ".join(rnd.choices(vocab, cum_weights=cum_weights, k=20)) + "\n"
+
+
+def run_order(order, corpus, n_words):
+    """ Build a single model and print build time, memory and size of the table """
+    source = open(corpus) if corpus else synthetic_corpus(n_words)
+    lines = list(source)
+    before = rss_mb()
+    start = time.perf_counter()
+    model = MarkovPy(lines, order=order, compact=True)
+    model.transitions.compile()
+    elapsed = time.perf_counter() - start
+    del lines
+    states = sum(len(level[0]) for level in model.transitions.levels)
+    print("{}\t{:.2f}\t{:.1f}\t{}\t{}".format(order, elapsed, rss_mb() - before, len(model.words), states))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="?", help="Text file to train on, a synthetic corpus is used otherwise")
+    parser.add_argument("--words", type=int, default=1000000, help="Size of the synthetic corpus")
+    parser.add_argument("--order", type=int, help=argparse.SUPPRESS)  # Single run, used by the child processes
+    args = parser.parse_args()
+
+    if args.order:
+        run_order(args.order, args.corpus, args.words)
+        return
+
+    print("order\tbuild s\tRSS MB\twords\tstates")
+    for order in ORDERS:
+        cmd = [sys.executable, os.path.abspath(__file__), "--order", str(order), "--words", str(args.words)]
+        if args.corpus: cmd.append(args.corpus)
+        sys.stdout.write(subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout)
+
+
+if __name__ == "__main__":
+    main()
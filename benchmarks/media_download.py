@@ -0,0 +1,103 @@
+"""
+MediaDownloader against the replay server: throughput compared with a serial requests.get(url).content loop,
+then the guarantees it gives, each checked against the content the server serves:
+reposts stored once, downloads cut halfway resumed with Range requests, partial files of an interrupted run
+resumed, and a second run answered from the manifest without any request.
+
+Usage:
+    python benchmarks/media_download.py [--users N] [--stories N] [--size BYTES] [--latency S] [--concurrency N]
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instagram_stories import Stories
+from media_downloader import MediaDownloader
+from replay_server import ReplayServer
+
+
+def serial_download(stories, directory):
+    """ The separate downloader used so far: one request at a time, whole media in memory, one file per media_id """
+    for story in stories:
+        with open(os.path.join(directory, str(story.media_id)), "wb") as f:
+            f.write(requests.get(story.url).content)
+
+
+def check(downloader, server, stories):
+    """ Every media is in the manifest with the content served for its URL """
+    for story in stories:
+        with open(downloader.path(story.media_id), "rb") as f:
+            content = f.read()
+        key = story.url.rsplit("/", 1)[1].split(".")[0]
+        assert content == server.media_content(key), story.media_id
+    objects = sum(len(files) for _, _, files in os.walk(os.path.join(downloader.directory, "objects")))
+    return objects
+
+
+def run(label, server, stories, directory, concurrency, max_attempts=5, **options):
+    server.reset(**options)
+    downloader = MediaDownloader(directory, concurrency=concurrency, max_attempts=max_attempts)
+    start = time.perf_counter()
+    stats = downloader.download(stories)
+    elapsed = time.perf_counter() - start
+    objects = check(downloader, server, stories) if not stats["failed"] else None
+    print("{:<24}{:.2f} s\t{}\tfiles {}\tstatuses {}".format(label, elapsed, stats, objects, dict(server.statuses)))
+    downloader.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--stories", type=int, default=6, help="Stories per user")
+    parser.add_argument("--size", type=int, default=2 * 2 ** 20, help="Bytes per media")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    server = ReplayServer(stories=args.stories, media_size=args.size, latency=args.latency).start()
+    stories = [Stories(element) for user in range(1, args.users + 1) for element in server.scale_stories(user)]
+    directory = tempfile.mkdtemp()
+    try:
+        print("{} stories, {} distinct media of {} bytes\n".format(len(stories), len(server.reel["items"]), args.size))
+        serial = os.path.join(directory, "serial")
+        os.makedirs(serial)
+        start = time.perf_counter()
+        serial_download(stories, serial)
+        print("{:<24}{:.2f} s\tfiles {}".format("serial", time.perf_counter() - start, len(os.listdir(serial))))
+
+        stats = run("downloader", server, stories, os.path.join(directory, "clean"), args.concurrency)
+        assert stats["downloaded"] == len(server.reel["items"])
+
+        stats = run("cut connections", server, stories, os.path.join(directory, "cut"), args.concurrency,
+                    max_attempts=20, truncate_rate=0.3)  # 5 cuts in a row are not rare among 120 downloads
+        assert stats["failed"] == 0 and server.statuses[206] > 0
+
+        resumed = os.path.join(directory, "resumed")
+        os.makedirs(os.path.join(resumed, "partial"))
+        for story in stories[:5]:  # Interrupted run: the first half of some media already on disk
+            key = story.url.rsplit("/", 1)[1].split(".")[0]
+            with open(os.path.join(resumed, "partial", str(story.media_id) + ".part"), "wb") as f:
+                f.write(server.media_content(key)[:args.size // 2])
+        run("interrupted run", server, stories, resumed, args.concurrency, truncate_rate=0.0)
+        assert server.statuses[206] == 5
+
+        stats = run("second run", server, stories, resumed, args.concurrency)
+        assert stats["known"] == len(stories) and not server.counts["media"]
+        digest = hashlib.sha256(server.media_content("recorded_0")).hexdigest()
+        assert any(digest in name for _, _, files in os.walk(resumed) for name in files)
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
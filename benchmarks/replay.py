@@ -0,0 +1,203 @@
+"""
+Replay benchmark of the fetch paths: RelationshipExtractor.extract, InstagramStories.users_stories,
+location_people and save_stories, against the local stand-in server of replay_server.py.
+Every scenario runs in a fresh interpreter, reporting throughput, p50/p99 latency, requests and peak memory.
+The results are saved as JSON so that two commits can be compared with --compare.
+
+Usage:
+    python benchmarks/replay.py [--items N] [--users N] [--stories N] [--locations N] [--latency S]
+                                [--error-rate P] [--throttle-rate P] [--out results.json] [--compare old.json]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from replay_server import ReplayServer, load_fixture, scale_stories
+
+SCENARIOS = ("extract", "users_stories", "location_people", "save_stories")
+
+
+def percentile(samples, q):
+    """ Nearest-rank percentile of a non-empty list """
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+def timed(fn, latencies):
+    def wrapper(*args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def batches(seq, size):
+    return [seq[start:start + size] for start in range(0, len(seq), size)]
+
+
+def instagram(args):
+    """ InstagramStories throttled with a token bucket if --rate, as usual if --delay, not at all otherwise """
+    from instagram_stories import InstagramStories
+    from request_scheduler import RequestScheduler, TokenBucket
+    policy = TokenBucket(args.rate, burst=args.concurrency, jitter=args.jitter) if args.rate else None
+    ig = InstagramStories(RequestScheduler(concurrency=args.concurrency, policy=policy, backoff=0.1))
+    ig.base_url, ig.cookie, ig.DELAY_REQUESTS = args.url, {}, args.delay or bool(args.rate)
+    return ig
+
+
+def run_extract(args, directory, latencies):
+    """
+    Returns:
+        units (int): Units processed, here (item, relation) pairs.
+        errors (int): Units that failed, here pairs whose extract raised.
+    """
+    from relationship_extractor import RelationshipExtractor
+    extractor = RelationshipExtractor(args.url)
+    extractor.extract = timed(extractor.extract, latencies)
+    pairs = [("item {}".format(idx), "politician") for idx in range(1, args.items + 1)]
+    errors = sum(error is not None for _, _, error in extractor.extract_many(pairs, concurrency=args.concurrency))
+    return len(pairs), errors
+
+
+def run_users_stories(args, directory, latencies):
+    """ One unit is one user, timed by batches of args.batch users. Errors are the stories not retrieved """
+    ig = instagram(args)
+    ids = list(range(1, args.users + 1))
+    users_stories = timed(ig.users_stories, latencies)
+    for batch in batches(ids, args.batch):
+        users_stories(batch)
+    return len(ids), args.users * args.stories - len(ig.res)
+
+
+def run_location_people(args, directory, latencies):
+    """ One unit is one location, timed by batches of args.batch locations """
+    ig = instagram(args)
+    ig.db_path = os.path.join(directory, "locations.db")
+    locations = [(idx, "location {}".format(idx)) for idx in range(1, args.locations + 1)]
+    location_people = timed(ig.location_people, latencies)
+    for batch in batches(locations, args.batch):
+        location_people(batch)
+    return len(locations), 0
+
+
+def run_save_stories(args, directory, latencies):
+    """ One unit is one story: users * stories stories saved by batches of 100, twice to also time the dedup """
+    from instagram_stories import Stories
+    recorded = load_fixture("instagram_reel_media")["items"]
+    stories = [Stories(item) for user in range(1, args.users + 1) for item in scale_stories(recorded, args.stories, user)]
+
+    ig = instagram(args)
+    ig.basefolder, ig.db_seen = directory, os.path.join(directory, "seen.db")
+    save_stories = timed(ig.save_stories, latencies)
+    for _ in range(2):
+        for batch in batches(stories, 100):
+            save_stories(batch)
+    return 2 * len(stories), 0
+
+
+def run_scenario(args):
+    """ Child process: run a single scenario and print its results as JSON """
+    latencies = []
+    directory = tempfile.mkdtemp()
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # The pipelines are chatty
+            units, errors = globals()["run_" + args.scenario](args, directory, latencies)
+    finally:
+        shutil.rmtree(directory)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "units": units, "errors": errors, "seconds": elapsed, "throughput": units / elapsed,
+        "p50": percentile(latencies, 50), "p99": percentile(latencies, 99),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10}))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    with open(path) as f:
+        old = json.load(f)
+    print("\nvs {}\nscenario\tthroughput\tp99".format(old.get("commit") or path))
+    for name, result in results.items():
+        before = old["results"].get(name)
+        if not before: continue
+        print("{:<16}{:+.1%}\t\t{:+.1%}".format(name, result["throughput"] / before["throughput"] - 1,
+                                                  result["p99"] / before["p99"] - 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--items", type=int, default=50, help="Wikidata items to extract")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--stories", type=int, default=5, help="Stories per user and per location")
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=1, help="Users or locations per call, the unit of latency")
+    parser.add_argument("--concurrency", type=int, default=1, help="Requests sent at the same time")
+    parser.add_argument("--delay", action="store_true", help="Keep the random delay between Instagram requests")
+    parser.add_argument("--rate", type=float, help="Instagram requests per second, with a token bucket")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--out", help="JSON file where the results are saved")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)  # Single run, used by the child processes
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_scenario(args)
+        return
+
+    server = ReplayServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          throttle_rate=args.throttle_rate, retry_after=args.retry_after, stories=args.stories).start()
+    results = {}
+    print("scenario\tunits/s\tp50 ms\tp99 ms\trequests\tnon-200\terrors\tRSS MB")
+    try:
+        for name in args.scenarios:
+            server.reset()
+            cmd = [sys.executable, os.path.abspath(__file__), "--scenario", name, "--url", server.url] + sys.argv[1:]
+            result = json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True,
+                                               check=True).stdout.splitlines()[-1])
+            result["requests"] = dict(server.counts)
+            result["statuses"] = {str(status): n for status, n in server.statuses.items()}
+            results[name] = result
+            print("{:<16}{:.1f}\t{:.1f}\t{:.1f}\t{}\t\t{}\t{}\t{:.1f}".format(
+                name, result["throughput"], result["p50"] * 1000, result["p99"] * 1000,
+                sum(result["requests"].values()), sum(server.statuses.values()) - server.statuses[200],
+                result["errors"], result["peak_rss_mb"]))
+    finally:
+        server.stop()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"commit": git_commit(), "date": datetime.datetime.now().isoformat(),
+                       "params": {name: value for name, value in vars(args).items()
+                                  if name not in ("out", "compare", "scenario", "url")},
+                       "results": results}, f, indent=2)
+    if args.compare: compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Local stand-in for the Wikidata and Instagram APIs, replaying the recorded responses of benchmarks/fixtures.
+Responses are scaled (one item per searched keyword, n stories per user or location) and the server can inject
+latency, server errors and 429 Too Many Requests with a Retry-After header.
+With media_size, the stories point to media served by the server itself, honouring Range requests: the same
+recorded story reposted by many users has the same content under different URLs, and a share of the responses
+can be cut short to exercise resumed downloads.
+"""
+import copy
+import gzip
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name + ".json")) as f:
+        return json.load(f)
+
+
+def scale_stories(recorded, n, owner):
+    """
+    Args:
+        recorded (List): Recorded stories.
+        n (int): Number of stories to return, cycling over the recorded ones.
+        owner (int): User or location the stories belong to, their ids are unique to it.
+    Returns:
+        stories (List): Instagram-provided dictionaries of the stories.
+    """
+    items = []
+    for idx in range(n):
+        story = copy.deepcopy(recorded[idx % len(recorded)])
+        story["pk"] = owner * 1000 + idx
+        story["id"] = "{}_{}".format(story["pk"], owner)
+        story["user"] = dict(story["user"], pk=owner, username="user_{}".format(owner))
+        items.append(story)
+    return items
+
+
+class ReplayServer:
+    """ Threaded HTTP server answering from the fixtures, counting the requests per endpoint """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 stories=3, media_size=0, truncate_rate=0.0, gzip_media=False, failing=(), seed=0):
+        """
+        Args:
+            latency (float): Seconds added before every response.
+            jitter (float): Maximum random seconds added on top of latency.
+            error_rate (float): Probability of answering 500, with an HTML body.
+            throttle_rate (float): Probability of answering 429 with a Retry-After header.
+            retry_after (int): Seconds of the Retry-After header.
+            stories (int): Stories per user and per location.
+            media_size (int): Bytes of the media served under /media/, 0 to keep the recorded CDN URLs.
+            truncate_rate (float): Probability of closing the connection halfway through a media.
+            gzip_media (Bool): Compress the media for the clients accepting gzip, as some CDNs do.
+            failing (Tuple): Endpoints always answered with 500, e.g. ("wikidata_labels",).
+            seed (int): Seed of the random errors and delays.
+        """
+        self.latency, self.jitter = latency, jitter
+        self.error_rate, self.throttle_rate, self.retry_after = error_rate, throttle_rate, retry_after
+        self.stories = stories
+        self.media_size, self.truncate_rate, self.gzip_media = media_size, truncate_rate, gzip_media
+        self.failing = failing
+        self.media = {}  # Key -> Content
+        self.rnd = random.Random(seed)
+        self.counts = Counter()  # Endpoint -> Requests
+        self.statuses = Counter()  # Status code -> Responses
+        self.lock = threading.Lock()
+
+        self.search = load_fixture("wikidata_search")
+        self.entity = next(iter(load_fixture("wikidata_entity")["entities"].values()))
+        self.labels = load_fixture("wikidata_labels")["entities"]
+        self.reel = load_fixture("instagram_reel_media")
+        self.location_feed = load_fixture("instagram_location_feed")
+        self.places = load_fixture("instagram_places")
+        self.throttled = load_fixture("instagram_throttled")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset(self, **options):
+        """ Clear the counters and change the options (latency, error_rate, stories...) """
+        with self.lock:
+            self.counts.clear()
+            self.statuses.clear()
+            for name, value in options.items():
+                setattr(self, name, value)
+
+    def fault(self):
+        """ Draw the delay and the injected status (None for a normal response) of a request """
+        with self.lock:
+            delay = self.latency + self.rnd.random() * self.jitter
+            draw = self.rnd.random()
+        if draw < self.throttle_rate: return delay, 429
+        if draw < self.throttle_rate + self.error_rate: return delay, 500
+        return delay, None
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, as the real APIs
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.startswith("/media/"): return self.send_media(url.path[len("/media/"):])
+                endpoint, body = server.route(url.path, parse_qs(url.query))
+                delay, status = server.fault()
+                if endpoint in server.failing: status = 500
+                if delay: time.sleep(delay)
+                headers = {}
+                if endpoint is None:
+                    status, body = 404, {"error": "not found"}
+                elif status == 429:
+                    body, headers = server.throttled, {"Retry-After": str(server.retry_after)}
+                with server.lock:
+                    server.counts[endpoint] += 1
+                    server.statuses[status or 200] += 1
+
+                content_type = "application/json"
+                if status == 500:  # An error page of the gateway, as the real APIs send
+                    data, content_type = b"<html><body><h1>500 Internal Server Error</h1></body></html>", "text/html"
+                else:
+                    data = json.dumps(body).encode("utf-8")
+                self.send_response(status or 200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_media(self, name):
+                data = server.media_content(name.rsplit(".", 1)[0])
+                delay, status = server.fault()
+                if delay: time.sleep(delay)
+                match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+                start = int(match.group(1)) if match and not status else 0
+                if status is None and start >= len(data) > 0:
+                    status = 416
+                elif status is None:
+                    status = 206 if start else 200
+                with server.lock:
+                    server.counts["media"] += 1
+                    server.statuses[status] += 1
+                    truncate = status in (200, 206) and server.rnd.random() < server.truncate_rate
+
+                body = data[start:] if status in (200, 206) else b""
+                encoded = server.gzip_media and "gzip" in self.headers.get("Accept-Encoding", "")
+                if encoded: body = gzip.compress(body)
+                self.send_response(status)
+                self.send_header("Content-Type", "video/mp4" if name.endswith(".mp4") else "image/jpeg")
+                if encoded: self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Accept-Ranges", "bytes")
+                if status == 206:
+                    self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(data) - 1, len(data)))
+                if status == 416:
+                    self.send_header("Content-Range", "bytes */{}".format(len(data)))
+                if status == 429:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.end_headers()
+                if truncate:
+                    self.wfile.write(body[:len(body) // 2])
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        return Handler
+
+    def media_content(self, key):
+        """ Deterministic content of a media, shared by every URL of the same key """
+        with self.lock:
+            if key not in self.media:
+                self.media[key] = random.Random(key).randbytes(self.media_size)
+            return self.media[key]
+
+    def route(self, path, query):
+        """
+        Returns:
+            endpoint (string): Name of the endpoint, None if unknown.
+            body (dict): Response.
+        """
+        action = query.get("action", [None])[0]
+        if action == "wbsearchentities":  # "item N" is the item QN, anything else the recorded one
+            match = re.match(r"item (\d+)$", query["search"][0])
+            body = copy.deepcopy(self.search)
+            if match: body["search"][0]["id"] = "Q{}".format(match.group(1))
+            return "wikidata_search", body
+        if action == "wbgetentities":
+            entities = {}
+            for idd in query["ids"][0].split("|"):
+                entities[idd] = self.labels.get(idd) or {
+                    "type": "property" if idd[0] == "P" else "item", "id": idd,
+                    "labels": {"en": {"language": "en", "value": "label {}".format(idd)}}}
+            return "wikidata_labels", {"entities": entities, "success": 1}
+        match = re.match(r"/wiki/Special:EntityData/(\w+)\.json$", path)
+        if match:
+            entity = dict(self.entity, id=match.group(1), title=match.group(1))
+            return "wikidata_entity", {"entities": {match.group(1): entity}}
+
+        match = re.match(r"/api/v1/feed/user/(\d+)/reel_media/$", path)
+        if match:
+            user_id = int(match.group(1))
+            return "instagram_reel_media", dict(self.reel, id=user_id, items=self.scale_stories(user_id))
+        match = re.match(r"/api/v1/feed/location/(\d+)/$", path)
+        if match:
+            body = copy.deepcopy(self.location_feed)
+            body["story"]["items"] = self.scale_stories(int(match.group(1)))
+            return "instagram_location_feed", body
+        if path.startswith("/api/v1/fbsearch/places/"):
+            return "instagram_places", self.places
+        return None, None
+
+    def scale_stories(self, owner):
+        items = scale_stories(self.reel["items"], self.stories, owner)
+        if self.media_size:  # Reposts: the same recorded story has the same content, whoever posts it
+            for idx, story in enumerate(items):
+                url = "{}media/recorded_{}.{}?id={}".format(self.url, idx % len(self.reel["items"]),
+                                                         "mp4" if story["media_type"] == 2 else "jpg", story["id"])
+                if story["media_type"] == 2:
+                    story["video_versions"][0]["url"] = url
+                else:
+                    story["image_versions2"]["candidates"][0]["url"] = url
+        return items
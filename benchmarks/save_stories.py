@@ -0,0 +1,89 @@
+"""
+Dedup throughput of save_stories against a large seen table: the historical SELECT + INSERT per story,
+SeenIndex with IN batches, and SeenIndex with the Bloom prefilter.
+
+Usage:
+    python benchmarks/save_stories.py [--seen N] [--stories N] [--seen-ratio P] [--batch N]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seen_index import SeenIndex
+
+
+def populate(path, n_seen):
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE IF NOT EXISTS seen(media_id TEXT PRIMARY KEY)')
+    with db:
+        db.executemany('INSERT INTO seen(media_id) VALUES(?)', (("{}_1".format(idx),) for idx in range(n_seen)))
+    db.close()
+
+
+def legacy_claim(cursor, ids):
+    """ save_stories before SeenIndex: one SELECT, then one INSERT, per story """
+    new = set()
+    for media_id in ids:
+        cursor.execute("SELECT * FROM seen WHERE media_id = ?", (media_id,))
+        if cursor.fetchone(): continue
+        new.add(media_id)
+        cursor.execute('''INSERT OR IGNORE INTO seen(media_id) VALUES(?)''', (media_id,))
+    return new
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seen", type=int, default=2000000, help="Ids already in the seen table")
+    parser.add_argument("--stories", type=int, default=200000, help="Ids checked")
+    parser.add_argument("--seen-ratio", type=float, default=0.5, help="Share of the checked ids already seen")
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    checked = ["{}_1".format(rnd.randrange(args.seen)) if rnd.random() < args.seen_ratio else "{}_2".format(idx)
+               for idx in range(args.stories)]
+    batches = [checked[start:start + args.batch] for start in range(0, len(checked), args.batch)]
+
+    directory = tempfile.mkdtemp()
+    try:
+        template = os.path.join(directory, "template.db")
+        start = time.perf_counter()
+        populate(template, args.seen)
+        print("seen table of {} ids built in {:.1f} s\n".format(args.seen, time.perf_counter() - start))
+
+        print("method\t\tstories/s\topen s\tnew")
+        for name in ("legacy", "in_batches", "prefilter"):
+            path = os.path.join(directory, name + ".db")
+            shutil.copy(template, path)
+            start = time.perf_counter()
+            if name == "legacy":
+                db = sqlite3.connect(path)
+                cursor = db.cursor()
+            else:
+                seen = SeenIndex(path, prefilter=name == "prefilter")
+            opened = time.perf_counter() - start
+
+            start = time.perf_counter()
+            new = 0
+            for batch in batches:
+                if name == "legacy":
+                    new += len(legacy_claim(cursor, batch))
+                    db.commit()
+                else:
+                    new += len(seen.claim(batch))
+            elapsed = time.perf_counter() - start
+            (db if name == "legacy" else seen).close()
+            print("{:<12}\t{:.0f}\t\t{:.2f}\t{}".format(name, len(checked) / elapsed, opened, new))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
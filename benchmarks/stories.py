@@ -0,0 +1,106 @@
+"""
+Parse throughput and retained memory per object of Stories, against the eager __dict__ class it replaced.
+Payloads are the recorded stories of benchmarks/fixtures, each decoded from its own JSON text and then dropped,
+as when a response is parsed. Stories keeps nothing of the payload, whichever path hands it out
+(users_stories, iter_user_stories, iter_location_stories, save_stories).
+
+Usage:
+    python benchmarks/stories.py [--stories N]
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instagram_stories import Stories
+from replay_server import load_fixture, scale_stories
+
+
+class LegacyStories():
+    """ Stories before __slots__: every section parsed eagerly into a per-instance __dict__ """
+
+    def __init__(self, element):
+        self.mentions, self.locations, self.hashtags, self.ctas = [], [], [], []
+        self.media_id = element['id']
+        self.user_id = element['user']['pk']
+        self.nickname = element["user"]["username"]
+        self.fullname = element["user"]["full_name"]
+        self.media_type = element['media_type']
+        self.url = ""
+        if element['media_type'] == 2:
+            self.url = element['video_versions'][0]['url']
+        if element['media_type'] == 1:
+            self.url = element['image_versions2']['candidates'][0]['url']
+        self.timestamp = datetime.datetime.fromtimestamp(element['taken_at']).strftime('%Y-%m-%d %H:%M:%S')
+        self.caption = element['caption']['text'] if element['caption'] else ""
+        for mention in element.get('reel_mentions') or []:
+            self.mentions.append((mention['user']['pk'], mention['user']['username'], mention['user']['full_name']))
+        for geotag in element.get('story_locations') or []:
+            loc = geotag['location']
+            if 'name' in loc and 'lat' in loc and 'lng' in loc and 'pk' in loc:
+                self.locations.append((loc['name'], loc['lat'], loc['lng'], loc['pk']))
+        for hashtag in element.get('story_hashtags') or []:
+            self.hashtags.append(hashtag['hashtag']['name'])
+        for typ in element.get('story_cta') or []:
+            if 'links' in typ:
+                for cta in typ['links']:
+                    self.ctas.append(cta['webUri'])
+
+    def discovered(self):
+        return [(self.user_id, mention[0]) for mention in self.mentions] if self.mentions else []
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def payloads(n):
+    recorded = load_fixture("instagram_reel_media")["items"]
+    return [json.dumps(item) for item in scale_stories(recorded, n, 1)]
+
+
+def throughput(make, texts, use):
+    """ Stories per second, parsing already decoded payloads then using them """
+    elements = [json.loads(text) for text in texts]
+    start = time.perf_counter()
+    for element in elements:
+        use(make(element))
+    return len(elements) / (time.perf_counter() - start)
+
+
+def retained(make, texts):
+    """ Bytes kept per story once the payloads are dropped """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    stories = [make(json.loads(text)) for text in texts]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del stories
+    return size / len(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=100000)
+    args = parser.parse_args()
+
+    texts = payloads(args.stories)
+    uses = (("parse", lambda story: None),
+            ("discovered", lambda story: story.discovered()),
+            ("to_dict", lambda story: story.to_dict()))
+    print("stories\t\t" + "\t".join(name + "/s" for name, _ in uses) + "\tbytes/story")
+    for name, make in (("legacy", LegacyStories), ("slots", Stories)):
+        rates = [throughput(make, texts, use) for _, use in uses]
+        print("{:<16}".format(name) + "\t".join("{:.0f}".format(rate) for rate in rates) +
+              "\t{:.0f}".format(retained(make, texts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+location_people and degree_separation against the replay server, with the sightings and the crawl written inline
+between two fetches, as before the writer thread, then by the writer thread while the next ones are fetched.
+The sightings database is first filled with synthetic sightings, so that its writes cost what they cost on a
+database in use. Reports the time of both, and the queue depth and write latency of the writer thread.
+
+Usage:
+    python benchmarks/writer_pipeline.py [--locations N] [--users N] [--stories N] [--prefill N] [--latency S]
+                                         [--concurrency N] [--queue N] [--directory PATH]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo_sightings import synthetic_sightings
+from instagram_stories import InstagramStories, batched
+from replay_server import ReplayServer
+from request_scheduler import RequestScheduler
+from sightings import SightingStore
+
+
+def inline_location_people(ig, locations, batch_size=500):
+    """ location_people before the writer thread: every batch is committed between two fetches """
+    store, rows = ig.sighting_store(), []
+    for (location, loc_name), curr in ig.iter_location_stories(locations):
+        if curr.locations and curr.locations[0]:
+            name, lat, lng, city_id = curr.locations[0]
+            rows.append((curr.taken_at, name, lat, lng, curr.user_id, curr.nickname, curr.fullname, city_id, loc_name))
+        if len(rows) >= batch_size:
+            store.insert(rows)
+            del rows[:]
+    store.insert(rows)
+
+
+def inline_degree_separation(ig, seeds, batch_size=100):
+    """ degree_separation before the writer thread, on a crawl without discovered users to fetch twice """
+    db = sqlite3.connect(ig.degree_path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS degree(source TEXT, refered TEXT, PRIMARY KEY(source, refered))')
+    db.execute('CREATE TABLE IF NOT EXISTS crawl(user_id TEXT PRIMARY KEY, depth INTEGER, last_fetched REAL)')
+    for batch in batched(ig.iter_user_reels(seeds), batch_size):
+        with db:
+            for user_id, stories in batch:
+                if stories is None: continue
+                pairs = [(str(pair[0]), str(pair[1])) for story in stories for pair in story.discovered()]
+                db.executemany('INSERT OR IGNORE INTO degree(source, refered) VALUES(?,?)', pairs)
+                db.executemany('INSERT OR IGNORE INTO crawl(user_id, depth) VALUES(?,1)', [(r,) for _, r in pairs])
+            db.executemany('INSERT OR REPLACE INTO crawl(user_id, depth, last_fetched) VALUES(?,0,?)',
+                           [(user_id, time.time()) for user_id, _ in batch])
+    db.close()
+
+
+def prefill(path, n):
+    store = SightingStore(path)
+    for batch in batched(synthetic_sightings(n, 200), 10000):
+        store.insert(batch)
+    store.close()
+
+
+def instagram(args, directory):
+    ig = InstagramStories(RequestScheduler(concurrency=args.concurrency))
+    ig.base_url, ig.cookie, ig.DELAY_REQUESTS = args.url, {}, False
+    ig.db_path, ig.degree_path = os.path.join(directory, "locations.db"), os.path.join(directory, "degree.db")
+    ig.WRITER_QUEUE = args.queue
+    return ig
+
+
+def run(label, fn):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # The pipelines are chatty
+        fn()
+    elapsed = time.perf_counter() - start
+    print("{:<32}{:.2f} s".format(label, elapsed))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--locations", type=int, default=300)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--stories", type=int, default=50, help="Stories per user and per location")
+    parser.add_argument("--prefill", type=int, default=500000, help="Sightings already in the database")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--queue", type=int, default=10000, help="WRITER_QUEUE, records before the fetch blocks")
+    parser.add_argument("--directory", help="Where the databases are written, a temporary folder by default")
+    args = parser.parse_args()
+
+    server = ReplayServer(latency=args.latency, stories=args.stories).start()
+    args.url = server.url
+    root = tempfile.mkdtemp(dir=args.directory)
+    try:
+        locations = [(idx, "location {}".format(idx)) for idx in range(1, args.locations + 1)]
+        seeds = [str(idx) for idx in range(1, args.users + 1)]
+        results = {}
+        for label in ("inline", "writer thread"):
+            directory = os.path.join(root, label.replace(" ", "_"))
+            os.makedirs(directory)
+            prefill(os.path.join(directory, "locations.db"), args.prefill)
+            ig = instagram(args, directory)
+            if label == "inline":
+                results[label] = (run("location_people inline", lambda: inline_location_people(ig, locations)) +
+                                  run("degree_separation inline", lambda: inline_degree_separation(ig, seeds)))
+            else:
+                results[label] = (run("location_people writer thread", lambda: ig.location_people(locations)) +
+                                  run("degree_separation writer thread", lambda: ig.degree_separation(0, seeds)))
+                print("\nwriter thread: {}\n".format(", ".join(
+                    "{} {}".format(key, round(value, 4)) for key, value in sorted(ig.writer.stats().items()))))
+                print(ig.metrics.report())
+            sightings = ig.sighting_store().db.execute('SELECT COUNT(*) FROM sightings').fetchone()[0]
+            ig.close()
+            print("{} sightings\n".format(sightings))
+        print("speedup {:.2f}x".format(results["inline"] / results["writer thread"]))
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
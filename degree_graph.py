@@ -0,0 +1,277 @@
+import sqlite3
+from array import array
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError as e:
+    HAS_NUMPY = False
+
+
+def merge_edges(offsets, targets, sources, destinations, n):
+    """
+    Insert edges in a CSR adjacency in O(edges + new edges log new edges), without re-sorting the existing ones.
+    Args:
+        offsets (np.ndarray): Start of the neighbours of every node in targets, plus the end, int64.
+        targets (np.ndarray): Neighbours of all the nodes, node after node, uint32.
+        sources, destinations (np.ndarray): New edges.
+        n (int): Number of nodes, at least len(offsets) - 1.
+    Returns:
+        offsets, targets (Tuple): The merged adjacency.
+    """
+    offsets = np.concatenate([offsets, np.full(n + 1 - len(offsets), offsets[-1], dtype=np.int64)])
+    order = np.argsort(sources, kind='stable')
+    sources, destinations = sources[order], destinations[order]
+    targets = np.insert(targets, offsets[sources.astype(np.int64) + 1], destinations)  # At the end of each node
+    counts = np.bincount(sources, minlength=n)
+    offsets[1:] += np.cumsum(counts)
+    return offsets, targets
+
+
+def gather(offsets, targets, nodes):
+    """
+    Args:
+        offsets, targets (np.ndarray): CSR adjacency.
+        nodes (np.ndarray): Nodes whose neighbours are wanted.
+    Returns:
+        neighbours, origins (Tuple): Every neighbour of the nodes, and the node it is a neighbour of.
+    """
+    starts, lengths = offsets[nodes], offsets[nodes + 1] - offsets[nodes]
+    total = int(lengths.sum())
+    if not total: return targets[:0], nodes[:0]
+    index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    return targets[index], np.repeat(nodes, lengths)
+
+
+class DegreeGraph:
+    """
+    The degree(source, refered) table of degree_separation, loaded in memory as a directed graph of integer ids
+    in CSR form: for every node, its neighbours are a contiguous slice of a uint32 array, in both directions.
+    About 8 bytes per edge and 16 bytes per node, plus the dictionary of the user ids.
+    refresh() merges the rows inserted since the last load, found by rowid, without reloading the others.
+    """
+    FETCH_ROWS = 100000
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the SQLite database of degree_separation.
+        """
+        if not HAS_NUMPY: raise ImportError("DegreeGraph requires numpy")
+        self.path = path
+        self.users, self.index = [], {}  # Integer id -> user id, and back
+        self.last_rowid = 0
+        self.offsets, self.targets = np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.uint32)  # Mentioned users
+        self.rev_offsets, self.rev_targets = np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.uint32)  # Mentioners
+        self.refresh()
+
+    def __len__(self):
+        return len(self.users)
+
+    @property
+    def edges(self):
+        return len(self.targets)
+
+    def refresh(self):
+        """
+        Load the rows of degree added since the last refresh. Rows are assumed to be only inserted, as by
+        degree_separation: a deleted row stays in the graph until a new DegreeGraph is loaded.
+        Returns:
+            n (int): Number of edges added.
+        """
+        db = sqlite3.connect(self.path)
+        cursor = db.execute('SELECT rowid, source, refered FROM degree WHERE rowid > ? ORDER BY rowid',
+                            (self.last_rowid,))
+        sources, destinations = array('I'), array('I')
+        index, users = self.index, self.users
+        while True:
+            rows = cursor.fetchmany(self.FETCH_ROWS)
+            if not rows: break
+            for _, source, refered in rows:
+                src = index.get(source)
+                if src is None:
+                    src = index[source] = len(users)
+                    users.append(source)
+                if refered is None: continue  # Seed row, only a node
+                dst = index.get(refered)
+                if dst is None:
+                    dst = index[refered] = len(users)
+                    users.append(refered)
+                sources.append(src)
+                destinations.append(dst)
+            self.last_rowid = rows[-1][0]
+        db.close()
+
+        sources, destinations = np.frombuffer(sources, dtype=np.uint32), np.frombuffer(destinations, dtype=np.uint32)
+        if len(sources) or len(users) + 1 > len(self.offsets):
+            self.offsets, self.targets = merge_edges(self.offsets, self.targets, sources, destinations, len(users))
+            self.rev_offsets, self.rev_targets = merge_edges(self.rev_offsets, self.rev_targets, destinations,
+                                                             sources, len(users))
+        return len(sources)
+
+    def node(self, user_id):
+        """ Integer id of a user, KeyError if it is not in the graph """
+        return self.index[str(user_id)]
+
+    def out_degree(self):
+        """ Returns: degrees (np.ndarray): Users mentioned by every node """
+        return np.diff(self.offsets)
+
+    def in_degree(self):
+        """ Returns: degrees (np.ndarray): Users mentioning every node """
+        return np.diff(self.rev_offsets)
+
+    def mentioned(self, user_id):
+        """ Returns: users (List): User ids mentioned by user_id """
+        node = self.node(user_id)
+        return [self.users[idx] for idx in self.targets[self.offsets[node]:self.offsets[node + 1]].tolist()]
+
+    def mentioners(self, user_id):
+        """ Returns: users (List): User ids mentioning user_id """
+        node = self.node(user_id)
+        return [self.users[idx] for idx in self.rev_targets[self.rev_offsets[node]:self.rev_offsets[node + 1]].tolist()]
+
+    def top(self, k=10, by="in"):
+        """
+        Args:
+            k (int): Number of users.
+            by (str): "in" for the most mentioned users, "out" for the users mentioning the most.
+        Returns:
+            top (List): (user id, degree) of the k users of highest degree, highest first.
+        """
+        degrees = self.in_degree() if by == "in" else self.out_degree()
+        k = min(k, len(degrees))
+        if not k: return []
+        best = np.argpartition(-degrees, k - 1)[:k]
+        best = best[np.argsort(-degrees[best], kind='stable')]
+        return [(self.users[idx], int(degrees[idx])) for idx in best.tolist()]
+
+    def adjacency(self, directed):
+        """ CSR adjacencies walked by a BFS: the mentions only, or the mentions in both directions """
+        if directed: return [(self.offsets, self.targets)]
+        return [(self.offsets, self.targets), (self.rev_offsets, self.rev_targets)]
+
+    def distances(self, user_id, directed=True, max_depth=None):
+        """
+        Args:
+            user_id (str): Start of the BFS.
+            directed (Bool): Follow the mentions only from the mentioner to the mentioned user.
+            max_depth (int): Stop after this many steps, None to visit the whole component.
+        Returns:
+            distances (np.ndarray): Steps from user_id to every node, -1 if it is not reached.
+        """
+        distances = np.full(len(self.users), -1, dtype=np.int32)
+        frontier = np.array([self.node(user_id)], dtype=np.int64)
+        distances[frontier] = depth = 0
+        while len(frontier) and (max_depth is None or depth < max_depth):
+            depth += 1
+            found = np.concatenate([gather(offsets, targets, frontier)[0] for offsets, targets in self.adjacency(directed)])
+            frontier = np.unique(found[distances[found] < 0]).astype(np.int64)
+            distances[frontier] = depth
+        return distances
+
+    def shortest_path(self, a, b, directed=True):
+        """
+        Degrees of separation between two users, by a BFS from both ends that expands the smaller frontier.
+        Args:
+            a, b (str): User ids.
+            directed (Bool): Follow the mentions only from the mentioner to the mentioned user.
+        Returns:
+            path (List): User ids from a to b, None if b cannot be reached.
+        """
+        start, goal = self.node(a), self.node(b)
+        if start == goal: return [a]
+        forward = self.adjacency(directed)
+        backward = [(self.rev_offsets, self.rev_targets)] if directed else forward
+        parents = [np.full(len(self.users), -1, dtype=np.int64), np.full(len(self.users), -1, dtype=np.int64)]
+        parents[0][start], parents[1][goal] = start, goal
+        frontiers = [np.array([start], dtype=np.int64), np.array([goal], dtype=np.int64)]
+        while len(frontiers[0]) and len(frontiers[1]):
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            found, origins = [], []
+            for offsets, targets in (forward if side == 0 else backward):
+                neighbours, origin = gather(offsets, targets, frontiers[side])
+                found.append(neighbours)
+                origins.append(origin)
+            found, origins = np.concatenate(found).astype(np.int64), np.concatenate(origins)
+            new = parents[side][found] < 0
+            found, origins = found[new], origins[new]
+            found, first = np.unique(found, return_index=True)
+            parents[side][found] = origins[first]
+            frontiers[side] = found
+            met = found[parents[1 - side][found] >= 0]
+            if len(met):
+                return self.join_path(parents, int(met[0]))
+        return None
+
+    def join_path(self, parents, middle):
+        """ User ids from the start to the goal of a bidirectional BFS, through the node where both sides met """
+        head, node = [], middle
+        while True:
+            head.append(node)
+            if parents[0][node] == node: break
+            node = int(parents[0][node])
+        tail, node = [], middle
+        while parents[1][node] != node:
+            node = int(parents[1][node])
+            tail.append(node)
+        return [self.users[idx] for idx in head[::-1] + tail]
+
+    def components(self):
+        """
+        Weakly connected components, by hooking every edge on the smallest label then pointer jumping.
+        Returns:
+            labels (np.ndarray): For every node, the smallest node of its component.
+        """
+        labels = np.arange(len(self.users), dtype=np.int64)
+        sources = np.repeat(labels, self.out_degree())
+        destinations = self.targets.astype(np.int64)
+        while True:
+            low, high = labels[sources], labels[destinations]
+            smallest = np.minimum(low, high)
+            hooked = labels.copy()
+            np.minimum.at(hooked, low, smallest)
+            np.minimum.at(hooked, high, smallest)
+            while True:
+                jumped = hooked[hooked]
+                if np.array_equal(jumped, hooked): break
+                hooked = jumped
+            if np.array_equal(hooked, labels): return labels
+            labels = hooked
+
+    def component_sizes(self, k=10):
+        """ Returns: sizes (List): (smallest user id of the component, size) of the k largest components """
+        labels, sizes = np.unique(self.components(), return_counts=True)
+        best = np.argsort(-sizes, kind='stable')[:k]
+        return [(self.users[int(labels[idx])], int(sizes[idx])) for idx in best]
+
+    def pagerank(self, damping=0.85, tol=1e-6, max_iter=100):
+        """
+        Args:
+            damping (float): Probability of following a mention rather than jumping to a random user.
+            tol (float): Stop when the L1 change of an iteration is below it.
+            max_iter (int): Maximum number of iterations.
+        Returns:
+            ranks (np.ndarray): PageRank of every node, summing to 1. Users mentioning no one spread their rank
+                over all the users.
+        """
+        n = len(self.users)
+        if not n: return np.zeros(0)
+        out_degree = self.out_degree()
+        dangling = out_degree == 0
+        inverse = np.where(dangling, 0.0, 1.0 / np.maximum(out_degree, 1))
+        sources = np.repeat(np.arange(n, dtype=np.uint32), out_degree)
+        ranks = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            spread = np.bincount(self.targets, weights=(ranks * inverse)[sources], minlength=n)
+            new = damping * spread + (damping * ranks[dangling].sum() + 1 - damping) / n
+            change = np.abs(new - ranks).sum()
+            ranks = new
+            if change < tol: break
+        return ranks
+
+    def top_pagerank(self, k=10, **kwargs):
+        """ Returns: top (List): (user id, PageRank) of the k users of highest PageRank, highest first """
+        ranks = self.pagerank(**kwargs)
+        best = np.argsort(-ranks, kind='stable')[:k]
+        return [(self.users[idx], float(ranks[idx])) for idx in best.tolist()]
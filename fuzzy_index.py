@@ -0,0 +1,83 @@
+import difflib
+from collections import Counter, defaultdict
+
+PAD = "\x00"
+
+
+def trigrams(s):
+    """
+    Args:
+        s (string): String to split, already normalized.
+    Returns:
+        grams (Counter): Occurrences of the trigrams of s, padded so that every string has len(s) + 2 of them.
+    """
+    padded = PAD * 2 + s + PAD * 2
+    return Counter(padded[idx:idx + 3] for idx in range(len(padded) - 2))
+
+
+def ratio_bound(matches, total):
+    """ Same formula as difflib, so that a bound on the matches gives a bound on SequenceMatcher.ratio """
+    return 2.0 * matches / total if total else 1.0
+
+
+class ScanIndex:
+    """ Reference matcher: compare the query with every string, as find_similarities always did """
+
+    def __init__(self, strings, threshold=0.9):
+        self.strings = list(dict.fromkeys(strings))
+        self.threshold = threshold
+
+    def match(self, query):
+        """
+        Args:
+            query (string): String to look for.
+        Returns:
+            matched (set): Strings whose SequenceMatcher ratio with the query, both lowercased, is above threshold.
+        """
+        query = query.lower()
+        return {s for s in self.strings
+                if difflib.SequenceMatcher(None, query, s.lower()).ratio() > self.threshold}
+
+
+class TrigramIndex(ScanIndex):
+    """
+    Same results as ScanIndex, without comparing the query with every string.
+    The strings are normalized once and indexed by trigram. A query only visits the strings sharing trigrams
+    with it, then discards them with cheap upper bounds of the ratio before the exact SequenceMatcher check:
+    the lengths, the number of common trigrams (every insertion or deletion destroys at most 3 of them),
+    then real_quick_ratio and quick_ratio.
+    """
+
+    def __init__(self, strings, threshold=0.9):
+        super().__init__(strings, threshold)
+        self.lowered = [s.lower() for s in self.strings]
+        self.lengths = [len(s) for s in self.lowered]
+        self.postings = defaultdict(list)  # Trigram -> [(String index, Occurrences)]
+        for idx, s in enumerate(self.lowered):
+            for gram, n in trigrams(s).items():
+                self.postings[gram].append((idx, n))
+
+    def match(self, query):
+        query = query.lower()
+        la = len(query)
+        common = defaultdict(int)  # String index -> Common trigrams
+        for gram, n in trigrams(query).items():
+            for idx, m in self.postings.get(gram, ()):
+                common[idx] += min(n, m)
+        if self.threshold < 5 / 6:  # Strings without common trigrams can only match below this threshold
+            common = {idx: common.get(idx, 0) for idx in range(len(self.strings))}
+
+        matcher = difflib.SequenceMatcher(None, query)
+        matched = set()
+        for idx, shared in common.items():
+            lb = self.lengths[idx]
+            total = la + lb
+            if ratio_bound(min(la, lb), total) <= self.threshold: continue
+            edits = max(0, -(-(max(la, lb) + 2 - shared) // 3))  # At least this many insertions and deletions
+            if ratio_bound((total - edits) // 2, total) <= self.threshold: continue
+
+            matcher.set_seq2(self.lowered[idx])
+            if (matcher.real_quick_ratio() > self.threshold and matcher.quick_ratio() > self.threshold and
+                    matcher.ratio() > self.threshold):
+                matched.add(self.strings[idx])
+        return matched
@@ -1,11 +1,15 @@
-import requests
 import json
 import datetime
 import time
 import os
 import sqlite3
-from random import randint
-from time import sleep
+from request_scheduler import RequestScheduler, JitterDelay
+from seen_index import SeenIndex
+from degree_graph import DegreeGraph
+from sightings import SightingStore
+from media_downloader import MediaDownloader
+from pipeline import WriterThread
+from stage_metrics import StageMetrics
 
 try:
     from terminaltables import AsciiTable
@@ -14,7 +18,59 @@ except ImportError as e:
     PRINT_TABLE = False
 
 
+def batched(iterable, size):
+    """
+    Args:
+        iterable: Elements to group, possibly a generator.
+        size (int): Maximum size of a batch.
+    Yields:
+        batch (List): Consecutive elements of iterable, only one batch is held at a time.
+    """
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch: yield batch
+
+
+EMPTY = ()  # Shared by all the stories without mentions, locations, hashtags or CTAs
+
+
+def parse_mentions(raw):
+    return [(mention['user']['pk'], mention['user']['username'], mention['user']['full_name']) for mention in raw]
+
+
+def parse_locations(raw):
+    locations = []
+    for geotag in raw:
+        loc = geotag['location']
+        if 'name' in loc and 'lat' in loc and 'lng' in loc and 'pk' in loc:  # Quite edge case..
+            locations.append((loc['name'], loc['lat'], loc['lng'], loc['pk']))
+    return locations
+
+
+def parse_hashtags(raw):
+    return [hashtag['hashtag']['name'] for hashtag in raw]
+
+
+def parse_ctas(raw):
+    return [cta['webUri'] for typ in raw if 'links' in typ for cta in typ['links']]
+
+
 class Stories():
+    """
+    A story, with the fields of the Instagram payload that are kept. Mentions, locations, hashtags and CTAs are
+    parsed into tuples at once, so that nothing of the payload is retained, and the timestamp is only formatted
+    when read.
+    to_dict / from_dict define the saved representation, its keys are FIELDS.
+    """
+    FIELDS = ('media_id', 'user_id', 'nickname', 'fullname', 'media_type', 'timestamp', 'url', 'caption',
+              'mentions', 'locations', 'hashtags', 'ctas')
+    __slots__ = ('media_id', 'user_id', 'nickname', 'fullname', 'media_type', 'taken_at', '_timestamp', 'url',
+                 'caption', 'mentions', 'locations', 'hashtags', 'ctas')
+
     def __init__(self, element=None):
         """
         Initialize the Stories, either as empty Obj or from a dictionary repr.
@@ -22,61 +78,47 @@ class Stories():
             element: Instagram-provided dictionary with informations.
         """
         self.media_id, self.user_id, self.nickname, self.fullname = "", "", "", ""
-        self.media_type, self.timestamp = 0, 0
+        self.media_type, self.taken_at, self._timestamp = 0, None, 0
         self.url, self.caption = "", ""
-        self.mentions, self.locations, self.hashtags, self.ctas = [], [], [], []
+        self.mentions, self.locations, self.hashtags, self.ctas = EMPTY, EMPTY, EMPTY, EMPTY
 
         if element:  # If we provide the Instagram object we use that to retrieve the data
-            media_id = element['id']
-            self.media_id = media_id
+            self.media_id = element['id']
             ## - Usr - <>
-            self.user_id = element['user']['pk']
-            self.nickname = element["user"]["username"]
-            self.fullname = element["user"]["full_name"]
+            user = element['user']
+            self.user_id, self.nickname, self.fullname = user['pk'], user['username'], user['full_name']
             ## - Video/Pic - <>
             self.media_type = element['media_type']
             if element['media_type'] == 2:
-                videos = element['video_versions']
-                video_url = videos[0]['url']
-                self.url = video_url
+                self.url = element['video_versions'][0]['url']
             if element['media_type'] == 1:
-                pics = element['image_versions2']['candidates']
-                pic_url = pics[0]['url']
-                self.url = pic_url
+                self.url = element['image_versions2']['candidates'][0]['url']
             ## - Time - <>
-            time = element['taken_at']
-            self.timestamp = datetime.datetime.fromtimestamp(time).strftime('%Y-%m-%d %H:%M:%S')
+            self.taken_at, self._timestamp = element['taken_at'], None  # Formatted on demand
             ## - Caption - <>
-            caption = element['caption']  
+            caption = element['caption']
             if caption:
                 self.caption = caption['text']
-            ## - Someone else tagged - <>
-            if 'reel_mentions' in element:
-                mentions = element['reel_mentions']
-                if mentions:
-                    for idx, mention in enumerate(mentions):
-                        self.mentions.append(
-                            (mention['user']['pk'], mention['user']['username'], mention['user']['full_name']))
-            ## - GeoTag - <> 
-            if 'story_locations' in element:
-                geotags = element['story_locations']
-                if geotags:
-                    for geotag in geotags:
-                        loc = geotag['location']
-                        if 'name' in loc and 'lat' in loc and 'lng' in loc and 'pk' in loc:  # Quite edge case..
-                            self.locations.append((loc['name'], loc['lat'], loc['lng'], loc['pk']))
-            ## Hashtag
-            if 'story_hashtags' in element:
-                hashtags = element['story_hashtags']
-                if hashtags:
-                    for hashtag in hashtags:
-                        self.hashtags.append(hashtag['hashtag']['name'])
-            ## CTA
-            if 'story_cta' in element:
-                for typ in element['story_cta']:
-                    if 'links' in typ:
-                        for idx, cta in enumerate(typ['links']):
-                            self.ctas.append(cta['webUri'])
+            ## - Someone else tagged, GeoTag, Hashtag, CTA - <> Most stories have none of them
+            raw = element.get('reel_mentions')
+            if raw: self.mentions = tuple(parse_mentions(raw)) or EMPTY
+            raw = element.get('story_locations')
+            if raw: self.locations = tuple(parse_locations(raw)) or EMPTY
+            raw = element.get('story_hashtags')
+            if raw: self.hashtags = tuple(parse_hashtags(raw)) or EMPTY
+            raw = element.get('story_cta')
+            if raw: self.ctas = tuple(parse_ctas(raw)) or EMPTY
+
+    @property
+    def timestamp(self):
+        """ Time the story was taken, formatted as '%Y-%m-%d %H:%M:%S' in local time """
+        if self._timestamp is None:
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.taken_at))
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._timestamp = value
 
     def __str__(self):
         """ Return a Human-Readable representation of the Object"""
@@ -86,7 +128,26 @@ class Stories():
 
     def from_json(self, d):
         """ Setup the object using a Json-able string """
-        self.__dict__ = json.load(d)
+        self.load_dict(json.load(d))
+
+    def to_dict(self):
+        """ Json-able dictionary of the Stories, as saved by save_stories """
+        return {'media_id': self.media_id, 'user_id': self.user_id, 'nickname': self.nickname,
+                'fullname': self.fullname, 'media_type': self.media_type, 'timestamp': self.timestamp,
+                'url': self.url, 'caption': self.caption, 'mentions': list(self.mentions),
+                'locations': list(self.locations), 'hashtags': list(self.hashtags), 'ctas': list(self.ctas)}
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Create the Stories from a dictionary produced by to_dict """
+        story = cls()
+        story.load_dict(d)
+        return story
+
+    def load_dict(self, d):
+        """ Set the fields present in a dictionary produced by to_dict """
+        for field in self.FIELDS:
+            if field in d: setattr(self, field, d[field])
 
     def print_info(self):
         """ Human friendly visualization of the data saved in Stories """
@@ -132,16 +193,59 @@ class Stories():
 
 
 class InstagramStories():
-    def __init__(self):
-        """ Initialize Options """
+    def __init__(self, scheduler=None):
+        """
+        Initialize Options
+        Args:
+            scheduler (RequestScheduler): Scheduler of the requests to Instagram, shared by all the endpoints.
+                By default one request at a time, each after a random delay of 0.8 to 1.7 second.
+                E.g. RequestScheduler(concurrency=8, policy=TokenBucket(rate=2, burst=4, jitter=0.3)) is faster.
+        """
         self.location_id = {}
         self.counter = 0
         self.basefolder, self.db_path = os.path.join("_", "_"), "_"
         self.db_seen = "_"
         self.degree_path = "_"
+        self.graph = None
         self.mode = 0
         self.res = []
         self.DELAY_REQUESTS, self.VERBOSE = True, False
+        self.SEEN_PREFILTER = False  # Keep a Bloom filter of the saved stories, for large seen tables
+        self.seen = None
+        self.sightings = None
+        self.archive = None  # StoryArchive where save_stories appends, instead of a new .json file per call
+        self.media_path = "_"  # Folder of download_media
+        self.downloader = None
+        self.writer = None  # WriterThread of the databases, see writer_thread
+        self.WRITER_QUEUE, self.WRITER_DELAY = 10000, 1.0  # Records queued before the fetch blocks, seconds to a write
+        self.metrics = StageMetrics()  # Writes of the writer thread, one stage per sink
+        self.base_url = "https://i.instagram.com/"  # Instagram private API
+        self.scheduler = scheduler or RequestScheduler(policy=JitterDelay(0.8, 1.7))
+
+    def get(self, url, throttle=True):
+        """
+        Args:
+            url (str): Endpoint to request, through the scheduler.
+            throttle (Bool): Wait for the throttling policy, only if DELAY_REQUESTS too. Only the requests of the
+                users_stories and location_people loops are throttled, as they always were, the single lookups are not.
+        Returns:
+            r (requests.Response): Response of Instagram, retried on 429 and 5xx in any case.
+        """
+        return self.scheduler.get(url, headers=self.cookie, throttle=throttle and self.DELAY_REQUESTS)
+
+    def get_json(self, url):
+        """
+        Args:
+            url (str): Endpoint to request, throttled as by get.
+        Returns:
+            d (dict): Decoded response of Instagram, None if it is not a successful JSON answer.
+        """
+        r = self.get(url)
+        if r.status_code != 200: return None
+        try:
+            return r.json()
+        except ValueError:
+            return None
 
     def set_mode(self, mode_n):
         """
@@ -156,8 +260,8 @@ class InstagramStories():
         Obtains from the Stories Tray the followed account IDs
         Returns: List of Instagram account IDs
         """
-        tray_endpoint = "https://i.instagram.com/api/v1/feed/reels_tray/"
-        r = requests.get(tray_endpoint, headers=self.cookie)
+        tray_endpoint = self.base_url + "api/v1/feed/reels_tray/"
+        r = self.get(tray_endpoint, throttle=False)
         stories = r.json()
         usr = []
         ids = []
@@ -185,8 +289,8 @@ class InstagramStories():
             location_name (str): Geographical places
         """
         if location_name not in self.location_id:
-            location_endpoint = "https://i.instagram.com/api/v1/fbsearch/places/?query={}/".format(location_name)
-            r = requests.get(location_endpoint, headers=self.cookie)
+            location_endpoint = self.base_url + "api/v1/fbsearch/places/?query={}/".format(location_name)
+            r = self.get(location_endpoint, throttle=False)
             d = r.json()
             place_id = d['items'][0]['location']['pk']
             print("{} - {}".format(location_name, place_id))
@@ -199,8 +303,8 @@ class InstagramStories():
         Args:
             user_id (int): ID of person of interest
         """
-        user_endpoint = "https://i.instagram.com/api/v1/users/{}/info/".format(user_id)
-        r = requests.get(user_endpoint, headers = self.cookie)
+        user_endpoint = self.base_url + "api/v1/users/{}/info/".format(user_id)
+        r = self.get(user_endpoint, throttle=False)
         d = r.json()
         
         username, fullname = d['user']['username'], d['user']['full_name']
@@ -214,82 +318,140 @@ class InstagramStories():
         Args:
             location_id (int): ID of location of interest
         """
-        location_endpoint = "https://i.instagram.com/api/v1/feed/location/{}/".format(location_id)
-        r = requests.get(location_endpoint, headers=self.cookie)
+        location_endpoint = self.base_url + "api/v1/feed/location/{}/".format(location_id)
+        r = self.get(location_endpoint, throttle=False)
         d = r.json()
         self.analytics_story(d['story']['items'])
 
-    def location_people(self, locations):
+    def location_people(self, locations, batch_size=500):
         """
-        Retrieve geo-tagged stories of a location and store relevant information in a database
+        Retrieve geo-tagged stories of a location and store relevant information in a database, see sighting_store.
+        The sightings are written by the writer thread while the next ones are fetched, batch_size at a time.
         Args:
-            locations_id (int): ID of location of interest
+            locations: List of tuples (ID, name) of the locations of interest
+            batch_size (int): Number of sightings between two commits
+        """
+        writer = self.writer_thread()
+        writer.register('sightings', self.sighting_store().insert, batch_size)
+        for (location, loc_name), curr in self.iter_location_stories(locations):
+            if curr.locations:
+                geotag = curr.locations[0]
+                if geotag:
+                    name, lat, lng = geotag[0], geotag[1], geotag[2]
+                    print("TIME: {} | {} : LAT: {} LNG: {} | ID {} NK {} - FN {}".format(curr.timestamp, name,
+                                                                                         lat, lng, curr.user_id,
+                                                                                         curr.nickname,
+                                                                                         curr.fullname))
+                    writer.put('sightings', (curr.taken_at if curr.taken_at is not None else curr.timestamp, name,
+                                             lat, lng, curr.user_id, curr.nickname, curr.fullname, geotag[3],
+                                             loc_name))
+        writer.flush()
+
+    def sighting_store(self):
+        """
+        Returns:
+            sightings (SightingStore): Sightings of location_people, with their spatial and time queries, opened on
+                db_path once and reused. Its connection is shared with the writer thread, which writes to it while
+                location_people runs
         """
-        db = sqlite3.connect(self.db_path)
-        cursor = db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users(timestamp TEXT, placename TEXT, lat TEXT, lng TEXT, user_id TEXT, nickname TEXT, fullname TEXT, city_id TEXT, city_name TEXT, PRIMARY KEY (timestamp, user_id))
-        ''')
-        db.commit()
-        for location_tuple in locations:
+        if self.sightings is None or self.sightings.path != self.db_path:
+            if self.sightings is not None: self.sightings.close()
+            self.sightings = SightingStore(self.db_path)
+        return self.sightings
 
-            if self.DELAY_REQUESTS: sleep(randint(800, 1700) / 1000)  # Wait between 0.8 and 1.7 second
+    def writer_thread(self):
+        """
+        Returns:
+            writer (WriterThread): Thread writing the sightings, the saved stories and the crawl of degree_separation
+                while the next ones are fetched, started on first use
+        """
+        if self.writer is None or not self.writer.is_alive():  # A failed writer raised its error, a new one is started
+            self.writer = WriterThread(max_queue=self.WRITER_QUEUE, max_delay=self.WRITER_DELAY, metrics=self.metrics)
+            self.writer.start()
+        return self.writer
 
-            location, loc_name = location_tuple
-            print("- LOCATION: {} -".format(loc_name))
+    def close(self):
+        """ Stop the writer thread, after its pending writes, and close the databases """
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+        for store in (self.seen, self.sightings, self.downloader):
+            if store is not None: store.close()
+        self.seen = self.sightings = self.downloader = None
 
-            location_endpoint = "https://i.instagram.com/api/v1/feed/location/{}/".format(location)
-            r = requests.get(location_endpoint, headers=self.cookie)
-            d = r.json()
-            if 'story' in d:
-                stories = d['story']['items']
-                for story in stories:
-                    curr = Stories(story)
-                    if curr.locations:
-                        geotag = curr.locations[0]
-                        if geotag:
-                            name, lat, lng = geotag[0], geotag[1], geotag[2]
-                            print("TIME: {} | {} : LAT: {} LNG: {} | ID {} NK {} - FN {}".format(curr.timestamp, name,
-                                                                                                 lat, lng, curr.user_id,
-                                                                                                 curr.nickname,
-                                                                                                 curr.fullname))
-                            cursor.execute('''
-                                INSERT OR IGNORE INTO users(timestamp, placename, lat, lng, user_id, nickname, fullname, city_id, city_name) VALUES(?,?,?,?,?,?,?,?,?)''',
-                                           (curr.timestamp, name, lat, lng, curr.user_id, curr.nickname, curr.fullname,
-                                            geotag[3], loc_name))
-                db.commit()
+    def iter_location_stories(self, locations):
+        """
+        Stream the stories of many locations, fetched concurrently by the scheduler and yielded in order
+        Args:
+            locations: List of tuples (ID, name) of the locations of interest
+        Yields:
+            (location, story): The tuple (ID, name) of the location and one of its Stories, as soon as it is parsed
+        """
+        locations = list(locations)
+        location_endpoint = self.base_url + "api/v1/feed/location/{}/"
+        responses = self.scheduler.map(lambda location_tuple: self.get_json(location_endpoint.format(location_tuple[0])),
+                                       locations)
+        for location_tuple, d in zip(locations, responses):
+            print("- LOCATION: {} -".format(location_tuple[1]))
+            if d is None:  # Still failing after the retries, the other locations are processed
+                print("Failed to retrieve the stories of url {}".format(location_endpoint.format(location_tuple[0])))
+            elif 'story' in d:
+                for element in d['story']['items']:
+                    yield location_tuple, self.parse_story(element)
             else:
                 print(d) # Edge cases where we are unable to retrieve information
 
     def users_stories(self, arr_ids):
         """
-        Obtain Stories from multiple users. Support for randomly delayed requests
+        Obtain Stories from multiple users, see iter_user_stories to process them without keeping them all
         Args:
             arr_ids: List of IDs of user we want to retrieve
         Returns:
             self.res: List of Stories elements obtained
         """
         self.counter = 0
-        userid_endpoint = "https://i.instagram.com/api/v1/feed/user/{}/reel_media/"
-        for idx, ids in enumerate(arr_ids):
+        arr_ids = list(arr_ids)
+        self.res.extend(self.iter_user_stories(arr_ids))
+        print("\n\nWe finished processing {} users with {} stories".format(len(arr_ids), self.counter))
+        return self.res
 
-            if self.DELAY_REQUESTS: sleep(randint(800, 1700) / 1000)  # Wait between 0.8 and 1.7 second
+    def iter_user_stories(self, arr_ids):
+        """
+        Stream the Stories of multiple users, fetched concurrently by the scheduler and yielded in order
+        Args:
+            arr_ids: List of IDs of user we want to retrieve
+        Yields:
+            story (Stories): Each Stories element, as soon as it is parsed
+        """
+        for _, stories in self.iter_user_reels(arr_ids):
+            if stories: yield from stories
 
-            url = userid_endpoint.format(ids)
-            r = requests.get(url, headers=self.cookie)
-            d = r.json()
-            if 'items' in d and d['items']:
+    def iter_user_reels(self, arr_ids):
+        """
+        Stream the Stories of multiple users grouped by user, fetched concurrently by the scheduler
+        Args:
+            arr_ids: List of IDs of user we want to retrieve
+        Yields:
+            ids, stories (Tuple): Each user ID in order, with the List of its Stories, empty if it has none, None if
+                its reel could not be retrieved (still throttled after the retries, error answer...)
+        """
+        arr_ids = list(arr_ids)
+        userid_endpoint = self.base_url + "api/v1/feed/user/{}/reel_media/"
+        responses = self.scheduler.map(lambda ids: self.get_json(userid_endpoint.format(ids)), arr_ids)
+        for idx, (ids, d) in enumerate(zip(arr_ids, responses)):
+            if d is None or d.get('status') == 'fail' or 'items' not in d:
+                print("Failed to retrieve the stories of url {}".format(userid_endpoint.format(ids)))
+                yield ids, None
+            elif d['items']:
                 items = d['items']
                 username = items[0]['user']['username']
                 print("\n\n___________________________________")
                 print("{}/{} Username: -| {} |-".format(idx + 1, len(arr_ids), username))
                 print("___________________________________")
-                self.analytics_story(items)
+                yield ids, [self.parse_story(element) for element in items]
             else:
-                print("Empty stories for url {}".format(url))
-                continue
-        print("\n\nWe finished processing {} users with {} stories".format(len(arr_ids), self.counter))
-        return self.res
+                print("Empty stories for url {}".format(userid_endpoint.format(ids)))
+                yield ids, []
 
     def analytics_story(self, usr_stories):
         """
@@ -298,15 +460,24 @@ class InstagramStories():
             usr_stories: dict of users stories
         """
         for element in usr_stories:  # Iter all user stories
-            curr_s = Stories(element)  # Create a custom class istance to hold the relevant information
-            self.counter += 1  # Counter to keep track of number of processed stories
-            if self.VERBOSE: curr_s.print_info()  # Nicely print all the information
-            self.res.append(curr_s)
+            self.res.append(self.parse_story(element))
+
+    def parse_story(self, element):
+        """
+        Args:
+            element: Instagram-provided dictionary of a story
+        Returns:
+            curr_s (Stories): The parsed story
+        """
+        curr_s = Stories(element)  # Create a custom class istance to hold the relevant information
+        self.counter += 1  # Counter to keep track of number of processed stories
+        if self.VERBOSE: curr_s.print_info()  # Nicely print all the information
+        return curr_s
 
     @staticmethod
     def save_stories_json(stories, path):
         with open(path, 'w+') as f_out:
-            json.dump(stories.__dict__, f_out)
+            json.dump(stories.to_dict(), f_out)
 
     @staticmethod
     def load_stories_json(path):
@@ -316,72 +487,199 @@ class InstagramStories():
         new_user.print_info()
         return new_user
 
-    def save_stories(self, stories):
+    def save_stories(self, stories, batch_size=1000):
         """
-        Given Stories object proceed to save them as .json files using a database to check if they are already saved
+        Given Stories object proceed to save them as .json files using a database to check if they are already saved.
+        If self.archive is set, they are appended to it instead.
+        The stories are consumed, then checked and written by the writer thread batch_size at a time, so they can come
+        from a generator that is still fetching. Every batch is a complete .json file (or archive append), written
+        before its stories are marked as seen, so an interrupted call only loses the batch in progress
         Args:
-            stories: List of Stories object
+            stories: Iterable of Stories object
+            batch_size (int): Number of stories checked against the database at once
         """
-        skipped = 0
+        counts = {'saved': 0, 'skipped': 0, 'files': 0}  # Only updated by the writer thread
+        seen, archive = self.seen_index(), self.archive
+        writer = self.writer_thread()
         date = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
-        path = os.path.join(self.basefolder, date + ".json")
-        with open(path, 'w+') as f:
+
+        def write(batch):
+            new = seen.unseen(str(story.media_id) for story in batch)
             to_save = []
-            db = sqlite3.connect(self.db_seen)
-            cursor = db.cursor()
-            cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS seen(media_id TEXT PRIMARY KEY)
-                ''')
-            db.commit()
-            for story in stories:
-                cursor.execute("SELECT * FROM seen WHERE media_id = ?", (story.media_id,))
-                ex = cursor.fetchone()
-                if ex:
-                    skipped += 1
+            for story in batch:
+                media_id = str(story.media_id)
+                if media_id not in new:
+                    counts['skipped'] += 1
                     continue
-                else:
-                    to_save.append(story.__dict__)
-                    cursor.execute('''INSERT OR IGNORE INTO seen(media_id) VALUES(?)''', (str(story.media_id),))
-            print("We skipped {} stories".format(skipped))
-            json.dump(to_save, f)
-            db.commit()
+                new.discard(media_id)  # A story repeated in the batch is saved once
+                to_save.append(story)
+            if not to_save: return
+            if archive is not None:
+                archive.append(to_save)
+            else:
+                while True:  # Never over a file of an earlier batch or call
+                    name = date if not counts['files'] else "{}-{:04d}".format(date, counts['files'])
+                    path = os.path.join(self.basefolder, name + ".json")
+                    counts['files'] += 1
+                    if not os.path.exists(path): break
+                self.save_stories_batch(to_save, path)
+            counts['saved'] += len(to_save)
+            seen.mark_seen(str(story.media_id) for story in to_save)  # Only once they are written
+
+        writer.register('stories', write, batch_size)
+        try:
+            for batch in batched(stories, batch_size):
+                writer.put_many('stories', batch)
+        finally:
+            writer.flush()  # Even if the stories raised
+        print("We skipped {} stories".format(counts['skipped']))
 
-    def degree_separation(self, grade, seeds):
+    @staticmethod
+    def save_stories_batch(stories, path):
+        """ Write the list of stories to path as json.dump would, atomically: the file is complete or absent """
+        with open(path + ".tmp", 'w') as f_out:
+            json.dump([story.to_dict() for story in stories], f_out)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.replace(path + ".tmp", path)
+
+    def download_media(self, stories, concurrency=4):
         """
-        Proceed to gradually discover Instagram users from already visited        
+        Download the photos and videos of Stories to media_path, see MediaDownloader
         Args:
-            grade (int): Eventually initialize the database with the Seeds 
-            seeds: List of seeds to start the discovery from 
+            stories: Iterable of Stories object, possibly a generator
+            concurrency (int): Media downloaded at the same time
+        Returns:
+            stats (dict): Media downloaded, already present and failed
         """
-        db = sqlite3.connect(self.degree_path)
-        cursor = db.cursor()
+        if self.downloader is None or self.downloader.directory != self.media_path:
+            if self.downloader is not None: self.downloader.close()
+            self.downloader = MediaDownloader(self.media_path, concurrency=concurrency)
+        stats = self.downloader.download(stories)
+        print("We downloaded {downloaded} media, {known} were already downloaded, {duplicates} were reposts "
+              "and {failed} failed".format(**stats))
+        return stats
 
-        if grade == 0:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS degree(source TEXT, refered TEXT, PRIMARY KEY(source, refered))
+    def seen_index(self):
+        """
+        Returns:
+            seen (SeenIndex): Index of the stories already saved, opened on db_seen once and reused
+        """
+        if self.seen is None or self.seen.path != self.db_seen:
+            if self.seen is not None: self.seen.close()
+            self.seen = SeenIndex(self.db_seen, prefilter=self.SEEN_PREFILTER)
+        return self.seen
+
+    def degree_graph(self):
+        """
+        Returns:
+            graph (DegreeGraph): In-memory graph of the degree table, loaded from degree_path once and refreshed
+                with the rows added since on every call
+        """
+        if self.graph is None or self.graph.path != self.degree_path:
+            self.graph = DegreeGraph(self.degree_path)
+        else:
+            self.graph.refresh()
+        return self.graph
+
+    def degree_separation(self, grade, seeds, max_depth=None, refresh=None, batch_size=100):
+        """
+        Proceed to gradually discover Instagram users from already visited, one BFS step per call.
+        The crawl table records the depth at which every user was discovered and when its stories were last fetched,
+        only the frontier (users never fetched, or fetched more than refresh seconds ago) is fetched.
+        Progress is committed by the writer thread every batch_size users, or every WRITER_DELAY seconds, while the next
+        users are fetched, so an interrupted call resumes where it stopped.
+        Users whose reel could not be retrieved stay in the frontier.
+        Args:
+            grade (int): Eventually initialize the database with the Seeds
+            seeds: List of seeds to start the discovery from
+            max_depth (int): Users discovered deeper than this are not fetched, None for no limit.
+            refresh (float): Seconds after which a fetched user is fetched again, None to fetch every user once.
+            batch_size (int): Users fetched between two checkpoints.
+        Returns:
+            fetched (int): Number of users fetched successfully.
+        """
+        path, writer = self.degree_path, self.writer_thread()
+
+        def connect():
+            db = sqlite3.connect(path)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS degree(source TEXT, refered TEXT, PRIMARY KEY(source, refered));
+                CREATE INDEX IF NOT EXISTS degree_refered ON degree(refered);
+                CREATE TABLE IF NOT EXISTS crawl(user_id TEXT PRIMARY KEY, depth INTEGER, last_fetched REAL);
+                CREATE INDEX IF NOT EXISTS crawl_frontier ON crawl(last_fetched, depth);
             ''')
-            db.commit()
-            for seed in seeds:
-                cursor.execute('''
-                INSERT OR IGNORE INTO degree(source, refered) VALUES(?,?)''',
-                               (seed, None))  
-            db.commit()
-
-        cursor.execute('''SELECT source, refered FROM degree''')
-        rows = cursor.fetchall()
-        check = set()
-        for row in rows:
-            check.add(row[0])
-            check.add(row[1])
-        if None in check:
-            check.remove(None)
-
-        self.users_stories(list(check))
-
-        for story in self.res:
-            curr = story.discovered()
-            if curr:  # If we have at least a discovery....
-                for pair in curr:  # Then for each discovery add the tuple to the db
-                    cursor.execute('''INSERT OR IGNORE INTO degree(source, refered) VALUES(?,?)''',
-                                   (str(pair[0]), str(pair[1])))
-        db.commit()
+            if db.execute('SELECT 1 FROM crawl LIMIT 1').fetchone() is None:
+                self.backfill_crawl(db)
+            return db
+
+        def frontier():
+            db = writer.resource(('degree', path), connect)
+            if grade == 0:
+                with db:
+                    for seed in seeds:
+                        db.execute('''INSERT OR IGNORE INTO degree(source, refered) VALUES(?,?)''', (str(seed), None))
+                        db.execute('''INSERT OR IGNORE INTO crawl(user_id, depth) VALUES(?,0)''', (str(seed),))
+                        db.execute('''UPDATE crawl SET depth = 0 WHERE user_id = ?''', (str(seed),))
+
+            query, params = '''SELECT user_id, depth FROM crawl WHERE (last_fetched IS NULL''', []
+            if refresh is not None:
+                query, params = query + ' OR last_fetched < ?', params + [time.time() - refresh]
+            query += ')'
+            if max_depth is not None:
+                query, params = query + ' AND depth <= ?', params + [max_depth]
+            return db.execute(query + ' ORDER BY depth, user_id', params).fetchall()
+
+        def checkpoint(batch):
+            """ The edges found, the users discovered and the users fetched, at once """
+            db = writer.resource(('degree', path), connect)
+            with db:
+                for user_id, depth, pairs, _ in batch:
+                    db.executemany('''INSERT OR IGNORE INTO degree(source, refered) VALUES(?,?)''', pairs)
+                    db.executemany('''INSERT OR IGNORE INTO crawl(user_id, depth) VALUES(?,?)''',
+                                   [(refered, depth) for _, refered in pairs])
+                    db.executemany('''UPDATE crawl SET depth = ? WHERE user_id = ? AND depth > ?''',
+                                   [(depth, refered, depth) for _, refered in pairs])
+                db.executemany('''UPDATE crawl SET last_fetched = ? WHERE user_id = ?''',
+                               [(fetched_at, user_id) for user_id, _, _, fetched_at in batch])
+
+        frontier = writer.call(frontier)
+        depths = dict(frontier)
+        print("Frontier of {} users".format(len(frontier)))
+
+        writer.register('crawl', checkpoint, batch_size)
+        fetched = 0
+        for user_id, stories in self.iter_user_reels(user_id for user_id, _ in frontier):
+            if stories is None: continue  # Not fetched, left in the frontier for the next call
+            pairs = [(str(pair[0]), str(pair[1])) for story in stories for pair in story.discovered()]
+            writer.put('crawl', (user_id, depths[user_id] + 1, pairs, time.time()))
+            fetched += 1
+        writer.flush()
+        return fetched
+
+    @staticmethod
+    def backfill_crawl(db):
+        """
+        Fill the crawl table of a degree table written before it existed: seeds are at depth 0, the depth of the others
+        is their distance from the seeds, and the users that referred someone were already fetched, at an unknown time.
+        """
+        depths = {source: 0 for source, in db.execute('''SELECT source FROM degree WHERE refered IS NULL''')}
+        frontier, depth = list(depths), 0
+        while frontier:
+            depth += 1
+            found = []
+            for start in range(0, len(frontier), 500):
+                sources = frontier[start:start + 500]
+                found.extend(refered for refered, in db.execute(
+                    '''SELECT refered FROM degree WHERE source IN ({}) AND refered IS NOT NULL'''.format(
+                        ",".join("?" * len(sources))), sources))
+            frontier = [user_id for user_id in dict.fromkeys(found) if user_id not in depths]
+            depths.update((user_id, depth) for user_id in frontier)
+
+        fetched = {source for source, in db.execute('''SELECT DISTINCT source FROM degree WHERE refered IS NOT NULL''')}
+        referred = {refered for refered, in db.execute('''SELECT DISTINCT refered FROM degree WHERE refered IS NOT NULL''')}
+        with db:  # Users not reachable from the seeds are crawled as seeds
+            db.executemany('''INSERT OR IGNORE INTO crawl(user_id, depth, last_fetched) VALUES(?,?,?)''',
+                           [(user_id, depths.get(user_id, 0), 0 if user_id in fetched else None)
+                            for user_id in set(depths) | fetched | referred])
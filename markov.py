@@ -1,40 +1,599 @@
+import os
 import string
+import struct
+import sys
 import re
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
-from random import choice
+from functools import partial
+from mmap import mmap as MMAP, ACCESS_READ
+from multiprocessing import Pool, cpu_count
+from random import choice, randrange
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError as e:
+    HAS_NUMPY = False
+
+TOKEN_RE = re.compile(r"[\w']+|[.,!?;]")
+WORD_CHAR_RE = re.compile(r"[\w']")  # A chunk ending with one of them may end in the middle of a word
+
+MODEL_MAGIC, MODEL_VERSION = b"MKPY", 1
+MODEL_HEADER = struct.Struct("<4sHBBQ")  # Magic, version, order, little endian, vocabulary size
+MODEL_SECTION = struct.Struct("<QQ")  # Offset and length in bytes of every array
+
+
+class MappedVocabulary():
+    """ Read-only id -> word view over the vocabulary blob of a saved model, decoding words on access """
+
+    def __init__(self, offsets, blob):
+        self.offsets, self.blob = offsets, blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idd):
+        return str(self.blob[self.offsets[idd]:self.offsets[idd + 1]], "utf-8")
+
+
+class CompactTransitions():
+    """
+    Count-based transition table over integer word ids, for chains of order 1 up to order.
+    While training, the n-grams are counted in one flat dictionary per order, keyed by the word ids packed
+    in a single integer. With NumPy, the counts merged from other tables are kept apart as sorted arrays.
+    They are compiled on demand into one CSR level per order: the states are the nodes
+    of a trie (key = parent node * vocabulary size + last word id, sorted) and every node owns a row of
+    successors ids and weights delimited by offsets. The weights are cumulative over the whole level, so
+    a row can be sampled with a single binary search, row by row or vectorized.
+    """
+    ID_BITS = 32
+
+    def __init__(self, order=1):
+        """
+        Args:
+            order (int): Maximum number of words in a state.
+        """
+        if order < 1: raise ValueError("order must be at least 1")
+        self.order = order
+        self.vocab = []  # Id -> Word
+        self.ids = {}  # Word -> Id
+        self.counts = [defaultdict(int) for _ in range(order)]  # Packed (State..., Successor) -> Occurrences
+        self.starts = defaultdict(int)  # Id -> Occurrences, the distribution of the start words
+        self.merged = [None] * order  # Per order: (ids, occurrences) of the merged transitions, sorted, see merge
+        self.levels = []  # Per order: (keys, offsets, successors, weights)
+        self.start_weights = array('Q')  # Cumulative occurrences of the words, by id
+        self.size = 0  # Vocabulary size used for the trie keys of the compiled levels
+        self.dirty = True  # The levels are out of date with the counts
+        self.readonly = False
+
+    def intern(self, word):
+        """
+        Args:
+            word (string): Word to convert.
+        Returns:
+            idd (int): Integer id of the word, a new one is assigned the first time a word is seen.
+        """
+        idd = self.ids.get(word)
+        if idd is None:
+            idd = self.ids[word] = len(self.vocab)
+            self.vocab.append(word)
+        return idd
+
+    def add(self, state, successor, n=1):
+        """
+        Count n more occurrences of the transition state -> successor
+        Args:
+            state (Sequence): Ids of the words of the state, from 1 to order of them.
+            successor (int): Id of the following word.
+        """
+        key = 0
+        for idd in state:
+            key = key << self.ID_BITS | idd
+        self.counts[len(state) - 1][key << self.ID_BITS | successor] += n
+        self.dirty = True
+
+    def count(self, seq, start=0, across=False):
+        """
+        Count the transitions of every order whose successor is in seq[start:].
+        Args:
+            seq (Sequence): Word ids, the ones before start are only used as states.
+            start (int): Index of the first new word.
+            across (bool): Only count the transitions whose state begins before start, the new words
+                having already been counted on their own (merge of a training shard).
+        """
+        bits, counts, starts = self.ID_BITS, self.counts, self.starts
+        for index in range(start, len(seq)):
+            key = seq[index]
+            if not across: starts[key] += 1
+            for n in range(min(self.order, index)):
+                key |= seq[index - n - 1] << (bits * (n + 1))
+                if not across or index - n - 1 < start:
+                    counts[n][key] += 1
+        self.dirty = True
+
+    def export(self):
+        """
+        Returns:
+            partial (Tuple): Vocabulary, then for every order the word ids of the counted transitions
+                (one row of state and successor ids per transition, flattened) with their occurrences, and the start
+                counts. Arrays are cheap to send to another process and to merge with NumPy.
+        """
+        counts = []
+        for order in range(self.order):
+            slots, occurrences = self._slots(order)
+            if self.merged[order] is not None:
+                slots.frombytes(self.merged[order][0].tobytes())
+                occurrences.frombytes(self.merged[order][1].tobytes())
+            counts.append((slots, occurrences))
+        return self.vocab, counts, dict(self.starts)
+
+    def _slots(self, order):
+        """
+        Returns:
+            slots, occurrences (Tuple): Word ids of the transitions counted in the dictionary of an order,
+                order + 2 ids per transition, and their occurrences.
+        """
+        bits = self.ID_BITS
+        mask = (1 << bits) - 1
+        slots, table = array('I'), self.counts[order]
+        for key in table:
+            slots.extend([key >> (bits * slot) & mask for slot in range(order + 1, -1, -1)])
+        return slots, array('Q', table.values())
+
+    def merge(self, partials):
+        """
+        Add the counts exported by other tables, built on the same kind of text with their own word ids.
+        With NumPy they are summed as arrays into merged, without a dictionary entry per transition.
+        Args:
+            partials (List): Results of export, their words are interned in this order.
+        Returns:
+            remaps (List): For every partial table, the id in this table of each of its word ids.
+        """
+        remaps = []
+        for vocab, _, starts in partials:
+            remap = [self.intern(word) for word in vocab]  # Words are interned in their order of appearance
+            for idd, n in starts.items():
+                self.starts[remap[idd]] += n
+            remaps.append(remap)
+
+        for order, mine in enumerate(self.counts):
+            width = order + 2
+            if HAS_NUMPY:
+                parts = [(np.asarray(remap, dtype=np.uint32)[np.frombuffer(counts[order][0], dtype=np.uint32)],
+                          np.frombuffer(counts[order][1], dtype=np.uint64))
+                         for remap, (_, counts, _) in zip(remaps, partials)]
+                self.merged[order] = self._reduce(parts + [self.merged[order]], width)
+                continue
+            for remap, (_, counts, _) in zip(remaps, partials):
+                slots, occurrences = counts[order]
+                keys = self._remap_keys(remap, slots, width)
+                if not mine:
+                    mine.update(zip(keys, occurrences))
+                else:
+                    for key, n in zip(keys, occurrences):
+                        mine[key] += n
+
+        self.dirty = True
+        return remaps
+
+    def _reduce(self, parts, width):
+        """
+        Args:
+            parts (List): Tuples (ids, occurrences) of NumPy arrays, width ids per transition, None are skipped.
+            width (int): Number of word ids of each transition.
+        Returns:
+            ids, occurrences (Tuple): Matrix of the distinct transitions, sorted as their packed keys, and their
+                total occurrences.
+        """
+        parts = [part for part in parts if part is not None]
+        ids = np.concatenate([part[0].reshape(-1, width) for part in parts] + [np.zeros((0, width), dtype=np.uint32)])
+        occurrences = np.concatenate([part[1] for part in parts] + [np.zeros(0, dtype=np.uint64)])
+        if not len(occurrences): return ids, occurrences
+
+        wide, size = ids.astype(np.uint64), max(len(self.vocab), 1)
+        if size ** width <= 2 ** 64:  # The ids fit in a single 64 bits key in base size, sorted as the rows
+            columns = [wide[:, 0]]
+            for col in range(1, width):
+                columns[0] = columns[0] * np.uint64(size) + wide[:, col]
+            rank = np.argsort(columns[0])
+        else:  # Pack them two by two in 64 bits columns, then sort by all of them
+            columns = [wide[:, 0]] if width % 2 else []
+            columns += [wide[:, col] << np.uint64(self.ID_BITS) | wide[:, col + 1] for col in range(width % 2, width, 2)]
+            rank = np.lexsort(columns[::-1])  # The last column is the least significant
+        new = np.zeros(len(rank), dtype=bool)
+        new[0] = True
+        for column in columns:
+            column = column[rank]
+            new[1:] |= column[1:] != column[:-1]
+        first = np.flatnonzero(new)  # First row of every distinct transition
+        return ids[rank[first]], np.add.reduceat(occurrences[rank], first)
+
+    def _remap_keys(self, remap, slots, width):
+        """
+        Args:
+            remap (List): Id in this table of every word id of the other table.
+            slots (array): Word ids of the transitions of the other table, width ids per transition.
+            width (int): Number of word ids of each transition.
+        Returns:
+            keys (List): Packed keys of the transitions, with the ids of this table.
+        """
+        keys = []  # Only used without NumPy, see _reduce
+        for row in range(0, len(slots), width):
+            key = 0
+            for idd in slots[row:row + width]:
+                key = key << self.ID_BITS | remap[idd]
+            keys.append(key)
+        return keys
+
+    def compile(self):
+        """ Rebuild the CSR levels from the transition counts """
+        size = len(self.vocab)
+        if HAS_NUMPY and any(merged is not None for merged in self.merged):
+            levels = self._compile_merged(size)
+        else:
+            levels = self._compile_counts(size)
+        start_weights, total = array('Q'), 0
+        for idd in range(size):
+            total += self.starts.get(idd, 0)
+            start_weights.append(total)
+        self.levels, self.start_weights, self.size = levels, start_weights, size
+        self.dirty = False
+
+    def _compile_counts(self, size):
+        """ CSR levels of the dictionaries of counts """
+        bits = self.ID_BITS
+        mask = (1 << bits) - 1
+        levels, parents = [], None
+        for counts in self.counts:
+            keys, offsets, successors, weights = array('Q'), array('Q', [0]), array('I'), array('Q')
+            nodes, state, total = {}, None, 0
+            for key in sorted(counts):
+                if key >> bits != state:  # First successor of a new state
+                    if state is not None: offsets.append(len(successors))
+                    state = key >> bits
+                    nodes[state] = len(keys)
+                    parent = parents[state >> bits] if parents is not None else 0
+                    keys.append(parent * size + (state & mask))
+                total += counts[key]
+                successors.append(key & mask)
+                weights.append(total)
+            if state is not None: offsets.append(len(successors))
+            levels.append((keys, offsets, successors, weights))
+            parents = nodes  # The prefix of every state is a state of the previous order
+        return levels
+
+    def _compile_merged(self, size):
+        """ CSR levels of the merged arrays, vectorized, the dictionaries of counts being folded into them first """
+        levels = []
+        for order in range(self.order):
+            width = order + 2
+            if self.counts[order]:
+                slots, occurrences = self._slots(order)
+                self.merged[order] = self._reduce([self.merged[order], (np.frombuffer(slots, dtype=np.uint32),
+                                                   np.frombuffer(occurrences, dtype=np.uint64))], width)
+                self.counts[order].clear()
+            ids, occurrences = self.merged[order] or (np.zeros((0, width), dtype=np.uint32), np.zeros(0, np.uint64))
+
+            new = np.zeros(len(ids), dtype=bool)  # First successor of a new state
+            new[:1] = True
+            for col in range(width - 1):
+                new[1:] |= ids[1:, col] != ids[:-1, col]
+            first = np.flatnonzero(new)
+            node = np.zeros(len(first), dtype=np.uint64)
+            for level, col in zip(levels, range(order)):  # Node of the prefix of every state, down the trie
+                keys = np.frombuffer(level[0], dtype=np.uint64)
+                node = np.searchsorted(keys, node * np.uint64(size) + ids[first, col]).astype(np.uint64)
+            sections = (node * np.uint64(size) + ids[first, order], np.append(first, len(ids)), ids[:, -1],
+                        np.cumsum(occurrences, dtype=np.uint64))
+            level = []
+            for section, fmt in zip(sections, "QQIQ"):
+                level.append(array(fmt))
+                level[-1].frombytes(section.astype(np.dtype(fmt)).tobytes())
+            levels.append(tuple(level))
+        return levels
+
+    def freeze(self):
+        """ Compile the table and drop the training counts, only the arrays used for sampling are kept """
+        if self.dirty: self.compile()
+        self.ids, self.counts, self.starts, self.merged = None, None, None, None
+        self.readonly = True
+
+    def start(self):
+        """
+        Returns:
+            start (int): Id of a word chosen proportionally to its occurrences, None if the table is empty.
+        """
+        if self.dirty: self.compile()
+        if not len(self.start_weights) or not self.start_weights[-1]: return None
+        return bisect_right(self.start_weights, randrange(self.start_weights[-1]))
+
+    def find(self, state):
+        """
+        Args:
+            state (Sequence): Ids of the words of the state.
+        Returns:
+            node (int): Index of the state in its CSR level, None if the state has no successors.
+        """
+        if self.dirty: self.compile()
+        node = 0
+        for level, idd in zip(self.levels, state):
+            keys = level[0]
+            key = node * self.size + idd
+            node = bisect_left(keys, key)
+            if node == len(keys) or keys[node] != key: return None
+        return node
+
+    def sample(self, history):
+        """
+        Args:
+            history (Sequence): Ids of the last words generated.
+        Returns:
+            successor (int): Id of a following word, chosen proportionally to its count, or None if there are none.
+                The longest state (up to order words) with successors is used, backing off to shorter ones.
+        """
+        for n in range(min(self.order, len(history)), 0, -1):
+            node = self.find(history[-n:])
+            if node is None: continue
+            _, offsets, successors, weights = self.levels[n - 1]
+            lo, hi = offsets[node], offsets[node + 1]
+            base = weights[lo - 1] if lo else 0
+            return successors[bisect_right(weights, base + randrange(weights[hi - 1] - base), lo, hi)]
+        return None
+
+    def save(self, f):
+        """
+        Write the compiled table in the binary model format: a header, the table of sections, then the
+        vocabulary (offsets and utf-8 blob), the start weights and the four arrays of every level,
+        each section aligned on 8 bytes.
+        Args:
+            f: File object opened in binary mode.
+        """
+        if self.dirty: self.compile()
+        blob, vocab_offsets = bytearray(), array('Q', [0])
+        for idd in range(self.size):
+            blob += self.vocab[idd].encode("utf-8")
+            vocab_offsets.append(len(blob))
+        sections = [vocab_offsets, blob, self.start_weights] + [x for level in self.levels for x in level]
+
+        position = MODEL_HEADER.size + MODEL_SECTION.size * len(sections)
+        table = []
+        for section in sections:
+            position += -position % 8
+            length = memoryview(section).nbytes
+            table.append(MODEL_SECTION.pack(position, length))
+            position += length
+
+        f.write(MODEL_HEADER.pack(MODEL_MAGIC, MODEL_VERSION, self.order, sys.byteorder == "little", self.size))
+        f.write(b"".join(table))
+        written = MODEL_HEADER.size + MODEL_SECTION.size * len(sections)
+        for section in sections:
+            f.write(bytes(-written % 8))
+            written += -written % 8
+            data = memoryview(section).cast('B')
+            f.write(data)
+            written += data.nbytes
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Read a table written by save. The result can only be sampled, not trained further.
+        Args:
+            path (string): Path of the model file.
+            mmap (bool): Map the file and sample directly from it, sharing the pages between processes.
+                Otherwise the file is read in memory.
+        Returns:
+            table (CompactTransitions): Table whose arrays are views over the file content.
+        """
+        with open(path, 'rb') as f:
+            buf = MMAP(f.fileno(), 0, access=ACCESS_READ) if mmap else f.read()
+        view = memoryview(buf)
+
+        if len(view) < MODEL_HEADER.size: raise ValueError("{} is not a MarkovPy model".format(path))
+        magic, version, order, little, size = MODEL_HEADER.unpack_from(view)
+        if magic != MODEL_MAGIC: raise ValueError("{} is not a MarkovPy model".format(path))
+        if version != MODEL_VERSION: raise ValueError("Unsupported model version {}".format(version))
+        if bool(little) != (sys.byteorder == "little"): raise ValueError("Model saved with another byte order")
+
+        formats = ['Q', 'B', 'Q'] + ['Q', 'Q', 'I', 'Q'] * order
+        sections = []
+        for idx, fmt in enumerate(formats):
+            offset, length = MODEL_SECTION.unpack_from(view, MODEL_HEADER.size + idx * MODEL_SECTION.size)
+            sections.append(view[offset:offset + length].cast(fmt))
+
+        table = cls(order)
+        table.vocab = MappedVocabulary(sections[0], sections[1])
+        table.ids, table.counts, table.starts = None, None, None
+        table.start_weights, table.size = sections[2], size
+        table.levels = [tuple(sections[3 + 4 * n:7 + 4 * n]) for n in range(order)]
+        table.dirty, table.readonly = False, True
+        return table
+
+
+def read_shard(path, start=0, end=None, encoding="utf-8"):
+    """
+    Yield the lines of a file beginning between the byte offsets start (included) and end (excluded).
+    Args:
+        path (string): Path of the text file.
+        start (int): Offset of the first byte of the shard.
+        end (int): Offset of the end of the shard, None for the end of the file.
+    """
+    with open(path, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()  # Skip the line started in the previous shard
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line: break
+            yield line.decode(encoding, errors="replace")
+
+
+def split_shards(paths, n_shards):
+    """
+    Args:
+        paths (List): Paths of the text files.
+        n_shards (int): Number of shards to split a single file into.
+    Returns:
+        shards (List): Tuples (path, start, end), one per file or n_shards byte ranges of a single file.
+    """
+    if len(paths) != 1: return [(path, 0, None) for path in paths]
+    size = os.path.getsize(paths[0])
+    bounds = [size * idx // n_shards for idx in range(n_shards)] + [None]
+    return [(paths[0], bounds[idx], bounds[idx + 1]) for idx in range(n_shards)]
+
+
+def train_shard(shard, order=1, double_punct=False, keep_source=True, encoding="utf-8"):
+    """
+    Train a compact model on a single shard, in a worker process.
+    Returns:
+        partial (Tuple): Vocabulary, transitions counts and start counts of the shard, then its first and
+            last words ids (to link it with its neighbours) and its word ids if keep_source.
+    """
+    path, start, end = shard
+    model = MarkovPy(compact=True, order=order, keep_source=keep_source)
+    model.DOUBLE_PUNCT = double_punct
+    context = max(order, 2)
+    head = []
+    for line in read_shard(path, start, end, encoding):
+        ids = [model.transitions.intern(x.lower()) for x in TOKEN_RE.findall(line)]
+        if len(head) < context: head += ids[:context - len(head)]
+        model._link_compact(ids)
+    return model.transitions.export() + (head, model._tail, model.words)
 
 
 class MarkovPy():
     DOUBLE_PUNCT = False
 
-    def __init__(self, txt=""):
+    def __init__(self, txt="", compact=False, order=1, keep_source=True):
+        """
+        Args:
+            txt (String or Iterable): Initial source material.
+            compact (bool): Store word ids and transitions counts in a CompactTransitions table
+                instead of the list of following words in nextransition.
+            order (int): Number of previous words the next one depends on. Orders above 1 always use the
+                compact table, and fall back to shorter states when the longest one has no successors.
+            keep_source (bool): Keep the raw text in sourcetxt and the stream of words in words. Without them
+                only the transitions and the occurrences of every word (to pick the start words) are kept,
+                which always uses the compact table.
+        """
+        if order < 1: raise ValueError("order must be at least 1")
         self.sourcetxt = ""
-        self.words = []
-        self.nextransition = defaultdict(list)
+        self.order = order
+        self.keep_source = keep_source
+        self.compact = compact or order > 1 or not keep_source
+        if self.compact:
+            self.words = array('I') if keep_source else None  # Stream of word ids
+            self.nextransition = None
+            self.transitions = CompactTransitions(order)
+        else:
+            self.words = []
+            self.nextransition = defaultdict(list)
+            self.transitions = None
+        self._tail = []  # Last words seen, used to link the next chunk of text
 
         if txt:
             self.morewords(txt)
 
     def morewords(self, txt=""):
         """
-        Add text to the source material. Process the new list of words and the transitions dictionary
+        Add text to the source material. Only the new words are processed, linking the first of them
+        to the last words already seen so that chunked ingestion builds the same transitions.
+        Args:
+        txt (String or Iterable): Text to add to the source material. An iterable of strings (file object,
+            generator, list of lines, blocks of f.read(n)...) is streamed chunk by chunk and is not kept in
+            sourcetxt. A word split between two chunks is read as one word.
+        """
+        if self.compact and self.transitions.readonly: raise ValueError("A loaded or frozen model can not be trained further")
+
+        if isinstance(txt, str):
+            if self.keep_source: self.sourcetxt += txt + " "
+            chunks = (txt,)
+        else:
+            chunks = txt
+
+        carry = ""  # Word ending the previous chunk, that the next chunk may continue
+        for chunk in chunks:
+            chunk = carry + chunk
+            tokens = TOKEN_RE.findall(chunk)  # Split word and punctuations symbols
+            carry = tokens.pop() if tokens and WORD_CHAR_RE.match(chunk[-1]) else ""
+            self._add_tokens(tokens)
+        if carry: self._add_tokens([carry])
+
+    def _add_tokens(self, tokens):
+        """ Link the tokens of a chunk of text, lowercased """
+        tokens = [x.lower() for x in tokens]
+        if self.compact:
+            self._link_compact([self.transitions.intern(x) for x in tokens])
+        else:
+            self._link(tokens)
+
+    def freeze(self):
+        """
+        Stop training: drop the source text, the words and the training counts of the compact table, so that
+        a long-running generator only keeps the compiled transitions in memory.
+        """
+        if not self.compact: raise ValueError("freeze requires the compact table (compact=True)")
+        self.transitions.freeze()
+        self.sourcetxt, self.words, self.keep_source = "", None, False
+
+    def _link(self, tokens):
+        """
+        Append the new tokens to the words list and add their transitions.
+        Args:
+            tokens (List): Lowercase tokens of the new chunk of text.
+        """
+        if not tokens: return
+
+        seq = self._tail + tokens  # Previous chunk boundary followed by the new words
+        start = len(self._tail)
+        self.words += tokens
+
+        for index in range(max(start - 1, 0), len(seq) - 1):  # Only pairs ending on a new word
+            self.nextransition[seq[index]].append(
+                seq[index + 1])  # For each word append the next element as the possible following element
+
+        # Experimental option: Chain together words separated by punctuations symbols.
+
+        if self.DOUBLE_PUNCT:
+            for index in range(max(start - 2, 0), len(seq) - 2):  # Only triplets ending on a new word
+                if (seq[index] not in string.punctuation and
+                    seq[index + 1] in string.punctuation):
+
+                    self.nextransition[seq[index]].append(seq[index + 2])
+
+        self._tail = seq[-2:]  # Keep enough context to link the next chunk
+
+    def _link_compact(self, ids):
+        """
+        Same as _link, counting the transitions between word ids in the compact table.
         Args:
-        txt (String): Text to add to the source material
+            ids (List): Word ids of the new chunk of text.
         """
-        self.sourcetxt += txt + " "
-        self.words += [x.lower() for x in re.findall(r"[\w']+|[.,!?;]", txt)]  # Split word and punctuations symbols
-        for index, element in enumerate(self.words[:-1]):  # Loop over the words, skipping the last one
-            self.nextransition[element].append(
-                self.words[index + 1])  # For each word append the next element as the possible following element
+        if not ids: return
+
+        seq = self._tail + ids
+        start = len(self._tail)
+        if self.keep_source: self.words.extend(ids)
+        table = self.transitions
+
+        table.count(seq, start)  # Transitions of every order ending on a new word
+        self._count_double_punct(seq, start)
+
+        self._tail = seq[-max(self.order, 2):]
+
+    def _count_double_punct(self, seq, start, across=False):
+        """ DOUBLE_PUNCT transitions of the compact table, for the triplets ending on a new word """
+        if not self.DOUBLE_PUNCT: return
 
-            # Experimental option: Chain together words separated by punctuations symbols.
+        table = self.transitions
+        vocab = table.vocab
+        for index in range(max(start - 2, 0), start if across else len(seq) - 2):
+            if (index + 2 < len(seq) and
+                vocab[seq[index]] not in string.punctuation and
+                vocab[seq[index + 1]] in string.punctuation):
 
-            if self.DOUBLE_PUNCT:
-                if (self.words[index] not in string.punctuaction and
-                    self.words[index + 1] in string.punctuation and
-                    index + 2 < len(self.words)):
-                    
-                    self.nextransition[element].append(self.words[index + 2])
+                table.add(seq[index:index + 1], seq[index + 2])
 
     def random_wordsgeneration(self, n=10):
         """
@@ -44,20 +603,183 @@ class MarkovPy():
         Returns:
             generated (string): A string containing the generated output.
         """
-        if not self.words or not n or n < 0: return ""  # Sanity check on the number of words to generate
+        if not n or n < 0: return ""  # Sanity check on the number of words to generate
+
+        generated = list(self.iter_generate(n))
+        return " " + " ".join(generated) if generated else ""
+
+    def iter_generate(self, n=None):
+        """
+        Lazily generate random words, yielding each one as soon as it is chosen.
+        Args:
+            n (int): Numbers of words to generate, None to never stop.
+        Yields:
+            word (string): The next generated word.
+        """
+        if n is not None and n <= 0: return
+        if self.compact:
+            yield from self._compact_generate(n)
+            return
 
-        generated = ""
+        if not self.words: return
 
         randomword = choice(self.words)
-        generated += " " + randomword
-        n -= 1
+        yield randomword
+        generated = 1
 
-        while n > 0:
+        while n is None or generated < n:
             if self.nextransition[randomword]:  # If a possibile next transition exist... 
                 randomword = choice(self.nextransition[randomword])
             else:  # Else start over from a random words  
                 randomword = choice(self.words)
-            generated += " " + randomword
-            n -= 1
+            yield randomword
+            generated += 1
+
+    def _compact_generate(self, n):
+        """ iter_generate over the compact table, backing off to shorter states before starting over """
+        if n is not None and n <= 0: return
+        vocab, table = self.transitions.vocab, self.transitions
+        state = table.start()
+        if state is None: return
+        history = [state]
+        yield vocab[state]
+        generated = 1
+
+        while n is None or generated < n:
+            state = table.sample(history)
+            if state is None:  # Else start over from a random words
+                state = table.start()
+                history = []
+            history.append(state)
+            del history[:-self.order]
+            yield vocab[state]
+            generated += 1
+
+    def generate_batch(self, n_sequences, length, seed=None, ids=False):
+        """
+        Generate many sequences at once, advancing all the chains together with NumPy.
+        Every sequence follows the same distribution as random_wordsgeneration.
+        Args:
+            n_sequences (int): Numbers of sequences to generate.
+            length (int): Numbers of words of each sequence.
+            seed: Seed of the NumPy random generator, the same seed gives the same output.
+            ids (bool): Return the matrix of word ids instead of the joined strings.
+        Returns:
+            generated: Matrix (n_sequences x length) of word ids in transitions.vocab, or list of strings.
+        """
+        if not HAS_NUMPY: raise ImportError("generate_batch requires numpy")
+        if not self.compact: raise ValueError("generate_batch requires the compact table (compact=True)")
+
+        rng = np.random.default_rng(seed)
+        table = self.transitions
+        if table.dirty: table.compile()
+        start_weights = np.frombuffer(table.start_weights, dtype=np.uint64)
+        levels = [tuple(np.frombuffer(x, dtype=memoryview(x).format) for x in level) for level in table.levels]
+        out = np.zeros((n_sequences, max(length, 0)), dtype=np.uint32)
+        if not len(start_weights) or not start_weights[-1] or not out.size:
+            return out if ids else [""] * n_sequences
+
+        def start(k):  # Draw k start words proportionally to their occurrences
+            return np.searchsorted(start_weights, rng.integers(start_weights[-1], size=k), side='right')
+
+        out[:, 0] = start(n_sequences)
+        history = np.ones(n_sequences, dtype=np.int64)  # Words generated since the last start over
+
+        for t in range(1, length):
+            pending = np.ones(n_sequences, dtype=bool)
+            nxt = np.zeros(n_sequences, dtype=np.uint32)
+            for n in range(min(self.order, t), 0, -1):  # Longest state first, then back off
+                rows = np.flatnonzero(pending & (history >= n))
+                if not len(rows): continue
+                node = np.zeros(len(rows), dtype=np.uint64)
+                found = np.ones(len(rows), dtype=bool)
+                for level, col in zip(levels, range(t - n, t)):  # Walk the trie down to the state
+                    keys = level[0]
+                    key = node * np.uint64(table.size) + out[rows, col]
+                    node = np.minimum(np.searchsorted(keys, key), max(len(keys) - 1, 0)).astype(np.uint64)
+                    found &= (keys[node] == key) if len(keys) else False
+                rows, node = rows[found], node[found]
+                _, offsets, successors, weights = levels[n - 1]
+                lo, hi = offsets[node], offsets[node + 1]
+                base = np.where(lo > 0, weights[np.maximum(lo, 1) - 1], 0)
+                r = base + rng.integers(weights[hi - 1] - base).astype(np.uint64)
+                nxt[rows] = successors[np.searchsorted(weights, r, side='right')]
+                pending[rows] = False
+            restart = np.flatnonzero(pending)  # Else start over from a random words
+            nxt[restart] = start(len(restart))
+            history = np.minimum(history + 1, self.order)
+            history[restart] = 1
+            out[:, t] = nxt
+
+        if ids: return out
+        used, inverse = np.unique(out, return_inverse=True)  # Only decode the words that were generated
+        vocab = np.array([table.vocab[idd] for idd in used.tolist()], dtype=object)
+        return [" ".join(row) for row in vocab[inverse.reshape(out.shape)]]
+
+    def save(self, path):
+        """
+        Save the trained model in a binary file that load can map in memory.
+        Args:
+            path (string): Path of the model file.
+        """
+        if not self.compact: raise ValueError("save requires the compact table (compact=True)")
+        with open(path, 'wb') as f:
+            self.transitions.save(f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a model written by save, without re-training it. Loaded models can generate text but not
+        learn more words, and have no sourcetxt nor words.
+        Args:
+            path (string): Path of the model file.
+            mmap (bool): Sample directly from the memory-mapped file, so that forked workers share one copy.
+        Returns:
+            model (MarkovPy): The loaded model.
+        """
+        table = CompactTransitions.load(path, mmap=mmap)
+        model = cls(compact=True, order=table.order, keep_source=False)
+        model.transitions = table
+        return model
+
+    @classmethod
+    def train_parallel(cls, paths, order=1, processes=None, keep_source=True, encoding="utf-8"):
+        """
+        Train a compact model on text files with a pool of processes. Every worker counts the transitions
+        of a shard (a whole file, or one range of lines per process when there is a single file), then the partial
+        tables are merged in order with the transitions spanning consecutive shards. With NumPy the merge and the
+        compilation are vectorized, so the work left to this process is small next to the one of the workers.
+        The result is the same model as feeding the files one after the other to morewords.
+        Args:
+            paths (List or string): Paths of the text files.
+            order (int): Order of the chain.
+            processes (int): Number of worker processes, all the cores by default.
+            keep_source (bool): Keep the stream of words in words, see __init__.
+        Returns:
+            model (MarkovPy): The trained model.
+        """
+        if isinstance(paths, str): paths = [paths]
+        processes = processes or cpu_count()
+        model = cls(compact=True, order=order, keep_source=keep_source)
+        table = model.transitions
+        worker = partial(train_shard, order=order, double_punct=model.DOUBLE_PUNCT, keep_source=keep_source,
+                         encoding=encoding)
+
+        with Pool(processes) as pool:
+            partials = list(pool.imap(worker, split_shards(paths, processes)))
+        remaps = table.merge([shard[:3] for shard in partials])
+
+        for remap, (_, _, _, head, tail, words) in zip(remaps, partials):
+            if not head: continue
+            seq = model._tail + [remap[idd] for idd in head]  # Transitions spanning the two shards
+            table.count(seq, len(model._tail), across=True)
+            model._count_double_punct(seq, len(model._tail), across=True)
+            model._tail = (model._tail + [remap[idd] for idd in tail])[-max(order, 2):]
 
-        return generated
+            if not keep_source: continue
+            if HAS_NUMPY:
+                ids = np.asarray(remap, dtype=np.uint32)[np.frombuffer(words, dtype=np.uint32)]
+                model.words.frombytes(ids.tobytes())
+            else:
+                model.words.extend(map(remap.__getitem__, words))
+        return model
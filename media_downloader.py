@@ -0,0 +1,176 @@
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+
+from request_scheduler import RequestScheduler
+
+EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/heic": ".heic",
+              "video/mp4": ".mp4"}
+
+
+class MediaDownloader:
+    """
+    Download the photos and videos of Stories, a few at a time over the pooled connections of a RequestScheduler.
+    Media are streamed to a .part file, resumed with a Range request after a cut connection or an interrupted run,
+    then stored once per content under objects/, named by their SHA-256: a reposted media is kept only once.
+    A SQLite manifest maps every media_id to its file, media already in it are not downloaded again.
+    """
+    CHUNK_SIZE = 256 * 1024  # Bytes hashed at once
+    READ_SIZE = 16 * 1024  # Bytes read from the network at most before they are written, a cut loses less
+
+    def __init__(self, directory, concurrency=4, scheduler=None, max_attempts=5):
+        """
+        Args:
+            directory (str): Folder of the media, of the partial downloads and of the manifest, created if needed.
+            concurrency (int): Media downloaded at the same time, when no scheduler is given.
+            scheduler (RequestScheduler): Scheduler of the downloads, its concurrency bounds the parallel downloads.
+                By default one without throttling policy delay, the CDN is not the rate limited API.
+            max_attempts (int): Connections tried for a media cut before its end, each resuming the previous one.
+        """
+        self.directory, self.max_attempts = directory, max_attempts
+        self.scheduler = scheduler or RequestScheduler(concurrency=concurrency)
+        for folder in ("objects", "partial"):
+            os.makedirs(os.path.join(directory, folder), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, "manifest.db"))
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS media(media_id TEXT PRIMARY KEY, url TEXT, sha256 TEXT, path TEXT,
+                                             size INTEGER, content_type TEXT, downloaded_at REAL);
+            CREATE INDEX IF NOT EXISTS media_url ON media(url);
+            CREATE INDEX IF NOT EXISTS media_sha256 ON media(sha256);
+        ''')
+        self.db.commit()
+
+    def download(self, stories):
+        """
+        Download the media of the Stories not in the manifest yet. The manifest is only written by the calling thread.
+        Args:
+            stories: Iterable of Stories object, possibly a generator.
+        Returns:
+            stats (dict): Media downloaded, already present (in the manifest, or same URL or content as another one),
+                failed, and bytes of the media downloaded.
+        """
+        stats = {"downloaded": 0, "known": 0, "duplicates": 0, "failed": 0, "bytes": 0}
+        for result in self.scheduler.map(self.fetch, self.pending(stories, stats)):
+            media_id, url, error = result[0], result[1], result[-1]
+            if error is not None:
+                print("Failed {} {}: {}".format(media_id, url, error))
+                stats["failed"] += 1
+                continue
+            _, _, sha256, path, size, content_type, duplicate, _ = result
+            stats["duplicates" if duplicate else "downloaded"] += 1
+            stats["bytes"] += size
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO media VALUES(?,?,?,?,?,?,?)',
+                                (media_id, url, sha256, path, size, content_type, time.time()))
+        return stats
+
+    def pending(self, stories, stats):
+        """
+        Yields:
+            (media_id, url): Media of the stories to download, once each. Those whose URL was already downloaded
+                for another media_id are added to the manifest without a request.
+        """
+        queued = set()
+        for story in stories:
+            media_id, url = str(story.media_id), story.url
+            if not url or media_id in queued: continue
+            if self.path(media_id):
+                stats["known"] += 1
+                continue
+            row = self.db.execute('SELECT sha256, path, size, content_type FROM media WHERE url = ? LIMIT 1',
+                                  (url,)).fetchone()
+            if row and os.path.exists(os.path.join(self.directory, row[1])):
+                with self.db:
+                    self.db.execute('INSERT OR REPLACE INTO media VALUES(?,?,?,?,?,?,?)',
+                                    (media_id, url) + row + (time.time(),))
+                stats["duplicates"] += 1
+                continue
+            queued.add(media_id)
+            yield media_id, url
+
+    def fetch(self, item):
+        """
+        Download one media in the worker threads, resuming its .part file. Only files are written here.
+        Args:
+            item (Tuple): (media_id, url).
+        Returns:
+            result (Tuple): (media_id, url, sha256, path relative to directory, size, content type,
+                whether the content was already stored, error). error is None on success, the rest None on failure.
+        """
+        media_id, url = item
+        part = os.path.join(self.directory, "partial", re.sub(r"[^\w.-]", "_", media_id) + ".part")
+        error = None
+        for attempt in range(self.max_attempts):
+            try:
+                done, content_type = self.fetch_part(url, part)
+                if done: break
+                error = "incomplete"
+            except (requests.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
+                error = e  # The bytes written so far are kept for the next one
+        else:
+            return media_id, url, None, None, None, None, None, error
+
+        sha256 = hashlib.sha256()
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        sha256 = sha256.hexdigest()
+        extension = EXTENSIONS.get(content_type) or os.path.splitext(urlparse(url).path)[1]
+        path = os.path.join("objects", sha256[:2], sha256 + extension)
+        size = os.path.getsize(part)
+        os.makedirs(os.path.join(self.directory, "objects", sha256[:2]), exist_ok=True)
+        duplicate = os.path.exists(os.path.join(self.directory, path))
+        if duplicate:
+            os.remove(part)
+        else:
+            os.replace(part, os.path.join(self.directory, path))
+        return media_id, url, sha256, path, size, content_type, duplicate, None
+
+    def fetch_part(self, url, part):
+        """
+        Append the rest of a media to its .part file, asking only the missing bytes.
+        Returns:
+            done, content_type (Tuple): Whether the media is complete, and its MIME type.
+        """
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Accept-Encoding": "identity"}  # Content-Length and Range count the bytes of the media as stored
+        if offset: headers["Range"] = "bytes={}-".format(offset)
+        r = self.scheduler.get(url, headers=headers, throttle=False, stream=True)
+        with r:
+            content_type = r.headers.get("Content-Type", "").split(";")[0].strip()
+            if r.status_code == 416:  # Nothing after offset: the .part was complete, unless it is larger
+                total = r.headers.get("Content-Range", "").rpartition("/")[2]
+                if total.isdigit() and int(total) == offset: return True, content_type
+                os.remove(part)
+                return False, content_type
+            r.raise_for_status()
+            mode = "ab" if r.status_code == 206 and offset else "wb"  # A 200 is the whole media again
+            expected = r.headers.get("Content-Length")
+            received = 0
+            read1 = getattr(r.raw, "read1", None)  # urllib3 2: the bytes already received, without waiting for more
+            chunks = iter(lambda: read1(self.READ_SIZE, decode_content=False), b"") if read1 else \
+                r.raw.stream(self.READ_SIZE, decode_content=False)
+            with open(part, mode) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    received += len(chunk)
+        return expected is None or received == int(expected), content_type
+
+    def path(self, media_id):
+        """
+        Returns:
+            path (str): File of the media, None if it is not downloaded.
+        """
+        row = self.db.execute('SELECT path FROM media WHERE media_id = ?', (str(media_id),)).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.directory, row[0])): return None
+        return os.path.join(self.directory, row[0])
+
+    def close(self):
+        self.db.close()
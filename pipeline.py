@@ -0,0 +1,191 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from stage_metrics import StageMetrics
+
+REGISTER, MANY, CALL, STOP = "register", "many", "call", "stop"  # Control messages, the records are (sink, record)
+
+
+class WriterThread(threading.Thread):
+    """
+    The single thread writing to the databases, so that fetching and writing overlap.
+    Producers put records on a queue bounded by records, blocking when it is full, so that memory stays flat when
+    writing is slower than fetching. Records are written by their sink in batches, when batch_size of them are
+    pending or when the oldest has waited max_delay seconds. Connections are either opened in this thread through
+    resource, or shared with producers that wait for flush before using them again.
+    Every write is timed in metrics as a stage named after its sink, with the records written as items.
+    """
+
+    def __init__(self, max_queue=10000, batch_size=500, max_delay=1.0, metrics=None):
+        """
+        Args:
+            max_queue (int): Records waiting to be written (a call counts as one), above which put blocks. A List of
+                put_many larger than max_queue waits for an empty queue.
+            batch_size (int): Default number of records written at once by a sink.
+            max_delay (float): Seconds after which pending records are written, even if fewer than batch_size.
+            metrics (StageMetrics): Where the writes are timed, a new one if None.
+        """
+        super().__init__(name="sqlite-writer", daemon=True)
+        self.queue = queue.Queue()  # Bounded by max_queue records through queued
+        self.max_queue, self.queued = max_queue, 0
+        self.room = threading.Condition()
+        self.batch_size, self.max_delay = batch_size, max_delay
+        self.metrics = metrics or StageMetrics()
+        self.sinks, self.resources = {}, {}  # Only used in this thread
+        self.error = None
+        self.lock = threading.Lock()
+        self.counters = {"flushes": 0, "records": 0, "flush_seconds": 0.0, "max_flush_seconds": 0.0,
+                         "max_queue_depth": 0, "blocked_puts": 0}
+
+    def send(self, message, records=1):
+        """ Put a message of records records on the queue, blocking while it is full, unless the writer failed """
+        with self.room:
+            if self.queued and self.queued + records > self.max_queue:
+                with self.lock:
+                    self.counters["blocked_puts"] += 1
+                while self.queued and self.queued + records > self.max_queue:
+                    self.check()
+                    self.room.wait(0.1)
+            self.queued += records
+        self.queue.put(message)
+
+    def received(self, kind, payload):
+        """ Release the room of a message taken from the queue """
+        with self.room:
+            self.queued -= len(payload[1]) if kind == MANY else 1
+            self.room.notify_all()
+
+    def check(self):
+        """ Raise the error that stopped the writer, in the producer """
+        if self.error is not None: raise RuntimeError("The writer thread failed") from self.error
+        if not self.is_alive(): raise RuntimeError("The writer thread is not running")
+
+    def register(self, sink, write, batch_size=None):
+        """
+        Args:
+            sink (str): Name of the sink, a sink registered again has its write replaced, after its pending records.
+            write (Callable): Called in the writer thread with a List of records.
+            batch_size (int): Records written at once, the default batch_size if None.
+        """
+        self.send((REGISTER, (sink, write, batch_size or self.batch_size)))
+
+    def put(self, sink, record):
+        """ Queue a record for a registered sink, blocking while the queue is full """
+        self.send((sink, record))
+
+    def put_many(self, sink, records):
+        """ Queue a List of records for a registered sink as one message, cheaper than a put per record """
+        self.send((MANY, (sink, records)), len(records))
+
+    def call(self, fn):
+        """
+        Run a function in the writer thread, after the records already queued are written, e.g. a query.
+        Returns:
+            result: What fn returned.
+        """
+        done, result = threading.Event(), []
+        self.send((CALL, (fn, result, done)))
+        while not done.wait(0.1):
+            self.check()
+        self.check()
+        return result[0]
+
+    def flush(self):
+        """ Wait until every record queued so far is written and committed """
+        self.call(lambda: None)
+
+    def resource(self, key, factory):
+        """
+        Only called in the writer thread, by the writes and the calls.
+        Args:
+            key: Identifier of the resource, e.g. ("seen", path).
+            factory (Callable): Creates the resource the first time, e.g. opens a connection.
+        Returns:
+            resource: The resource, created once and closed, if it has a close method, when the writer stops.
+        """
+        if key not in self.resources: self.resources[key] = factory()
+        return self.resources[key]
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): Current and maximum queue depth in records, puts that had to wait, flushes, records written,
+                total and maximum seconds of a flush.
+        """
+        with self.lock:
+            return dict(self.counters, queue_depth=self.queued)
+
+    def close(self):
+        """ Write the pending records, close the resources and stop the thread """
+        if self.is_alive():
+            self.send((STOP, None))
+            self.join()
+        if self.error is not None: raise RuntimeError("The writer thread failed") from self.error
+
+    def run(self):
+        pending, oldest = defaultdict(list), {}  # Sink -> Records, time of the oldest
+        try:
+            while True:
+                timeout = max(0.0, min(oldest.values()) + self.max_delay - time.monotonic()) if oldest else None
+                try:
+                    kind, payload = self.queue.get(timeout=timeout)
+                except queue.Empty:  # max_delay elapsed
+                    for sink in [sink for sink, since in oldest.items() if time.monotonic() - since >= self.max_delay]:
+                        self.write(sink, pending, oldest)
+                    continue
+                with self.lock:
+                    self.counters["max_queue_depth"] = max(self.counters["max_queue_depth"], self.queued)
+                self.received(kind, payload)
+
+                if kind == REGISTER:
+                    sink, write, batch_size = payload
+                    if sink in pending: self.write(sink, pending, oldest)
+                    self.sinks[sink] = (write, batch_size)
+                elif kind in (CALL, STOP):
+                    for sink in list(pending):
+                        self.write(sink, pending, oldest)
+                    if kind == STOP: break
+                    fn, result, done = payload
+                    try:
+                        result.append(fn())
+                    finally:
+                        done.set()
+                else:
+                    sink = kind
+                    if kind == MANY:
+                        sink, records = payload
+                        pending[sink].extend(records)
+                    else:
+                        pending[sink].append(payload)
+                    oldest.setdefault(sink, time.monotonic())
+                    if len(pending[sink]) >= self.sinks[sink][1]: self.write(sink, pending, oldest)
+        except BaseException as e:
+            self.error = e
+            while True:  # Unblock the producers, their next put or call raises the error
+                try:
+                    kind, payload = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.received(kind, payload)
+                if kind == CALL: payload[2].set()
+        finally:
+            for resource in self.resources.values():
+                if hasattr(resource, "close"): resource.close()
+            self.resources.clear()
+
+    def write(self, sink, pending, oldest):
+        """ Write the pending records of a sink with its write function """
+        records = pending.pop(sink)
+        oldest.pop(sink, None)
+        start = time.perf_counter()
+        with self.metrics.stage(sink) as counters:
+            self.sinks[sink][0](records)
+            counters['items'] += len(records)
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.counters["flushes"] += 1
+            self.counters["records"] += len(records)
+            self.counters["flush_seconds"] += seconds
+            self.counters["max_flush_seconds"] = max(self.counters["max_flush_seconds"], seconds)
@@ -0,0 +1,480 @@
+#from tqdm import tqdm
+import difflib
+from wikidata import client  # The wikidata package, this module is named so as not to hide it
+import requests
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from wikidata_cache import WikidataCache
+from wikidata_dump import WikidataDump
+from fuzzy_index import TrigramIndex
+from stage_metrics import StageMetrics, console_sink
+
+
+class RateLimiter:
+    """ Space the requests of all the threads sharing it to at most rate per second """
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval: return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next)
+            self.next = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+
+
+class RelationshipExtractor:
+    """
+    Find the relations between Wikidata items and other elements.
+    Wall time, requests, bytes, cache hits and items of every stage (search, entity, labels, decode,
+    decode_fallback, similarities) are collected in self.metrics. Progress messages are only sent to its hooks:
+    add console_sink to print them.
+    """
+    LABELS_BATCH = 50  # Maximum number of ids of a wbgetentities request
+    TIMEOUT = 30  # Seconds before giving up on a request
+    INDEXES = 32  # Indexes of find_similarities kept, the least recently used is dropped
+    ENTITIES, SEARCHES = 1000, 10000  # Entities (prop_d) and searches kept in memory, the least recently used dropped
+
+    def __init__(self, base_url="https://www.wikidata.org/", cache_path=None, rate=None, pool_size=10,
+                 dump_path=None):
+        """
+        Args:
+            base_url (string): Base URL of the Wikidata instance.
+            cache_path (string): SQLite database caching searches, entities and labels across runs and
+                processes, see WikidataCache. Nothing is persisted if None.
+            rate (float): Maximum number of requests per second, unbounded if None.
+            pool_size (int): Number of keep-alive connections kept open to Wikidata.
+            dump_path (string): Index of a Wikidata dump built by WikidataDump.build. If given, searches, claims
+                and labels are read from it and no request is made.
+        """
+        self.cache = OrderedDict()  # ID -> prop_d, at most ENTITIES
+        self.search_cache = OrderedDict()  # Keyword -> ID, at most SEARCHES
+        self.store = WikidataCache(cache_path) if cache_path else None
+        self.dump = WikidataDump(dump_path) if dump_path else None
+        self.base_url = base_url
+        self.client = client.Client(base_url)  # doctest: +SKIP
+        self.mode = 1 # 1 for searching the propriety with values, 0 for searching the values throught the propriety
+        self.VERBOSE = False
+        self.matcher = TrigramIndex  # Index class used by find_similarities, ScanIndex compares every string
+        self.indexes = OrderedDict()  # (id of prop_d, mode) -> (prop_d, index), at most INDEXES
+
+        self.session = requests.Session()  # Connections are reused between requests and threads
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.limiter = RateLimiter(rate)
+        self.lock = threading.Lock()
+        self.inflight = {}  # (Kind, Key) -> Future of the lookup currently running
+        self.metrics = StageMetrics()
+
+    def request_json(self, url):
+        """
+        Args:
+            url (string): URL of the Wikidata API to call.
+        Returns:
+            json_resp: Decoded JSON response.
+        """
+        self.limiter.wait()
+        resp = self.session.get(url=url, timeout=self.TIMEOUT)
+        self.metrics.add(requests=1, bytes=len(resp.content))
+        resp.raise_for_status()  # An error body must not be read as an empty result
+        return json.loads(resp.text)
+
+    def recall(self, cache, key):
+        """
+        Args:
+            cache (OrderedDict): cache or search_cache.
+            key: Key of the lookup.
+        Returns:
+            value: The cached value, now the most recently used, None if it is not cached.
+        """
+        with self.lock:
+            value = cache.get(key)
+            if value is not None: cache.move_to_end(key)
+            return value
+
+    def remember(self, cache, key, value, size):
+        """ Store a value in cache or search_cache, dropping the least recently used ones above size """
+        with self.lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > size:
+                cache.popitem(last=False)
+
+    def once(self, key, fn):
+        """
+        Run fn, or if another thread is already running the same lookup, wait for its result instead.
+        Args:
+            key (Tuple): Kind and key of the lookup.
+            fn (Callable): Function doing the lookup.
+        Returns:
+            result: Result of fn.
+        """
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner: future = self.inflight[key] = Future()
+        if not owner: return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock: del self.inflight[key]
+        
+    def set_mode(self, m):
+        """
+        Set the current operating mode of the RelationshipExtractor
+        Args:
+            m (int):  1 for searching the propriety with values, 0 for searching the values throught the propriety
+        """
+        if m in (0, 1): self.mode = m
+            
+    class NoRelevantResult(Exception):    pass
+
+    class ApiError(Exception):    pass
+    
+    def search_id(self, keyword):
+        """
+        Query keyword using wikidata API to retrieve it's ID
+        Args:
+            keyword (string): Item to search on wikidata.
+        Returns:
+            idd (string): Wikidata ID of the searched item.
+        """
+        if not keyword: raise ValueError
+
+        with self.metrics.stage('search') as counters:
+            counters['items'] += 1
+            idd = self.recall(self.search_cache, keyword)
+            if idd: counters['cache_hits'] += 1
+            else: idd = self.once(('search', keyword), lambda: self._search_id(keyword))
+        self.metrics.log('search', "\n\n--\n\nID of Item to retrieve\t{}\n\n--\n", idd)
+        return idd
+
+    def _search_id(self, keyword):
+        idd = self.recall(self.search_cache, keyword)
+        if idd is not None: return idd
+        if self.dump:
+            idd = self.dump.search(keyword)
+            if idd is None:
+                self.metrics.log('search', "No relevant page found")
+                raise self.NoRelevantResult(keyword)
+        else:
+            idd = self.store.get('search', keyword) if self.store else None
+            if idd is not None: self.metrics.add(cache_hits=1)
+        if idd is None:
+            BASE_URL = self.base_url + "w/api.php?action=wbsearchentities&search={}&language=en&format=json"
+
+            json_resp = self.request_json(BASE_URL.format(keyword))
+
+            if not len(json_resp['search']): 
+                self.metrics.log('search', "No relevant page found")
+                raise self.NoRelevantResult(keyword)
+
+            idd = json_resp['search'][0]['id'] 
+            if self.store: self.store.set('search', keyword, idd)
+        self.remember(self.search_cache, keyword, idd, self.SEARCHES)
+        return idd
+
+    def visualize_prop(self, d):
+        """
+        Args:
+            d (dict): Dictionary of Prop -> Values to visualize.
+        """
+        class SetEncoder(json.JSONEncoder): # Custom encoder to handle json-dumping set
+            def default(self, obj):
+                if isinstance(obj, set):
+                    return list(obj)
+                return json.JSONEncoder.default(self, obj)
+        print("\n\n--\n\n")
+        print (json.dumps(d, sort_keys=True, indent=4, cls=SetEncoder))
+        print("\n\n--\n\n")
+        
+    def get_labels(self, ids):
+        """
+        Retrieve the English labels of many Wikidata entities, LABELS_BATCH ids per request.
+        Args:
+            ids (Iterable): Wikidata IDs of the entities.
+        Returns:
+            labels (dict): Dictionary ID -> Label, empty string if an entity has no label.
+        """
+        with self.metrics.stage('labels') as counters:
+            if self.dump:
+                labels = self.dump.labels(ids)
+                counters['items'] += len(labels)
+                return labels
+            labels = self._get_labels(list(dict.fromkeys(ids)), counters)  # Skip duplicate, keeping the order
+            counters['items'] += len(labels)
+            return labels
+
+    def _get_labels(self, ids, counters):
+        BASE_URL = self.base_url + "w/api.php?action=wbgetentities&ids={}&props=labels&languages=en&languagefallback=1&format=json"
+
+        labels = self.store.get_many('label', ids) if self.store else {}
+        counters['cache_hits'] += len(labels)
+
+        mine, others = [], {}  # Labels to fetch here, labels being fetched by other threads
+        with self.lock:
+            for idd in ids:
+                if idd in labels: continue
+                future = self.inflight.get(('label', idd))
+                if future is None:
+                    self.inflight[('label', idd)] = Future()
+                    mine.append(idd)
+                else:
+                    others[idd] = future
+
+        try:
+            for start in range(0, len(mine), self.LABELS_BATCH):
+                batch = mine[start:start + self.LABELS_BATCH]
+                json_resp = self.request_json(BASE_URL.format("|".join(batch)))
+                if 'entities' not in json_resp: raise self.ApiError(json_resp.get('error', json_resp))
+                for idd, ent in json_resp['entities'].items():
+                    label = ent.get('labels', {}).get('en')
+                    labels[idd] = label['value'] if label else ""
+            if self.store and mine: self.store.set_many('label', {idd: labels[idd] for idd in mine if idd in labels})
+        except BaseException as e:  # The threads waiting for the labels not fetched fail too, nothing is cached
+            with self.lock:
+                for idd in mine:
+                    future = self.inflight.pop(('label', idd))
+                    if idd in labels: future.set_result(labels[idd])
+                    else: future.set_exception(e)
+            raise
+        with self.lock:
+            for idd in mine:
+                self.inflight.pop(('label', idd)).set_result(labels.get(idd))
+
+        for idd, future in others.items():
+            label = future.result()
+            if label is not None: labels[idd] = label
+        counters['cache_hits'] += len(others)  # Shared with another thread
+        return labels
+
+    def get_propvalues(self, idd):
+        """
+        Retrieve and store the Wikidata information about an Entity.
+        The labels of the properties and of the entities used as values are resolved together, in batches.
+        Args:
+            idd (string): Wikidata ID of the item.
+        Returns:
+            prop_d (dict): Dictionary Prop -> Values of certain Wikidata Item.
+        """
+        if not idd: raise ValueError
+
+        prop_d = self.recall(self.cache, idd)
+        if prop_d is not None:
+            self.metrics.add('entity', cache_hits=1)
+            return prop_d
+        return self.once(('entity', idd), lambda: self._get_propvalues(idd))
+
+    def _get_propvalues(self, idd):
+        prop_d = self.recall(self.cache, idd)
+        if prop_d is not None: return prop_d
+        with self.metrics.stage('entity') as counters:
+            claims = self.get_claims(idd)
+
+            snaks = {} # Prop ID -> Values snaks
+            to_label = list(claims)
+            for prop_id, prop_claims in claims.items():
+                snaks[prop_id] = [claim['mainsnak'] for claim in prop_claims if claim['mainsnak']['snaktype'] == 'value']
+                for snak in snaks[prop_id]:
+                    if snak['datavalue']['type'] == 'wikibase-entityid': # Propriety is a wikidata entity
+                        to_label.append(RelationshipExtractor.entity_id(snak['datavalue']['value']))
+            counters['items'] += 1
+        labels = self.get_labels(to_label)
+        with self.metrics.stage('decode') as counters:
+            prop_d = self.decode_values(snaks, labels)
+            counters['items'] += sum(len(prop_snaks) for prop_snaks in snaks.values())
+
+        self.remember(self.cache, idd, prop_d, self.ENTITIES)
+        return prop_d
+
+    def decode_values(self, snaks, labels):
+        """
+        Args:
+            snaks (dict): Dictionary Prop ID -> Main snaks of the values.
+            labels (dict): Dictionary ID -> Label of the properties and of the entities used as values.
+        Returns:
+            prop_d (dict): Dictionary Prop -> Values.
+        """
+        log = self.metrics.log
+        prop_d = {}
+
+        n = len(snaks)
+        for idx, (prop_id, prop_snaks) in enumerate(snaks.items()): # Iterate over properties
+
+            prop_label = labels.get(prop_id, "")
+            log('decode', "\n{}/{} Propriety ID:\t {} \tPropriety NAME:\t {}", idx+1, n, prop_id, prop_label)
+
+            prop_d[prop_label.lower()] = set() # Set of values for each proprieties 
+
+            for snak in prop_snaks:
+                try:
+                    if snak['datavalue']['type'] == 'wikibase-entityid': # Propriety is a wikidata entity
+                        p = labels.get(RelationshipExtractor.entity_id(snak['datavalue']['value']), "")
+                        log('decode', "{}", p)
+                        prop_d[prop_label.lower()].add(p) # Skip duplicate
+                    else:
+                        p = self.client.decode_datavalue(snak['datatype'], snak['datavalue'])
+                        log('decode', "{}", p) # Propriety is a value
+                        prop_d[prop_label.lower()].add(str(p))
+                except Exception as e: # Handling  of unsupported DataValue, its time is included in decode
+                    with self.metrics.stage('decode_fallback') as counters:
+                        counters['items'] += 1
+                        try:
+                            param = str(e).split("unsupported type: ")[1].replace("'",'"') # Value type
+                            d = json.loads(param)
+                            log('decode_fallback', "{}", d["value"]["amount"])
+                            prop_d[prop_label.lower()].add(str(d["value"]["amount"]))
+                        except:
+                            log('decode_fallback', "Unhandled type (GPS, ...)\n") # Other unhandled type
+        return prop_d
+
+    def get_claims(self, idd):
+        """
+        Args:
+            idd (string): Wikidata ID of the item.
+        Returns:
+            claims (dict): Dictionary Prop ID -> Claims of the item, as returned by Wikidata.
+        """
+        if self.dump: return self.dump.claims(idd) or {}
+        claims = self.store.get('entity', idd) if self.store else None
+        if claims is not None: self.metrics.add(cache_hits=1)
+        else:
+            json_resp = self.request_json(self.base_url + "wiki/Special:EntityData/{}.json".format(idd))
+            entities = json_resp['entities']
+            data = entities.get(idd) or next(iter(entities.values()))  # Redirected entity
+            claims = data.get('claims') or {}
+            if self.store: self.store.set('entity', idd, claims)
+        return claims
+
+    @staticmethod
+    def entity_id(value):
+        """
+        Args:
+            value (dict): Value of a wikibase-entityid DataValue.
+        Returns:
+            idd (string): Wikidata ID of the entity.
+        """
+        if 'id' in value: return value['id']
+        return {'item': 'Q', 'property': 'P'}.get(value.get('entity-type'), 'Q') + str(value['numeric-id'])
+
+    def find_similarities(self, prop_d, to_find):
+        """
+        Args:
+            prop_d (dict): Dictionary Prop -> Values of certain Wikidata Item.
+            to_find (string): Element to search for the connection with the Item.
+        Returns:
+            results (List): List of propriety which make a match between the prop_d and to_find .
+        """
+        results = []
+
+        if self.mode: self.metrics.log('similarities', "\n-Normal MODE-\n")
+        elif not self.mode: self.metrics.log('similarities', "\n-Reverse MODE-\n")
+
+        with self.metrics.stage('similarities') as counters:
+            counters['items'] += 1
+            matched = self.get_index(prop_d).match(to_find) # Strings deemed similar by comparison_strategy
+            for prop_name, value in prop_d.items():
+                for value_name in value:
+                    if self.mode and value_name in matched:
+                        results.append(prop_name)         
+                    elif not self.mode and prop_name in matched:
+                        results.append(value_name)
+        for result in results:
+            self.metrics.log('similarities', "{} | Possible match: {}", to_find, result)
+        return results
+
+    def get_index(self, prop_d):
+        """
+        Args:
+            prop_d (dict): Dictionary Prop -> Values of certain Wikidata Item.
+        Returns:
+            index: Matcher over the values (normal mode) or the proprieties (reverse mode) of prop_d, built once
+                while it is among the INDEXES most recently used.
+        """
+        key = (id(prop_d), self.mode)
+        with self.lock:
+            entry = self.indexes.get(key)
+            if entry is not None and entry[0] is prop_d:
+                self.indexes.move_to_end(key)
+                return entry[1]
+        strings = [v for value in prop_d.values() for v in value] if self.mode else list(prop_d)
+        index = self.matcher(strings)
+        with self.lock:
+            self.indexes[key] = (prop_d, index)
+            self.indexes.move_to_end(key)
+            while len(self.indexes) > self.INDEXES:
+                self.indexes.popitem(last=False)
+        return index
+
+    def comparison_strategy(s1, s2):
+        """
+        Args:
+            s1 (string): First string to compare.
+            s2 (string): Second string to compare.
+        Returns:
+            Bool (Bool): Boolean check if s1 and s2 are deemed enought similar.
+        """                    
+        return (difflib.SequenceMatcher(None, s1.lower(), s2.lower()).ratio()) > 0.9                  
+
+    def extract(self, to_search, relation_with):
+        """
+        Args:
+            to_search (string): Item to search on wikidata.
+            relation_with (string): Element to search for the connection with the Item.
+        Returns:
+            results (List): Matches found by find_similarities.
+        """
+        self.metrics.log('extract', "PROCESSING {}", to_search)
+        idd = self.search_id(to_search) # Retrieve the wikidata ID for the best possible result.
+        prop_d = self.get_propvalues(idd)
+        if self.VERBOSE:
+            self.visualize_prop(prop_d)
+        return self.find_similarities(prop_d, relation_with)
+
+    def extract_many(self, pairs, concurrency=8):
+        """
+        Run extract on many pairs with a pool of threads, sharing the connections, the caches and the rate limit.
+        Lookups of the same item, search or label made at the same time are only requested once.
+        Args:
+            pairs (Iterable): Tuples (to_search, relation_with).
+            concurrency (int): Number of pairs processed at the same time.
+        Yields:
+            result (Tuple): (to_search, relation_with), results of extract and None, or None and the exception
+                raised, in order of completion.
+        """
+        pairs = iter(pairs)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            running = {}
+            while True:
+                for pair in pairs:  # Keep at most 2 * concurrency pairs submitted
+                    running[pool.submit(self.extract, *pair)] = pair
+                    if len(running) >= 2 * concurrency: break
+                if not running: return
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pair = running.pop(future)
+                    error = future.exception()
+                    yield pair, None if error else future.result(), error
+
+
+if __name__ == "__main__":
+    re = RelationshipExtractor()
+    re.metrics.add_hook(console_sink)
+
+    re.extract("Julius Caesar", "politician")
+    print(re.metrics.report())
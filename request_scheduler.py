@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from random import uniform
+
+import requests
+
+
+class JitterDelay:
+    """ Throttling policy: sleep a random time before every request, the historical behaviour of InstagramStories """
+
+    def __init__(self, low=0.8, high=1.7):
+        """
+        Args:
+            low (float): Minimum seconds to wait.
+            high (float): Maximum seconds to wait.
+        """
+        self.low, self.high = low, high
+
+    def wait(self):
+        time.sleep(uniform(self.low, self.high))
+
+    def slow_down(self):
+        pass
+
+    def speed_up(self):
+        pass
+
+
+class TokenBucket:
+    """
+    Throttling policy: at most rate requests per second on average, bursts of at most burst requests,
+    shared by all the threads. The rate is halved on every 429 or 5xx and slowly recovers on success.
+    """
+
+    def __init__(self, rate=1.0, burst=1, jitter=0.0, min_rate=0.05):
+        """
+        Args:
+            rate (float): Requests per second allowed.
+            burst (int): Requests that can be sent at once after an idle period.
+            jitter (float): Maximum random seconds added after a token is taken, so requests are not evenly spaced.
+            min_rate (float): Rate below which slow_down does not go.
+        """
+        self.max_rate, self.rate, self.min_rate = rate, rate, min_rate
+        self.burst, self.jitter = burst, jitter
+        self.tokens, self.last = float(burst), time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1  # Reserve a token, possibly in the future: waiters are served in order
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        delay += uniform(0, self.jitter)
+        if delay > 0: time.sleep(delay)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RequestScheduler:
+    """
+    Send the GET requests of many threads through a pooled keep-alive session, throttled by a shared policy.
+    429 and 5xx answers are retried with exponential backoff, or after their Retry-After header, and pause
+    every thread of the scheduler meanwhile.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, concurrency=1, policy=None, max_retries=5, backoff=1.0, max_backoff=120.0, timeout=30):
+        """
+        Args:
+            concurrency (int): Requests running at the same time in map.
+            policy: Throttling policy (JitterDelay, TokenBucket...), JitterDelay() if None.
+            max_retries (int): Retries of a request answered 429 or 5xx, the last answer is returned after them.
+            backoff (float): Seconds waited before the first retry, doubled at every retry.
+            max_backoff (float): Maximum seconds waited before a retry.
+            timeout (float): Seconds before giving up on a request.
+        """
+        self.concurrency = concurrency
+        self.policy = policy if policy is not None else JitterDelay()
+        self.max_retries, self.backoff, self.max_backoff, self.timeout = max_retries, backoff, max_backoff, timeout
+        self.resume_at = 0  # Monotonic time before which no request is sent
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(10, concurrency))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url, headers=None, throttle=True, stream=False):
+        """
+        Args:
+            url (string): URL to request.
+            headers (dict): Headers of the request, e.g. the cookies.
+            throttle (Bool): Wait for the policy before the request.
+            stream (Bool): Leave the body to be read with iter_content, the response must then be closed.
+        Returns:
+            r (requests.Response): Response, possibly still a 429 or 5xx after max_retries retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.pause()
+            if throttle: self.policy.wait()
+            r = self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+            if r.status_code not in self.RETRY_STATUSES:
+                self.policy.speed_up()
+                return r
+            self.policy.slow_down()
+            if attempt < self.max_retries:
+                r.close()  # Give the connection back to the pool
+                delay = self.retry_after(r)
+                if delay is None: delay = min(self.max_backoff, self.backoff * 2 ** attempt) * uniform(0.5, 1.5)
+                with self.lock:
+                    self.resume_at = max(self.resume_at, time.monotonic() + delay)
+        return r
+
+    def pause(self):
+        """ Wait for the end of the backoff triggered by the last 429 or 5xx """
+        while True:
+            delay = self.resume_at - time.monotonic()
+            if delay <= 0: return
+            time.sleep(delay)
+
+    @staticmethod
+    def retry_after(r):
+        """
+        Returns:
+            delay (float): Seconds asked by the Retry-After header of the response, None if there is none.
+        """
+        value = r.headers.get("Retry-After")
+        if not value: return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+
+    def map(self, fn, items):
+        """
+        Args:
+            fn (Callable): Function doing the requests for an item, usually through get.
+            items (Iterable): Items to process.
+        Yields:
+            result: Results of fn, in the order of items, with at most concurrency calls running.
+        """
+        if self.concurrency <= 1:
+            for item in items:
+                yield fn(item)
+            return
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            running = deque()
+            for item in items:
+                running.append(pool.submit(fn, item))
+                if len(running) >= 2 * self.concurrency:  # Bound the results waiting to be consumed
+                    yield running.popleft().result()
+            while running:
+                yield running.popleft().result()
@@ -0,0 +1,158 @@
+import math
+import sqlite3
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError as e:
+    HAS_NUMPY = False
+
+
+class BloomFilter:
+    """
+    Set membership with false positives but no false negatives, in about 10 bits per element for 1% errors.
+    Used in front of the seen table: an id it does not contain is new, without asking the database.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        Args:
+            capacity (int): Number of elements expected, the error rate grows above it.
+            error_rate (float): Probability of a false positive at capacity.
+        """
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, key):
+        h = hash(key)  # Salted per process, fine for a filter that is never persisted
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        size, bits = self.size, self.bits
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % size
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        h = hash(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        size, bits = self.size, self.bits
+        for i in range(self.hashes):  # Most keys checked are new, they usually fail on the first bits
+            pos = (h1 + i * h2) % size
+            if not bits[pos >> 3] & (1 << (pos & 7)): return False
+        return True
+
+    def add_many(self, keys):
+        keys = list(keys)
+        if not HAS_NUMPY:
+            for key in keys:
+                self.add(key)
+            return
+        pos = self._positions(keys)
+        np.bitwise_or.at(np.frombuffer(self.bits, dtype=np.uint8), pos >> 3, np.left_shift(1, pos & 7).astype(np.uint8))
+        self.count += len(keys)
+
+    def contains_many(self, keys):
+        """
+        Args:
+            keys (List): Keys to check.
+        Returns:
+            found (List): For every key, False if it was never added, True if it probably was.
+        """
+        if not HAS_NUMPY: return [key in self for key in keys]
+        pos = self._positions(keys)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)[pos >> 3] & np.left_shift(1, pos & 7).astype(np.uint8)
+        return bits.all(axis=1).tolist()
+
+    def _positions(self, keys):
+        """ Bit positions of the keys, a row per key, computed as add does but vectorized """
+        h = np.fromiter((hash(key) for key in keys), dtype=np.int64, count=len(keys))
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return (h1[:, None] + np.arange(self.hashes)[None, :] * h2[:, None]) % self.size
+
+
+class SeenIndex:
+    """
+    The seen(media_id) table of save_stories, checked and updated a batch at a time over one connection in WAL mode.
+    With prefilter, a Bloom filter of the seen ids, loaded once, answers for most new ids without the database.
+    """
+    LOOKUP_BATCH = 500  # Ids per IN (...) query, below the SQLite limit of parameters
+
+    def __init__(self, path, prefilter=False, capacity=1000000):
+        """
+        Args:
+            path (str): Path of the SQLite database.
+            prefilter (Bool): Keep a Bloom filter of the seen ids in memory.
+            capacity (int): Minimum number of ids the Bloom filter is sized for.
+        """
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)  # Written by the writer thread of InstagramStories
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''
+                CREATE TABLE IF NOT EXISTS seen(media_id TEXT PRIMARY KEY)
+            ''')
+        self.db.commit()
+
+        self.capacity = capacity
+        self.bloom = None
+        if prefilter: self.load_prefilter()
+
+    def load_prefilter(self):
+        """ (Re)build the Bloom filter from the table, with room for as many new ids as there are seen ones """
+        rows = self.db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        self.bloom = BloomFilter(max(self.capacity, 2 * rows))
+        cursor = self.db.execute('SELECT media_id FROM seen')
+        while True:
+            rows = cursor.fetchmany(100000)
+            if not rows: break
+            self.bloom.add_many(media_id for media_id, in rows)
+
+    def claim(self, ids):
+        """
+        Mark ids as seen, in one transaction.
+        Args:
+            ids: Media IDs, as strings.
+        Returns:
+            new (set): The ids that were not seen before, each duplicate in ids being counted once.
+        """
+        new = self.unseen(ids)
+        self.mark_seen(new)
+        return new
+
+    def unseen(self, ids):
+        """
+        Look ids up without marking them, see mark_seen.
+        Args:
+            ids: Media IDs, as strings.
+        Returns:
+            new (set): The ids that are not seen yet, each duplicate in ids being counted once.
+        """
+        ids = list(dict.fromkeys(ids))
+        maybe_seen = ids
+        if self.bloom is not None:
+            maybe_seen = [media_id for media_id, found in zip(ids, self.bloom.contains_many(ids)) if found]
+        seen = set()
+        for start in range(0, len(maybe_seen), self.LOOKUP_BATCH):
+            batch = maybe_seen[start:start + self.LOOKUP_BATCH]
+            seen.update(media_id for media_id, in self.db.execute(
+                'SELECT media_id FROM seen WHERE media_id IN ({})'.format(",".join("?" * len(batch))), batch))
+        return {media_id for media_id in ids if media_id not in seen}
+
+    def mark_seen(self, ids):
+        """
+        Mark ids as seen, in one transaction. Only called once they are saved, so that a failed save is retried.
+        Args:
+            ids: Media IDs, as strings, not seen yet (see unseen).
+        """
+        ids = list(ids)
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO seen(media_id) VALUES(?)', ((media_id,) for media_id in ids))
+        if self.bloom is not None:
+            self.bloom.add_many(ids)
+            if self.bloom.count > self.bloom.capacity: self.load_prefilter()  # Keep the false positives rare
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,179 @@
+import datetime
+import math
+import sqlite3
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """ Great-circle distance in km between two points given in degrees """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def epoch(value):
+    """
+    Args:
+        value: Time as epoch seconds, datetime, or '%Y-%m-%d %H:%M:%S' string in local time like Stories timestamps.
+    Returns:
+        seconds (float): Epoch seconds, None if value is None.
+    """
+    if value is None or isinstance(value, (int, float)): return value
+    if isinstance(value, str): value = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return value.timestamp()
+
+
+class SightingStore:
+    """
+    Geotagged sightings of users, as collected by location_people, with numeric coordinates.
+    A 3-dimensional R*Tree indexes the coordinates with the time, so that "near X last week" only reads the rows
+    matching both, and a B-tree indexes the time alone. Rows are written in batched transactions.
+    Returned rows are (timestamp, placename, lat, lng, user_id, nickname, fullname, city_id, city_name),
+    the columns of the historical users table, with the timestamp formatted as Stories do.
+    """
+    COLUMNS = ("datetime(taken_at, 'unixepoch', 'localtime'), placename, lat, lng, user_id, nickname, fullname, "
+               "city_id, city_name")
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the SQLite database. Its users table, if location_people wrote one before
+                the sightings table existed, is imported once.
+        """
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)  # Written by the writer thread of InstagramStories
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS sightings(id INTEGER PRIMARY KEY, taken_at INTEGER, placename TEXT,
+                                                 lat REAL, lng REAL, user_id TEXT, nickname TEXT, fullname TEXT,
+                                                 city_id TEXT, city_name TEXT,
+                                                 UNIQUE(taken_at, user_id));  -- Also the index of the time
+            CREATE VIRTUAL TABLE IF NOT EXISTS sightings_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng,
+                                                                         min_time, max_time);
+            CREATE TRIGGER IF NOT EXISTS sightings_rtree_insert AFTER INSERT ON sightings
+                WHEN new.lat IS NOT NULL AND new.lng IS NOT NULL AND new.taken_at IS NOT NULL
+                BEGIN INSERT INTO sightings_rtree VALUES(new.id, new.lat, new.lat, new.lng, new.lng, new.taken_at,
+                                                         new.taken_at); END;
+            CREATE TRIGGER IF NOT EXISTS sightings_rtree_delete AFTER DELETE ON sightings
+                BEGIN DELETE FROM sightings_rtree WHERE id = old.id; END;
+        ''')
+        self.db.commit()
+        self.import_legacy()
+
+    def import_legacy(self):
+        """ Copy the rows of the users table, with TEXT coordinates and local time, into an empty sightings table """
+        if not self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone(): return
+        if self.db.execute('SELECT 1 FROM sightings LIMIT 1').fetchone(): return
+        with self.db:
+            self.db.execute('''
+                INSERT OR IGNORE INTO sightings(taken_at, placename, lat, lng, user_id, nickname, fullname, city_id,
+                                                city_name)
+                SELECT CAST(strftime('%s', timestamp, 'utc') AS INTEGER), placename, CAST(lat AS REAL),
+                       CAST(lng AS REAL), user_id, nickname, fullname, city_id, city_name FROM users''')
+
+    def insert(self, rows):
+        """
+        Write sightings in one transaction, a sighting of a user at a time already stored being ignored.
+        Args:
+            rows: Iterable of (taken_at, placename, lat, lng, user_id, nickname, fullname, city_id, city_name),
+                taken_at as accepted by epoch.
+        Returns:
+            n (int): Number of sightings written.
+        """
+        last = self.db.execute('SELECT MAX(id) FROM sightings').fetchone()[0] or 0
+        with self.db:
+            self.db.executemany('''
+                INSERT OR IGNORE INTO sightings(taken_at, placename, lat, lng, user_id, nickname, fullname, city_id,
+                                                city_name) VALUES(?,?,?,?,?,?,?,?,?)''',
+                                ((epoch(row[0]), row[1], float(row[2]), float(row[3]), str(row[4])) + tuple(row[5:])
+                                 for row in rows))
+        return (self.db.execute('SELECT MAX(id) FROM sightings').fetchone()[0] or 0) - last  # Ids are consecutive
+
+    @staticmethod
+    def time_filter(since, until, column='s.taken_at'):
+        """ SQL condition and parameters of a time window, either end being optional """
+        query, params = '', []
+        if since is not None:
+            query, params = query + ' AND {} >= ?'.format(column), params + [epoch(since)]
+        if until is not None:
+            query, params = query + ' AND {} <= ?'.format(column), params + [epoch(until)]
+        return query, params
+
+    def in_bbox(self, min_lat, min_lng, max_lat, max_lng, since=None, until=None):
+        """
+        Args:
+            min_lat, min_lng, max_lat, max_lng (float): Corners of the box, in degrees. A box crossing the
+                antimeridian has min_lng > max_lng.
+            since, until: Optional time window, as accepted by epoch.
+        Returns:
+            rows (List): Sightings in the box, oldest first.
+        """
+        if min_lng > max_lng:
+            return sorted(self.in_bbox(min_lat, min_lng, max_lat, 180, since, until) +
+                          self.in_bbox(min_lat, -180, max_lat, max_lng, since, until), key=lambda row: row[0])
+        query = '''
+            SELECT {} FROM sightings_rtree r JOIN sightings s ON s.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?
+                AND s.lat BETWEEN ? AND ? AND s.lng BETWEEN ? AND ?'''.format(self.COLUMNS)
+        params = [min_lat, max_lat, min_lng, max_lng] * 2  # The R*Tree rounds to float32, s is exact
+        if since is not None:  # +s.taken_at: the time is looked up in the R*Tree, not in the B-tree
+            query, params = query + ' AND r.max_time >= ? AND +s.taken_at >= ?', params + [epoch(since)] * 2
+        if until is not None:
+            query, params = query + ' AND r.min_time <= ? AND +s.taken_at <= ?', params + [epoch(until)] * 2
+        return self.db.execute(query + ' ORDER BY s.taken_at', params).fetchall()
+
+    def near(self, lat, lng, radius_km, since=None, until=None):
+        """
+        Args:
+            lat, lng (float): Center, in degrees.
+            radius_km (float): Radius of the search.
+            since, until: Optional time window, as accepted by epoch.
+        Returns:
+            rows (List): (distance in km,) + sighting, for the sightings within radius_km, nearest first.
+        """
+        delta_lat = radius_km / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(lat))
+        if abs(lat) + delta_lat >= 90 or cos_lat * 180 * KM_PER_DEGREE <= radius_km:  # Around a pole: every longitude
+            min_lng, max_lng = -180, 180
+        else:
+            delta_lng = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / cos_lat)))
+            min_lng, max_lng = lng - delta_lng, lng + delta_lng
+            if min_lng < -180: min_lng += 360
+            if max_lng > 180: max_lng -= 360
+        candidates = self.in_bbox(max(-90, lat - delta_lat), min_lng, min(90, lat + delta_lat), max_lng, since, until)
+        found = [(haversine(lat, lng, row[2], row[3]),) + row for row in candidates]
+        return sorted((row for row in found if row[0] <= radius_km), key=lambda row: row[0])
+
+    def in_window(self, since=None, until=None, user_id=None):
+        """
+        Args:
+            since, until: Time window, as accepted by epoch.
+            user_id (str): Only the sightings of this user.
+        Returns:
+            rows (List): Sightings in the window, oldest first.
+        """
+        time_query, time_params = self.time_filter(since, until)
+        if user_id is not None: time_query, time_params = time_query + ' AND s.user_id = ?', time_params + [str(user_id)]
+        return self.db.execute('SELECT {} FROM sightings s WHERE 1{} ORDER BY s.taken_at'.format(
+            self.COLUMNS, time_query), time_params).fetchall()
+
+    def city_stats(self, since=None, until=None):
+        """
+        Args:
+            since, until: Optional time window, as accepted by epoch.
+        Returns:
+            stats (List): (city_id, city_name, sightings, distinct users, first and last timestamp, mean lat, mean lng)
+                of every city, most sightings first.
+        """
+        time_query, time_params = self.time_filter(since, until)
+        return self.db.execute('''
+            SELECT city_id, MAX(city_name), COUNT(*), COUNT(DISTINCT user_id),
+                   datetime(MIN(taken_at), 'unixepoch', 'localtime'), datetime(MAX(taken_at), 'unixepoch', 'localtime'),
+                   AVG(lat), AVG(lng)
+            FROM sightings s WHERE 1{} GROUP BY city_id ORDER BY 3 DESC'''.format(time_query), time_params).fetchall()
+
+    def close(self):
+        self.db.close()
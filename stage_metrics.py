@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+COUNTERS = ('calls', 'seconds', 'requests', 'bytes', 'cache_hits', 'items')
+
+
+def console_sink(event):
+    """ Hook printing the messages of a pipeline, as it always did, and nothing else """
+    if event['type'] == 'message': print(event['message'])
+
+
+class StageMetrics:
+    """
+    Wall time and counters (requests, bytes, cache hits, items...) of the stages of a pipeline, shared by its threads.
+    Hooks receive every event as a dict:
+        {'type': 'stage', 'stage': name, 'seconds': ..., <counters of this run of the stage>} when a stage ends,
+        {'type': 'message', 'stage': name, 'message': text} for the progress messages.
+    Messages are only formatted when a hook is registered, so a pipeline without hooks is silent.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(lambda: defaultdict(float))  # Stage -> Counter -> Total
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Stack of the stages running in the current thread
+
+    def add_hook(self, hook):
+        """
+        Args:
+            hook (Callable): Function called with every event.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage, the counters added while it runs are attributed to it.
+        Args:
+            name (string): Name of the stage.
+        """
+        stack = self.local.__dict__.setdefault('stack', [])
+        counters = defaultdict(float)
+        stack.append((name, counters))
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            counters['calls'] += 1
+            counters['seconds'] += seconds
+            with self.lock:
+                total = self.totals[name]
+                for counter, value in counters.items():
+                    total[counter] += value
+            if self.hooks: self.emit(dict(counters, type='stage', stage=name))
+
+    def add(self, stage=None, **counters):
+        """
+        Args:
+            stage (string): Stage to add the counters to, the innermost stage running in this thread if None.
+            counters: Counter -> Increment, e.g. requests=1, bytes=2048.
+        """
+        stack = getattr(self.local, 'stack', None)
+        if stage is None and stack:  # Private to this thread until the stage ends
+            for counter, value in counters.items():
+                stack[-1][1][counter] += value
+            return
+        with self.lock:
+            total = self.totals[stage or 'other']
+            for counter, value in counters.items():
+                total[counter] += value
+
+    def log(self, stage, message, *args):
+        """
+        Args:
+            stage (string): Stage the message is about.
+            message (string): Message, formatted with args only if a hook is registered.
+        """
+        if self.hooks: self.emit({'type': 'message', 'stage': stage, 'message': message.format(*args)})
+
+    def emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    def summary(self):
+        """
+        Returns:
+            summary (dict): Stage -> Counter -> Total since the creation or the last reset.
+        """
+        with self.lock:
+            return {name: {counter: total.get(counter, 0) for counter in COUNTERS}
+                    for name, total in self.totals.items()}
+
+    def report(self):
+        """
+        Returns:
+            report (string): Table of the totals of every stage.
+        """
+        lines = ["stage\t\t" + "\t".join(COUNTERS)]
+        for name, total in self.summary().items():
+            lines.append("{:<16}".format(name) + "\t".join(
+                "{:.3f}".format(total[counter]) if counter == 'seconds' else "{:.0f}".format(total[counter])
+                for counter in COUNTERS))
+        return "\n".join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.totals.clear()
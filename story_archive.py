@@ -0,0 +1,170 @@
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from instagram_stories import Stories
+
+
+class StoryArchive:
+    """
+    Append-only archive of Stories in gzip-compressed JSON Lines segments, rotated by size or age.
+    Every append is written as a complete gzip member, so a crash can only lose the append in progress: a segment
+    whose size on disk is not the one indexed after the last append is never appended to again, and its readers stop
+    at the truncated member.
+    A sidecar SQLite index records the segment of every story by media_id, user_id and timestamp,
+    so that lookups and range scans only read the segments that can match.
+    """
+    SEGMENT_PREFIX, SEGMENT_SUFFIX = "stories-", ".jsonl.gz"
+
+    def __init__(self, directory, max_bytes=64 * 2 ** 20, max_age=24 * 3600, compresslevel=6):
+        """
+        Args:
+            directory (str): Folder of the segments and of the index, created if needed.
+            max_bytes (int): Uncompressed size above which a new segment is started.
+            max_age (float): Seconds after which a new segment is started, None to rotate by size only.
+            compresslevel (int): gzip compression level.
+        """
+        self.directory, self.max_bytes, self.max_age, self.compresslevel = directory, max_bytes, max_age, compresslevel
+        os.makedirs(directory, exist_ok=True)
+        # Written by the writer thread of InstagramStories, one thread at a time
+        self.db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS segments(name TEXT PRIMARY KEY, opened REAL, bytes INTEGER, stories INTEGER,
+                                                min_timestamp TEXT, max_timestamp TEXT, size INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS stories(media_id TEXT, user_id TEXT, timestamp TEXT, segment TEXT);
+            CREATE INDEX IF NOT EXISTS stories_media ON stories(media_id);
+            CREATE INDEX IF NOT EXISTS stories_user ON stories(user_id, timestamp);
+            CREATE INDEX IF NOT EXISTS stories_timestamp ON stories(timestamp);
+        ''')
+        if 'size' not in [column[1] for column in self.db.execute('PRAGMA table_info(segments)')]:
+            self.db.execute('ALTER TABLE segments ADD COLUMN size INTEGER')  # NULL: unknown, not appended to again
+        self.db.commit()
+
+    def current_segment(self):
+        """
+        Returns:
+            segment (Tuple): Name, opening time and uncompressed size of the segment to append to, a new one if the
+                last one is full, too old, or was left with a partial append by a crash.
+        """
+        row = self.db.execute('''SELECT name, opened, bytes, size FROM segments
+                                 ORDER BY opened DESC, name DESC LIMIT 1''').fetchone()
+        now = time.time()
+        if row and row[2] < self.max_bytes and (self.max_age is None or now - row[1] < self.max_age) and \
+                row[3] == self.disk_size(row[0]):
+            return row[:3]
+        name = "{}{}-{:04d}{}".format(self.SEGMENT_PREFIX, datetime.datetime.now().strftime('%Y%m%d-%H%M%S'),
+                                      self.db.execute('SELECT COUNT(*) FROM segments').fetchone()[0],
+                                      self.SEGMENT_SUFFIX)
+        self.db.execute('INSERT INTO segments(name, opened, bytes, stories) VALUES(?,?,0,0)', (name, now))
+        self.db.commit()
+        return name, now, 0
+
+    def append(self, stories):
+        """
+        Args:
+            stories: Iterable of Stories object, written to the current segment as one gzip member.
+        Returns:
+            n (int): Number of stories written.
+        """
+        lines, rows = [], []
+        for story in stories:
+            d = story.to_dict()
+            lines.append(json.dumps(d) + "\n")
+            rows.append((str(d['media_id']), str(d['user_id']), d['timestamp']))
+        if not lines: return 0
+
+        name, _, size = self.current_segment()
+        data = "".join(lines).encode("utf-8")
+        with open(os.path.join(self.directory, name), "ab") as f:
+            f.write(gzip.compress(data, self.compresslevel))
+            f.flush()
+            os.fsync(f.fileno())
+            disk_size = f.tell()
+
+        timestamps = [timestamp for _, _, timestamp in rows]
+        with self.db:
+            self.db.executemany('INSERT INTO stories(media_id, user_id, timestamp, segment) VALUES(?,?,?,?)',
+                                [row + (name,) for row in rows])
+            self.db.execute('''
+                UPDATE segments SET bytes = bytes + ?, stories = stories + ?, size = ?,
+                    min_timestamp = MIN(COALESCE(min_timestamp, ?), ?), max_timestamp = MAX(COALESCE(max_timestamp, ?), ?)
+                WHERE name = ?''', (len(data), len(rows), disk_size, min(timestamps), min(timestamps), max(timestamps),
+                                    max(timestamps), name))
+        return len(rows)
+
+    def segments(self, media_id=None, user_id=None, since=None, until=None):
+        """
+        Args:
+            media_id (str): Only the segments holding this story.
+            user_id (str): Only the segments holding stories of this user.
+            since (str or datetime): Only the segments holding stories taken at or after this time.
+            until (str or datetime): Only the segments holding stories taken at or before this time.
+        Returns:
+            names (List): Names of the segments that can hold matching stories, oldest first.
+        """
+        since, until = self.timestamp(since), self.timestamp(until)
+        if media_id is None and user_id is None:  # Ranges of the segments are enough
+            query, params = 'SELECT name FROM segments WHERE 1', []
+            if since is not None:
+                query, params = query + ' AND max_timestamp >= ?', params + [since]
+            if until is not None:
+                query, params = query + ' AND min_timestamp <= ?', params + [until]
+        else:
+            query, params = 'SELECT DISTINCT segment FROM stories WHERE 1', []
+            for column, value in (('media_id', media_id), ('user_id', user_id)):
+                if value is not None:
+                    query, params = query + ' AND {} = ?'.format(column), params + [str(value)]
+            if since is not None:
+                query, params = query + ' AND timestamp >= ?', params + [since]
+            if until is not None:
+                query, params = query + ' AND timestamp <= ?', params + [until]
+            query = 'SELECT name FROM segments WHERE name IN ({})'.format(query)
+        return [name for name, in self.db.execute(query + ' ORDER BY opened, name', params)]
+
+    def iter_stories(self, media_id=None, user_id=None, since=None, until=None):
+        """
+        Stream the archived Stories, one segment and one line at a time.
+        Args:
+            media_id, user_id, since, until: Filters, see segments.
+        Yields:
+            story (Stories): Each matching story, oldest segment first.
+        """
+        since, until = self.timestamp(since), self.timestamp(until)
+        for name in self.segments(media_id, user_id, since, until):
+            for d in self.read_segment(name):
+                if media_id is not None and str(d['media_id']) != str(media_id): continue
+                if user_id is not None and str(d['user_id']) != str(user_id): continue
+                if since is not None and d['timestamp'] < since: continue
+                if until is not None and d['timestamp'] > until: continue
+                yield Stories.from_dict(d)
+
+    def read_segment(self, name):
+        """
+        Yields:
+            d (dict): Each story of the segment, as saved. A truncated last append, left by a crash, is skipped.
+        """
+        with gzip.open(os.path.join(self.directory, name), "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    yield json.loads(line)
+            except (EOFError, gzip.BadGzipFile, zlib.error, ValueError):
+                return
+
+    def disk_size(self, name):
+        """ Size of a segment file, 0 if it was not written yet """
+        path = os.path.join(self.directory, name)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    @staticmethod
+    def timestamp(value):
+        """ Stories timestamps are '%Y-%m-%d %H:%M:%S' strings, so they compare as strings """
+        if isinstance(value, datetime.datetime): return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]  # The modules, and the stand-in server of the benchmarks
+
+from replay_server import ReplayServer
+
+
+@pytest.fixture
+def server():
+    """ Stand-in for the Wikidata and Instagram APIs, without latency, counting the requests per endpoint """
+    server = ReplayServer().start()
+    yield server
+    server.stop()
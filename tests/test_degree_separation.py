@@ -0,0 +1,30 @@
+import contextlib
+import io
+import sqlite3
+
+from instagram_stories import InstagramStories
+from request_scheduler import RequestScheduler, TokenBucket
+
+
+def instagram(server, path):
+    ig = InstagramStories(RequestScheduler(max_retries=1, backoff=0.01, policy=TokenBucket(rate=1000)))
+    ig.base_url, ig.cookie, ig.DELAY_REQUESTS = server.url, {}, False
+    ig.degree_path = path
+    return ig
+
+
+def test_throttled_users_stay_in_frontier(server, tmp_path):
+    path = str(tmp_path / "degree.db")
+    ig = instagram(server, path)
+    server.reset(throttle_rate=1.0, retry_after=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert ig.degree_separation(0, ["1", "2", "3"]) == 0
+    assert server.statuses[429] == 6
+    db = sqlite3.connect(path)
+    assert db.execute('SELECT COUNT(*) FROM crawl WHERE last_fetched IS NOT NULL').fetchone()[0] == 0
+
+    server.reset(throttle_rate=0.0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert ig.degree_separation(1, []) == 3
+    assert db.execute('SELECT COUNT(*) FROM crawl WHERE last_fetched IS NOT NULL').fetchone()[0] == 3
+    ig.close()
@@ -0,0 +1,22 @@
+import contextlib
+import io
+
+from instagram_stories import InstagramStories
+from request_scheduler import RequestScheduler, TokenBucket
+
+
+def test_failed_locations_are_skipped(server, tmp_path):
+    ig = InstagramStories(RequestScheduler(max_retries=0, policy=TokenBucket(rate=1000)))
+    ig.base_url, ig.cookie, ig.DELAY_REQUESTS = server.url, {}, False
+    ig.db_path = str(tmp_path / "locations.db")
+    locations = [(idx, "location {}".format(idx)) for idx in range(1, 21)]
+    server.reset(error_rate=0.5)  # Answered with an HTML error page
+    with contextlib.redirect_stdout(io.StringIO()):
+        found = {location for location, _ in ig.iter_location_stories(locations)}
+    assert server.statuses[500] and len(found) == server.statuses[200]
+
+    server.reset(error_rate=0.0, failing=("instagram_location_feed",))
+    with contextlib.redirect_stdout(io.StringIO()):
+        ig.location_people(locations)  # Completes, with no sighting
+    assert not ig.sighting_store().db.execute('SELECT COUNT(*) FROM sightings').fetchone()[0]
+    ig.close()
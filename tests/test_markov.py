@@ -0,0 +1,33 @@
+import pytest
+
+from markov import MarkovPy
+from markov_orders import synthetic_corpus
+
+
+@pytest.mark.parametrize("order", [1, 3])
+def test_train_parallel_is_sequential_training(tmp_path, order):
+    path = str(tmp_path / "corpus.txt")
+    with open(path, "w") as f:
+        f.writelines(synthetic_corpus(20000))
+    with open(path) as f:
+        expected = MarkovPy(f, order=order, compact=True).transitions
+    table = MarkovPy.train_parallel(path, order=order, processes=3).transitions
+    expected.compile()
+    table.compile()
+    assert table.vocab == expected.vocab and table.start_weights == expected.start_weights
+    assert table.levels == expected.levels
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_words_split_across_chunks(compact):
+    model = MarkovPy(compact=compact)
+    model.morewords(iter(["Hel", "lo wor", "ld. It's", " ", "o", "k"]))
+    words = list(model.words) if not compact else [model.transitions.vocab[idd] for idd in model.words]
+    assert words == ["hello", "world", ".", "it's", "ok"]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_iter_generate_counts_words(compact):
+    model = MarkovPy("the stage is set . the play begins", compact=compact)
+    assert list(model.iter_generate(0)) == [] and list(model.iter_generate(-2)) == []
+    assert len(list(model.iter_generate(5))) == 5
@@ -0,0 +1,80 @@
+import os
+
+from instagram_stories import Stories
+from media_downloader import MediaDownloader
+
+
+def media(server, users=2, size=50000, **options):
+    """ Stories of the stand-in server whose media are served by it, the same recorded story being a repost """
+    server.reset(media_size=size, **options)
+    return [Stories(element) for user in range(1, users + 1) for element in server.scale_stories(user)]
+
+
+def content(server, story):
+    return server.media_content(story.url.rsplit("/", 1)[1].split(".")[0])
+
+
+def check(downloader, server, stories):
+    for story in stories:
+        with open(downloader.path(story.media_id), "rb") as f:
+            assert f.read() == content(server, story)
+
+
+def test_compressed_media_are_stored_as_served(server, tmp_path):
+    stories = media(server, gzip_media=True)
+    downloader = MediaDownloader(str(tmp_path), max_attempts=1)  # Complete at the first response
+    stats = downloader.download(stories)
+    assert stats["failed"] == 0 and server.counts["media"] == stats["downloaded"] + stats["duplicates"]
+    check(downloader, server, stories)
+    downloader.close()
+
+
+def objects(directory):
+    return sum(len(files) for _, _, files in os.walk(os.path.join(directory, "objects")))
+
+
+def test_cut_connections_are_resumed(server, tmp_path):
+    stories = media(server, truncate_rate=0.5)
+    downloader = MediaDownloader(str(tmp_path), max_attempts=30)
+    stats = downloader.download(stories)
+    assert stats["failed"] == 0 and server.statuses[206] > 0  # Range requests after the cuts
+    check(downloader, server, stories)
+    downloader.close()
+
+
+def test_partial_files_of_an_earlier_run_are_resumed(server, tmp_path):
+    stories = media(server)
+    os.makedirs(str(tmp_path / "partial"))
+    for story in stories[:2]:
+        with open(str(tmp_path / "partial" / (str(story.media_id) + ".part")), "wb") as f:
+            f.write(content(server, story)[:20000])
+    downloader = MediaDownloader(str(tmp_path))
+    assert downloader.download(stories)["failed"] == 0
+    assert server.statuses[206] == 2 and server.statuses[200] == len(stories) - 2
+    check(downloader, server, stories)
+    assert not os.listdir(str(tmp_path / "partial"))
+    downloader.close()
+
+
+def test_reposts_are_stored_once(server, tmp_path):
+    stories = media(server, users=3)
+    downloader = MediaDownloader(str(tmp_path))
+    stats = downloader.download(stories)
+    distinct = len(server.reel["items"])
+    assert stats["downloaded"] == objects(str(tmp_path)) == distinct
+    assert stats["duplicates"] == len(stories) - distinct
+    check(downloader, server, stories)
+    downloader.close()
+
+
+def test_second_run_is_answered_from_the_manifest(server, tmp_path):
+    stories = media(server)
+    first = MediaDownloader(str(tmp_path))
+    first.download(stories)
+    first.close()
+    server.reset()
+    downloader = MediaDownloader(str(tmp_path))
+    stats = downloader.download(stories)
+    assert stats["known"] == len(stories) and stats["downloaded"] == 0 and not server.counts["media"]
+    check(downloader, server, stories)
+    downloader.close()
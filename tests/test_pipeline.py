@@ -0,0 +1,25 @@
+import threading
+
+from pipeline import WriterThread
+
+
+def test_queue_is_bounded_by_records():
+    writer = WriterThread(max_queue=100, batch_size=10)
+    writer.start()
+    release, written = threading.Event(), []
+    writer.register('slow', lambda records: release.wait() and written.extend(records))
+
+    def produce():
+        for start in range(0, 1000, 50):
+            writer.put_many('slow', list(range(start, start + 50)))
+    producer = threading.Thread(target=produce)
+    producer.start()
+    producer.join(0.5)
+    assert producer.is_alive()  # Blocked, although only a few messages are queued
+    assert writer.stats()["queue_depth"] <= 100
+
+    release.set()
+    producer.join()
+    writer.close()
+    assert written == list(range(1000))
+    assert writer.stats()["max_queue_depth"] <= 100 and writer.stats()["blocked_puts"] > 0
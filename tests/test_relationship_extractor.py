@@ -0,0 +1,59 @@
+import math
+
+import pytest
+import requests
+
+from relationship_extractor import RelationshipExtractor
+
+
+def label_ids(server):
+    """ Properties and entity values of the entity served, labelled by get_propvalues """
+    ids = list(server.entity["claims"])
+    for claims in server.entity["claims"].values():
+        for claim in claims:
+            snak = claim["mainsnak"]
+            if snak["snaktype"] == "value" and snak["datavalue"]["type"] == "wikibase-entityid":
+                ids.append(RelationshipExtractor.entity_id(snak["datavalue"]["value"]))
+    return list(dict.fromkeys(ids))
+
+
+def test_labels_are_batched(server):
+    extractor = RelationshipExtractor(server.url)
+    prop_d = extractor.get_propvalues("Q1")
+    assert len(prop_d) == len(server.entity["claims"])
+    assert server.counts["wikidata_entity"] == 1
+    assert server.counts["wikidata_labels"] == math.ceil(len(label_ids(server)) / RelationshipExtractor.LABELS_BATCH)
+
+    assert extractor.get_propvalues("Q1") is prop_d  # Cached, no request
+    assert sum(server.counts.values()) == 1 + server.counts["wikidata_labels"]
+
+
+def test_failed_labels_are_not_cached(server):
+    extractor = RelationshipExtractor(server.url)
+    server.reset(failing=("wikidata_labels",))
+    with pytest.raises(requests.HTTPError):
+        extractor.get_propvalues("Q1")
+    assert "Q1" not in extractor.cache and not extractor.inflight
+
+    server.reset(failing=())
+    prop_d = extractor.get_propvalues("Q1")
+    assert "" not in prop_d and len(prop_d) == len(server.entity["claims"])
+
+
+def test_extract_many_reports_failed_labels(server):
+    extractor = RelationshipExtractor(server.url)
+    server.reset(failing=("wikidata_labels",))
+    results = list(extractor.extract_many([("item {}".format(idx), "politician") for idx in range(1, 5)]))
+    assert len(results) == 4 and all(isinstance(error, requests.HTTPError) for _, _, error in results)
+    assert not extractor.cache
+
+
+def test_entities_are_bounded(server):
+    extractor = RelationshipExtractor(server.url)
+    extractor.ENTITIES = 2
+    first = extractor.get_propvalues("Q1")
+    extractor.get_propvalues("Q2")
+    assert extractor.get_propvalues("Q1") is first  # Now the most recently used
+    extractor.get_propvalues("Q3")
+    assert list(extractor.cache) == ["Q1", "Q3"]
+    assert server.counts["wikidata_entity"] == 3
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from request_scheduler import RequestScheduler, TokenBucket
+
+
+def test_retry_after_429(server):
+    server.reset(throttle_rate=1.0, retry_after=1)
+    scheduler = RequestScheduler(max_retries=2, backoff=100)  # The Retry-After header is waited, not the backoff
+    start = time.monotonic()
+    r = scheduler.get(server.url + "api/v1/feed/user/1/reel_media/", throttle=False)
+    assert r.status_code == 429 and server.statuses[429] == 3  # The last answer after max_retries retries
+    assert 2 <= time.monotonic() - start < 10
+
+
+def test_retries_until_success(server):
+    server.reset(throttle_rate=0.3, error_rate=0.1, retry_after=0)
+    scheduler = RequestScheduler(concurrency=4, max_retries=10, backoff=0.01, policy=TokenBucket(rate=1000, burst=4))
+    urls = [server.url + "api/v1/feed/user/{}/reel_media/".format(idx) for idx in range(1, 31)]
+    responses = list(scheduler.map(lambda url: scheduler.get(url).json(), urls))
+    assert [d["id"] for d in responses] == list(range(1, 31))  # In order, all successful
+    assert server.statuses[429] and server.statuses[500] and server.statuses[200] == 30
+
+
+def test_bounded_concurrency(server):
+    server.reset(latency=0.05)
+    scheduler = RequestScheduler(concurrency=3, policy=TokenBucket(rate=1000, burst=3))
+    lock, running, peak = threading.Lock(), [0], [0]
+
+    def fetch(idx):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        try:
+            return scheduler.get(server.url + "api/v1/feed/user/{}/reel_media/".format(idx)).json()["id"]
+        finally:
+            with lock:
+                running[0] -= 1
+
+    assert list(scheduler.map(fetch, range(1, 13))) == list(range(1, 13))
+    assert peak[0] == 3
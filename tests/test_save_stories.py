@@ -0,0 +1,27 @@
+import json
+import os
+
+import pytest
+
+from instagram_stories import InstagramStories
+from test_story_archive import stories
+
+
+def test_interrupted_save_leaves_readable_files(tmp_path):
+    ig = InstagramStories()
+    ig.db_seen, ig.basefolder = str(tmp_path / "seen.db"), str(tmp_path)
+
+    def fetched():
+        yield from stories(1) + stories(2)
+        raise KeyboardInterrupt  # Killed while fetching the next ones
+    with pytest.raises(KeyboardInterrupt):
+        ig.save_stories(fetched(), batch_size=10)
+    ig.save_stories(stories(2) + stories(3), batch_size=10)
+    ig.close()
+
+    saved = []
+    for name in sorted(os.listdir(str(tmp_path))):
+        if name.endswith(".json"):
+            with open(str(tmp_path / name)) as f:
+                saved.extend(d['user_id'] for d in json.load(f))
+    assert sorted(saved) == [1] * 10 + [2] * 10 + [3] * 10
@@ -0,0 +1,49 @@
+import gzip
+import os
+
+import pytest
+
+from instagram_stories import InstagramStories, Stories
+from replay_server import load_fixture, scale_stories
+from story_archive import StoryArchive
+
+
+def stories(owner, n=10):
+    return [Stories(item) for item in scale_stories(load_fixture("instagram_reel_media")["items"], n, owner)]
+
+
+def test_crash_during_append(tmp_path):
+    archive = StoryArchive(str(tmp_path))
+    assert archive.append(stories(1)) == 10
+    name = archive.segments()[0]
+    member = gzip.compress(b"".join(b'{"media_id": "lost"}\n' for _ in range(100)))
+    with open(os.path.join(str(tmp_path), name), "ab") as f:  # Crash halfway through the next append
+        f.write(member[:len(member) // 2])
+    archive.close()
+
+    archive = StoryArchive(str(tmp_path))
+    assert archive.append(stories(2)) == 10
+    assert len(archive.segments()) == 2  # The damaged segment is not appended to
+    assert sorted(story.user_id for story in archive.iter_stories()) == [1] * 10 + [2] * 10
+    archive.close()
+
+
+def test_failed_append_is_saved_again(tmp_path, monkeypatch):
+    ig = InstagramStories()
+    ig.db_seen = str(tmp_path / "seen.db")
+    ig.archive = StoryArchive(str(tmp_path / "archive"))
+    append = ig.archive.append
+
+    def crash(batch):
+        raise OSError("disk full")
+    monkeypatch.setattr(ig.archive, "append", crash)
+    with pytest.raises(RuntimeError):
+        ig.save_stories(stories(1))
+    assert ig.seen_index().unseen(str(story.media_id) for story in stories(1)) == \
+        {str(story.media_id) for story in stories(1)}  # Not marked as seen
+
+    monkeypatch.setattr(ig.archive, "append", append)
+    ig.save_stories(stories(1))
+    assert len(list(ig.archive.iter_stories())) == 10
+    ig.close()
+    ig.archive.close()
@@ -0,0 +1,149 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class WikidataCache:
+    """
+    Persistent cache of Wikidata lookups (search results, entity claims, labels...) shared by processes.
+    Values are JSON-encoded in a SQLite database in WAL mode, so many workers can read and write it at once.
+    Entries expire after ttl seconds and the least recently used ones are evicted above max_entries.
+    The namespaces listed in HOT are also kept in a small in-memory LRU in front of the database.
+    """
+    HOT = ('label',)  # Namespaces of small, very frequent lookups (property labels)
+    TOUCH_EVERY = 60  # Seconds between two updates of the access time of an entry
+    CHECK_EVERY = 1000  # Writes between two checks of the number of entries
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=1000000, hot_size=10000):
+        """
+        Args:
+            path (string): Path of the SQLite database, created if needed.
+            ttl (float): Seconds an entry stays valid, None for no expiry.
+            max_entries (int): Number of entries above which the least recently used are evicted.
+            hot_size (int): Number of entries of the in-memory tier.
+        """
+        self.path, self.ttl, self.max_entries, self.hot_size = path, ttl, max_entries, hot_size
+        self.hot = OrderedDict()
+        self.hits, self.misses = defaultdict(int), defaultdict(int)
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS cache(namespace TEXT, key TEXT, value TEXT, created REAL, accessed REAL, PRIMARY KEY (namespace, key))
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed)')
+        self.db.commit()
+
+    def get(self, namespace, key):
+        """
+        Args:
+            namespace (string): Kind of lookup, e.g. 'search', 'entity' or 'label'.
+            key (string): Key of the lookup in its namespace.
+        Returns:
+            value: The cached value, None if it is missing or expired.
+        """
+        return self.get_many(namespace, [key]).get(key)
+
+    def get_many(self, namespace, keys):
+        """
+        Args:
+            namespace (string): Kind of lookup.
+            keys (Iterable): Keys of the lookups.
+        Returns:
+            values (dict): Key -> Value of the keys found in the cache.
+        """
+        keys = list(keys)
+        found, missing = {}, []
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                entry = self.hot.get((namespace, key))
+                if entry is not None and not self._expired(entry[1], now):
+                    self.hot.move_to_end((namespace, key))
+                    found[key] = entry[0]
+                else:
+                    missing.append(key)
+            self.hits[namespace] += len(found)
+
+            touched = []
+            for start in range(0, len(missing), 500):  # Stay below the SQLite limit of parameters
+                batch = missing[start:start + 500]
+                rows = self.db.execute(
+                    'SELECT key, value, created, accessed FROM cache WHERE namespace = ? AND key IN ({})'.format(
+                        ",".join("?" * len(batch))), [namespace] + batch)
+                for key, value, created, accessed in rows:
+                    if self._expired(created, now): continue
+                    found[key] = json.loads(value)
+                    self.hits[namespace] += 1
+                    if namespace in self.HOT: self._remember(namespace, key, found[key], created)
+                    if now - accessed > self.TOUCH_EVERY: touched.append((now, namespace, key))
+            self.misses[namespace] += len(keys) - len(found)
+
+            if touched:  # Approximate LRU: the access time is only refreshed from time to time
+                self.db.executemany('UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?', touched)
+                self.db.commit()
+        return found
+
+    def set(self, namespace, key, value):
+        """
+        Args:
+            namespace (string): Kind of lookup.
+            key (string): Key of the lookup in its namespace.
+            value: JSON-serializable value to store.
+        """
+        self.set_many(namespace, {key: value})
+
+    def set_many(self, namespace, values):
+        """
+        Args:
+            namespace (string): Kind of lookup.
+            values (dict): Key -> Value to store.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO cache(namespace, key, value, created, accessed) VALUES(?,?,?,?,?)',
+                                [(namespace, key, json.dumps(value), now, now) for key, value in values.items()])
+            self.db.commit()
+            if namespace in self.HOT:
+                for key, value in values.items():
+                    self._remember(namespace, key, value, now)
+            self.writes += len(values)
+            if self.writes >= self.CHECK_EVERY:
+                self.writes = 0
+                self._evict(now)
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): Namespace -> (hits, misses) since the cache was opened.
+        """
+        return {namespace: (self.hits[namespace], self.misses[namespace])
+                for namespace in set(self.hits) | set(self.misses)}
+
+    def close(self):
+        self.db.close()
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, namespace, key, value, created):
+        """ Store an entry in the in-memory tier, dropping the least recently used one if it is full """
+        self.hot[(namespace, key)] = (value, created)
+        self.hot.move_to_end((namespace, key))
+        while len(self.hot) > self.hot_size:
+            self.hot.popitem(last=False)
+
+    def _evict(self, now):
+        """ Delete the expired entries, then the least recently used ones above max_entries """
+        if self.ttl is not None:
+            self.db.execute('DELETE FROM cache WHERE created < ?', (now - self.ttl,))
+        extra = self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_entries
+        if extra > 0:
+            self.db.execute('DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY accessed LIMIT ?)',
+                            (extra,))
+        self.db.commit()
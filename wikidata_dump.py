@@ -0,0 +1,171 @@
+import argparse
+import bz2
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+def open_dump(path):
+    """
+    Args:
+        path (string): Path of a Wikidata JSON dump, compressed with bz2 or gzip or not at all.
+    Returns:
+        f: Text stream over the dump, decompressed on the fly.
+    """
+    if path.endswith(".bz2"): return bz2.open(path, "rt", encoding="utf-8")
+    if path.endswith(".gz"): return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def iter_entities(f):
+    """
+    The dump is a JSON array with one entity per line, so it is decoded line by line in constant memory.
+    Args:
+        f: Text stream over a Wikidata JSON dump.
+    Yields:
+        entity (dict): Decoded entity.
+    """
+    for line in f:
+        line = line.strip().rstrip(",")
+        if line in ("", "[", "]"): continue
+        yield json.loads(line)
+
+
+class WikidataDump:
+    """
+    Local on-disk index of a Wikidata JSON dump, answering the lookups of RelationshipExtractor offline:
+    English label or alias -> ID, ID -> label, ID -> claims.
+    Only the main snaks of the claims are kept, compressed, so the index is much smaller than the dump.
+    """
+    SCHEMA = '''
+        CREATE TABLE entities(id TEXT PRIMARY KEY, label TEXT, claims BLOB);
+        CREATE TABLE names(name TEXT, alias INTEGER, sitelinks INTEGER, id TEXT);
+    '''
+
+    def __init__(self, path):
+        """
+        Args:
+            path (string): Path of an index built by WikidataDump.build.
+        """
+        if not os.path.exists(path): raise FileNotFoundError(path)
+        self.path = path
+        self.db = sqlite3.connect("file:{}?mode=ro".format(path), uri=True, check_same_thread=False)
+        self.db.execute('PRAGMA mmap_size=1073741824')
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, dump_path, path, batch=1000, language="en", verbose=False):
+        """
+        Stream a dump into a new index. It is written next to path and moved there once complete.
+        Args:
+            dump_path (string): Path of the Wikidata JSON dump (.json, .json.bz2 or .json.gz).
+            path (string): Path of the index to create, replaced if it exists.
+            batch (int): Number of entities written at once, the only ones held in memory.
+            language (string): Language of the labels and aliases to index.
+            verbose (Bool): Print the progress every 100000 entities.
+        Returns:
+            dump (WikidataDump): The new index.
+        """
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        db = sqlite3.connect(tmp_path)
+        db.execute('PRAGMA journal_mode=OFF')
+        db.execute('PRAGMA synchronous=OFF')
+        db.executescript(cls.SCHEMA)
+
+        entities, names = [], []
+        start = time.time()
+        with open_dump(dump_path) as f:
+            for n, ent in enumerate(iter_entities(f), 1):
+                entities.append(cls._entity_row(ent, language))
+                names.extend(cls._name_rows(ent, language))
+                if len(entities) >= batch:
+                    cls._write(db, entities, names)
+                    entities, names = [], []
+                if verbose and not n % 100000:
+                    print("{} entities\t{:.0f}/s".format(n, n / (time.time() - start)))
+        cls._write(db, entities, names)
+
+        db.execute('CREATE INDEX names_name ON names(name, alias, sitelinks)')  # Faster after the inserts
+        db.commit()
+        db.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    @staticmethod
+    def _entity_row(ent, language):
+        label = ent.get('labels', {}).get(language)
+        claims = {prop_id: [{'mainsnak': claim['mainsnak']} for claim in prop_claims]
+                  for prop_id, prop_claims in ent.get('claims', {}).items()}
+        return (ent['id'], label['value'] if label else "",
+                zlib.compress(json.dumps(claims, separators=(",", ":")).encode("utf-8")))
+
+    @staticmethod
+    def _name_rows(ent, language):
+        sitelinks = len(ent.get('sitelinks', {}))  # Popularity of the entity, to rank homonyms
+        label = ent.get('labels', {}).get(language)
+        names = {label['value'].lower(): 0} if label else {}
+        for alias in ent.get('aliases', {}).get(language, []):
+            names.setdefault(alias['value'].lower(), 1)
+        return [(name, alias, -sitelinks, ent['id']) for name, alias in names.items()]  # Negated: ascending order
+
+    @staticmethod
+    def _write(db, entities, names):
+        db.executemany('INSERT OR REPLACE INTO entities(id, label, claims) VALUES(?,?,?)', entities)
+        db.executemany('INSERT INTO names(name, alias, sitelinks, id) VALUES(?,?,?,?)', names)
+
+    def search(self, keyword):
+        """
+        Args:
+            keyword (string): Label or alias to look for, case insensitive.
+        Returns:
+            idd (string): ID of the best entity, labels before aliases then most sitelinks first. None if not found.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT id FROM names WHERE name = ? ORDER BY alias, sitelinks LIMIT 1',
+                                  (keyword.lower(),)).fetchone()
+        return row[0] if row else None
+
+    def claims(self, idd):
+        """
+        Args:
+            idd (string): Wikidata ID of the item.
+        Returns:
+            claims (dict): Dictionary Prop ID -> Claims of the item, only with their main snak. None if not found.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT claims FROM entities WHERE id = ?', (idd,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def labels(self, ids):
+        """
+        Args:
+            ids (Iterable): Wikidata IDs of the entities.
+        Returns:
+            labels (dict): Dictionary ID -> Label of the entities found, empty string if one has no label.
+        """
+        ids = list(dict.fromkeys(ids))
+        labels = {}
+        with self.lock:
+            for start in range(0, len(ids), 500):  # Stay below the SQLite limit of parameters
+                batch = ids[start:start + 500]
+                labels.update(self.db.execute('SELECT id, label FROM entities WHERE id IN ({})'.format(
+                    ",".join("?" * len(batch))), batch))
+        return labels
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index a Wikidata JSON dump for the offline mode of RelationshipExtractor")
+    parser.add_argument("dump", help="Wikidata JSON dump, e.g. latest-all.json.bz2")
+    parser.add_argument("index", help="Path of the index to create")
+    parser.add_argument("--language", default="en")
+    args = parser.parse_args()
+
+    WikidataDump.build(args.dump, args.index, language=args.language, verbose=True)